@@ -1,14 +1,18 @@
 from fastapi import APIRouter, Depends, Query, FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from services.static.gtfs_data_loader import load_gtfs_data
-from services.static.gtfs_processing import get_routes_list_with_labels, get_stops_list_for_route, get_schedule_data, get_schedule_from_block_id, get_timetable_data, create_csv_with_schedule_numbers, get_schedule_number_from_block_id, get_routes_list_from_block_id, get_stops_list, get_stops_list_with_location, get_shape_list_for_trip_id, get_stops_list_for_trip_with_delay, get_stop_details, get_vehicle_details, get_service_data, get_vehicle_history, get_route_history
+from services.static.gtfs_processing import get_routes_list_with_labels, get_stops_list_for_route, get_stop_patterns_for_route, get_schedule_data, get_schedule_from_block_id, get_timetable_data, get_route_timetables_data, get_schedule_number_from_block_id, get_routes_list_from_block_id, get_stops_list, get_stops_list_with_location, get_shape_list_for_trip_id, get_shape_polyline_for_trip_id, get_stops_list_for_trip_with_delay, get_stop_details, get_vehicle_details, get_service_data, get_vehicle_history, get_route_history
 import pandas as pd
-from services.realtime.realtime_service import get_vehicle_realtime_raw_data, get_vehicle_with_route_name, get_realtime_stop_details, save_vehicle_to_daily_log
+from services.realtime.realtime_service import get_realtime_snapshot, get_vehicle_delta, get_viewport_vehicles, stream_realtime_vehicles, get_vehicle_with_route_name, get_realtime_stop_details, save_vehicle_to_daily_log
+from services.realtime.realtime_parser import vehicle_positions_to_records
 from sqlalchemy.orm import Session
 from database.crud import import_vehicles_from_json  
 from database.session import SessionLocal  
 from fastapi import Request
 from services.static.gtfs_data_loader import gtfs_data_instance
+from services.static.gtfs_tiles import GTFS_TILE_MAX_AGE, TILE_MAX_ZOOM
 
 router = APIRouter()
 
@@ -57,8 +61,7 @@ async def get_stops_list_edp(
 async def get_stops_list_location(
 ):  
     data = get_gtfs_data()
-    stop_list = get_stops_list_with_location(data)
-    return convert_schedule_for_json(stop_list)
+    return get_stops_list_with_location(data)
 
 @router.get("/api/stops")
 async def get_stops(
@@ -68,6 +71,14 @@ async def get_stops(
     stops = get_stops_list_for_route(data, route_number)
     return jsonable_encoder(stops)
 
+@router.get("/api/routes/patterns")
+async def get_route_patterns(
+    route_number: str = Query(...)
+):
+    data = get_gtfs_data()
+    patterns = get_stop_patterns_for_route(data, route_number)
+    return jsonable_encoder(patterns)
+
 @router.get("/api/routes/schedule/plan")
 async def get_schedule_plan(
     route_name: str = Query(...)
@@ -112,11 +123,29 @@ async def get_timetable(
     json_serializable_schedule = convert_schedule_for_json(schedule)
     return json_serializable_schedule 
 
+@router.get("/api/routes/timetables")
+async def get_route_timetables(
+    route_number: str = Query(...),
+    direction: int = Query(...),
+    service_id: str = Query(),
+):
+    data = get_gtfs_data()
+
+    timetables = get_route_timetables_data(data, route_number, direction, service_id)
+    return convert_schedule_for_json(timetables)
+
+def parse_bbox(bbox):
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    return min_lon, min_lat, max_lon, max_lat
+
 @router.get("/api/realtime/")
 async def realtime_data():
     try:
-        vehicle_list_a, vehicle_list_t = get_vehicle_realtime_raw_data()
-        vehicle_list = vehicle_list_a + vehicle_list_t
+        snapshot = await get_realtime_snapshot()
+        vehicle_list = vehicle_positions_to_records(snapshot.positions_a) + vehicle_positions_to_records(snapshot.positions_t)
         if vehicle_list:
             return jsonable_encoder(vehicle_list)
         else:
@@ -126,9 +155,26 @@ async def realtime_data():
         raise HTTPException(status_code=500, detail="Could not fetch or parse real-time data")
 
 @router.get("/api/realtime/vehicles/")
-async def get_vehicle_with_route():
+async def get_vehicle_with_route(
+    since: int = Query(None),
+    bbox: str = Query(None),
+    zoom: int = Query(None, ge=0, le=22),
+):
+    if bbox is not None:
+        bbox = parse_bbox(bbox)
     try:
         data = get_gtfs_data()
+        await get_realtime_snapshot()
+        if bbox is not None or zoom is not None:
+            viewport = get_viewport_vehicles(bbox, zoom)
+            if viewport is None:
+                raise HTTPException(status_code=500, detail="Could not fetch or parse real-time data")
+            return jsonable_encoder(viewport)
+        if since is not None:
+            delta = get_vehicle_delta(since)
+            if delta is None:
+                raise HTTPException(status_code=500, detail="Could not fetch or parse real-time data")
+            return Response(content=delta, media_type="application/json")
         vehicle_list = get_vehicle_with_route_name(data)
         if vehicle_list:
             return jsonable_encoder(vehicle_list)
@@ -138,6 +184,21 @@ async def get_vehicle_with_route():
         print(f"Error fetching vehicle positions: {e}")
         raise HTTPException(status_code=500, detail="Could not fetch or parse real-time data")
 
+@router.get("/api/realtime/stream")
+async def stream_vehicles(
+    route: str = Query(None),
+    vehicle_type: str = Query(None),
+    bbox: str = Query(None),
+):
+    routes = route.split(",") if route else None
+    vehicle_types = vehicle_type.split(",") if vehicle_type else None
+    bbox = parse_bbox(bbox) if bbox else None
+    return StreamingResponse(
+        stream_realtime_vehicles(routes, vehicle_types, bbox),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 def get_db():
     db = SessionLocal()
     try:
@@ -154,12 +215,6 @@ async def import_vehicles(db: Session = Depends(get_db)):
         print(f"Error importing vehicles: {e}")
         raise HTTPException(status_code=500, detail="Błąd podczas importu pojazdów.")
 
-@router.get("/api/create_csv_files/")
-async def get_vehicle_with_route():
-    data = get_gtfs_data()
-    response = create_csv_with_schedule_numbers(data)
-    return response
-
 @router.get("/api/schedule/routes")
 async def get_routes_list(
     block_id: str = Query(...),
@@ -179,7 +234,44 @@ async def get_shape_list(
 ):
     data = get_gtfs_data()
     shape_list = get_shape_list_for_trip_id(data, trip_id, vehicle_type)
-    return convert_schedule_for_json(shape_list)
+    return shape_list
+
+@router.get("/api/trip/shape/polyline")
+async def get_shape_polyline(
+    trip_id: str = Query(...),
+    vehicle_type: str = Query(...),
+    zoom: int = Query(14, ge=0)
+):
+    data = get_gtfs_data()
+    shape_polyline = get_shape_polyline_for_trip_id(data, trip_id, vehicle_type, zoom)
+    if shape_polyline is None:
+        raise HTTPException(status_code=404, detail=f"No shape found for trip {trip_id}")
+    return shape_polyline
+
+@router.get("/tiles/{z}/{x}/{y}")
+async def get_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    v: str = Query(None)
+):
+    if not 0 <= z <= TILE_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    data = get_gtfs_data()
+    etag = f'"{data["version"]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable" if v == data['version'] else f"public, max-age={GTFS_TILE_MAX_AGE}",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    # Rendering a tile is CPU work, so it runs in the thread pool instead of
+    # blocking the event loop; cached tiles return from there right away.
+    tile = await run_in_threadpool(data['tiles'].tile, z, x, y)
+    return Response(content=tile, media_type="application/vnd.mapbox-vector-tile", headers=headers)
 
 @router.get("/api/trip/stops/delay")
 async def get_stops_list_with_delay(
@@ -196,6 +288,7 @@ async def get_stop_details_edp(
     stop_name: str = Query(...),
 ):  
     data = get_gtfs_data()
+    await get_realtime_snapshot()
     stop_details = get_stop_details(data, stop_name)
 
     return stop_details
@@ -205,6 +298,7 @@ async def get_stop_delay_edp(
     schedule_number: str = Query(...),
 ):  
     data = get_gtfs_data()
+    await get_realtime_snapshot()
     stop_details = get_realtime_stop_details(data, schedule_number)
 
     return stop_details
@@ -214,6 +308,7 @@ async def get_vehicle_details_edp(
     vehicle_id: str = Query(...),
 ):  
     data = get_gtfs_data()
+    await get_realtime_snapshot()
     vehicle_details = get_vehicle_details(data, vehicle_id)
 
     return vehicle_details
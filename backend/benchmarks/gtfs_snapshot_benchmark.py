@@ -0,0 +1,78 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.static import gtfs_data_loader, gtfs_snapshot
+
+# Times building the whole model (tables, indexes, tiles) the way a worker
+# does at startup: once from the CSV files and once from the compiled
+# snapshot. It runs on a temporary copy of the feeds in gtfs_data, so the
+# snapshots of the served feeds are left alone.
+REPEAT = 3
+# A worker should be up in under a second when the snapshot is compiled.
+STARTUP_TARGET = 1.0
+
+
+def measure(fn, repeat=REPEAT):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # build_gtfs_data reports the memory usage of every table.
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def copy_feeds(target_path):
+    for vehicle_type in gtfs_data_loader.GTFS_FEEDS:
+        source_folder = os.path.join(gtfs_data_loader.GTFS_DATA_PATH, vehicle_type)
+        target_folder = os.path.join(target_path, vehicle_type)
+        os.makedirs(target_folder)
+        for file_name in gtfs_data_loader.GTFS_FEED_FILES + [gtfs_snapshot.FEED_VERSION_FILE]:
+            if os.path.exists(os.path.join(source_folder, file_name)):
+                shutil.copy(os.path.join(source_folder, file_name), target_folder)
+
+
+def main():
+    missing = [
+        vehicle_type for vehicle_type in gtfs_data_loader.GTFS_FEEDS
+        if not os.path.exists(os.path.join(gtfs_data_loader.GTFS_DATA_PATH, vehicle_type, 'trips.txt'))
+    ]
+    if missing:
+        print(f"No feed for {', '.join(missing)} in {gtfs_data_loader.GTFS_DATA_PATH}, start the server once to download it")
+        return
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        copy_feeds(temp_path)
+        gtfs_data_loader.GTFS_DATA_PATH = temp_path
+
+        gtfs_snapshot.GTFS_SNAPSHOT_ENABLED = False
+        csv_time, csv_data = measure(gtfs_data_loader.build_gtfs_data, repeat=1)
+
+        gtfs_snapshot.GTFS_SNAPSHOT_ENABLED = True
+        compile_time, _ = measure(gtfs_data_loader.build_gtfs_data, repeat=1)
+        snapshot_time, snapshot_data = measure(gtfs_data_loader.build_gtfs_data)
+
+    # The snapshot columns are read-only memory maps; copies compare as arrays.
+    for name, df in csv_data.items():
+        if isinstance(df, pd.DataFrame):
+            pd.testing.assert_frame_equal(snapshot_data[name].copy(), df, check_dtype=False, check_categorical=False, check_index_type=False)
+
+    rows = sum(len(df) for df in csv_data.values() if isinstance(df, pd.DataFrame))
+    print(f"{rows} rows")
+    print(f"CSV: {csv_time * 1000:.0f} ms")
+    print(f"Compiling the snapshot: {compile_time * 1000:.0f} ms")
+    print(f"Snapshot: {snapshot_time * 1000:.0f} ms, {csv_time / snapshot_time:.1f}x faster")
+    print(f"Worker startup target of {STARTUP_TARGET * 1000:.0f} ms {'met' if snapshot_time < STARTUP_TARGET else 'missed'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.static.gtfs_data_loader import load_gtfs_data, gtfs_data_instance
+from services.realtime.realtime_parser import VEHICLE_POSITION_COLUMNS
+from services.realtime.realtime_service import enrich_vehicle_positions
+
+# Roughly the size of the Krakow fleet during the morning peak.
+BUS_VEHICLES = 1100
+TRAM_VEHICLES = 400
+REPEAT = 5
+
+
+def make_positions(trips, count, seed):
+    rng = np.random.default_rng(seed)
+    trip_ids = rng.choice(trips.index.values, size=count, replace=False)
+    return pd.DataFrame({
+        'trip_id': trip_ids,
+        'route_id': '',
+        'direction_id': 0,
+        'license_plate': [f"V{seed}{i:04}" for i in range(count)],
+        'latitude': rng.uniform(49.95, 50.15, count),
+        'longitude': rng.uniform(19.80, 20.15, count),
+        'bearing': rng.uniform(0, 360, count),
+        'stop_id': '',
+        'current_stop_sequence': 1,
+        'timestamp': int(time.time()),
+    }, columns=VEHICLE_POSITION_COLUMNS)
+
+
+def legacy_schedule_number(gtfs_data, block_id, service_id, vehicle_type):
+    # get_schedule_number_from_block_id as it was: a boolean-mask scan of
+    # the whole schedule number table per vehicle.
+    schedule_data = gtfs_data['schedule_num_a'] if vehicle_type == "bus" else gtfs_data['schedule_num_t']
+    filtered_data = schedule_data[(schedule_data['block_id'] == block_id) & (schedule_data['service_id'] == service_id)]
+    if not filtered_data.empty:
+        return filtered_data.iloc[0]['schedule_number']
+
+    return None
+
+
+def legacy_enrich(gtfs_data, positions, vehicle_type):
+    # The per-vehicle lookups get_vehicle_with_route_name used before the
+    # batch enrichment, kept here as the baseline.
+    suffix = 'a' if vehicle_type == 'bus' else 't'
+    trips = gtfs_data[f'trips_{suffix}']
+    routes = gtfs_data[f'routes_{suffix}']
+    if 'route_id' not in routes.index.names:
+        routes = routes.set_index('route_id')
+
+    vehicle_list = []
+    for vehicle in positions.itertuples(index=False):
+        trip_id = vehicle.trip_id
+        if trip_id in trips.index:
+            route_id = trips.loc[trip_id]['route_id']
+            block_id = trips.loc[str(trip_id)]['block_id']
+            service_id = trips.loc[str(trip_id)]['service_id']
+            vehicle_list.append({
+                'vehicle_id': vehicle.license_plate,
+                'schedule_number': legacy_schedule_number(gtfs_data, block_id, service_id, vehicle_type),
+                'route_short_name': routes.loc[route_id]['route_short_name'],
+                'block_id': block_id,
+                'latitude': vehicle.latitude,
+                'longitude': vehicle.longitude,
+                'timestamp': vehicle.timestamp,
+                'stop_id': vehicle.stop_id,
+                'trip_id': trip_id,
+                'route_id': route_id,
+                'trip_headsign': trips.loc[str(trip_id)]['trip_headsign'],
+                'shape_id': trips.loc[str(trip_id)]['shape_id'],
+                'bearing': vehicle.bearing,
+                'type': vehicle_type,
+            })
+    return vehicle_list
+
+
+def measure(fn):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    load_gtfs_data()
+    gtfs_data = gtfs_data_instance.get_data()
+    positions_a = make_positions(gtfs_data['trips_a'], BUS_VEHICLES, 1)
+    positions_t = make_positions(gtfs_data['trips_t'], TRAM_VEHICLES, 2)
+
+    legacy = measure(lambda: legacy_enrich(gtfs_data, positions_a, 'bus') + legacy_enrich(gtfs_data, positions_t, 'tram'))
+    batch = measure(lambda: enrich_vehicle_positions(gtfs_data, positions_a, positions_t))
+
+    print(f"Vehicles per cycle: {BUS_VEHICLES + TRAM_VEHICLES}")
+    print(f"Per-vehicle lookups: {legacy * 1000:.1f} ms")
+    print(f"Batch enrichment:    {batch * 1000:.1f} ms")
+    print(f"Speedup:             {legacy / batch:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.static.gtfs_data_loader import GTFS_DATA_PATH, SCHEDULE_NUMBER_BUILDERS
+
+# Times the schedule number builders on the feeds in gtfs_data. Their output
+# is checked against the original numbering in tests/test_schedule_numbers.py.
+REPEAT = 3
+
+
+def main():
+    for vehicle_type, builder in SCHEDULE_NUMBER_BUILDERS.items():
+        folder_path = os.path.join(GTFS_DATA_PATH, vehicle_type)
+        if not os.path.exists(os.path.join(folder_path, 'trips.txt')):
+            print(f"{vehicle_type}: no feed in {folder_path}, skipped")
+            continue
+
+        routes = pd.read_csv(os.path.join(folder_path, 'routes.txt'))
+        trips = pd.read_csv(os.path.join(folder_path, 'trips.txt'))
+        calendar = pd.read_csv(os.path.join(folder_path, 'calendar.txt'))
+        timings = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            schedule_numbers = builder(routes, trips, calendar)
+            timings.append(time.perf_counter() - started)
+        print(f"{vehicle_type}: {len(schedule_numbers)} schedule numbers in {min(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
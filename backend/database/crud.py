@@ -129,24 +129,21 @@ def log_new_vehicle_to_daily_logs(session, vehicle):
     session.add(daily_log)
     session.commit()
     
-def get_vehicle_ids_with_timestamps_by_schedule_number(session, schedule_number):
-    vehicles = session.query(VehiclesStatus.vehicle_id, VehiclesStatus.last_updated).filter(
-        VehiclesStatus.schedule_number == schedule_number
+def get_vehicle_ids_with_timestamps_by_schedule_numbers(session, schedule_numbers):
+    vehicles = session.query(VehiclesStatus.schedule_number, VehiclesStatus.vehicle_id, VehiclesStatus.last_updated).filter(
+        VehiclesStatus.schedule_number.in_(schedule_numbers)
     ).all()
-    
-    if vehicles:
-        vehicle_data = [
-            {"vehicle_id": vehicle[0], "timestamp": int(vehicle[1].timestamp())}
-            for vehicle in vehicles
-        ]
-        
-        if len(vehicle_data) > 1:
-            vehicle_data.reverse()
-        
-        return vehicle_data
 
-    return []
+    vehicle_data = {}
+    for schedule_number, vehicle_id, last_updated in vehicles:
+        vehicle_data.setdefault(schedule_number, []).append(
+            {"vehicle_id": vehicle_id, "timestamp": int(last_updated.timestamp())}
+        )
+
+    for vehicle_list in vehicle_data.values():
+        vehicle_list.reverse()
 
+    return vehicle_data
 
 
 def get_vehicle_status_by_id(session: Session, vehicle_id: str):
@@ -1,20 +1,43 @@
 import asyncio
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from starlette.middleware.cors import CORSMiddleware
 from api.routes import configure_routes
-from services.realtime.realtime_service import prepare_realtime_data_for_database
-from services.static.gtfs_data_loader import load_gtfs_data
+from services.realtime.realtime_service import realtime_ingestion_worker, dispatch_realtime_snapshots
+from services.static.gtfs_data_loader import load_gtfs_data, gtfs_data_instance, gtfs_request_data
+from services.static.gtfs_updater import GTFS_UPDATE_ENABLED, gtfs_feed_updater
 
 app = FastAPI()
 
+# Feeds are downloaded by one worker only, the one ingesting realtime data.
+gtfs_feed_updater.is_leader = realtime_ingestion_worker.is_leader
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-GTFS-Version"],
 )
 
+# Streams stay open for as long as the client is connected, and a model
+# pinned for one would be kept alive across every hot reload meanwhile.
+# They do not read the static model anyway.
+UNPINNED_PATHS = {"/api/realtime/stream"}
+
+@app.middleware("http")
+async def pin_gtfs_version(request: Request, call_next):
+    # The whole request is served from the model that was active when it
+    # arrived, and the response says which feed version that was.
+    if request.url.path in UNPINNED_PATHS:
+        return await call_next(request)
+    gtfs_data = gtfs_data_instance.get_data()
+    gtfs_request_data.set(gtfs_data)
+    response = await call_next(request)
+    if gtfs_data is not None:
+        response.headers["X-GTFS-Version"] = gtfs_data['version']
+    return response
+
 @app.on_event("startup")
 async def startup_event():
     try:
@@ -22,17 +45,21 @@ async def startup_event():
     except Exception as e:
         print(f"Error loading GTFS data: {e}")
 
-    asyncio.create_task(start_realtime_check()) 
-async def check_for_new_realtime_data():
-    while True:
-        try:
-            prepare_realtime_data_for_database()  
-        except Exception as e:
-            print(f"Error: {e}")
-        await asyncio.sleep(60)
-
-async def start_realtime_check():
-    asyncio.create_task(check_for_new_realtime_data())
+    start_realtime_check()
+    if GTFS_UPDATE_ENABLED:
+        gtfs_feed_updater.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    dispatch_task = getattr(app.state, "realtime_dispatch_task", None)
+    if dispatch_task is not None:
+        dispatch_task.cancel()
+    await asyncio.to_thread(realtime_ingestion_worker.stop)
+    await asyncio.to_thread(gtfs_feed_updater.stop)
+
+def start_realtime_check():
+    realtime_ingestion_worker.start()
+    app.state.realtime_dispatch_task = asyncio.create_task(dispatch_realtime_snapshots())
 
 configure_routes(app)
 
@@ -1,28 +1,116 @@
-import requests
-
-def download_gtfs_realtime_file():
-
-    url_a = 'https://gtfs.ztp.krakow.pl/VehiclePositions_A.pb'
-    local_filename_a = 'services/realtime/realtime_data/vehicle_positions_a.pb'
-    url_t = 'https://gtfs.ztp.krakow.pl/VehiclePositions_T.pb'
-    local_filename_t = 'services/realtime/realtime_data/vehicle_positions_t.pb'
-
-    response_a = requests.get(url_a, stream=True)
-    if response_a.status_code == 200:
-        with open(local_filename_a, 'wb') as f:
-            for chunk in response_a.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        print(f"Downloaded {local_filename_a} successfully.")
-    else:
-        raise Exception(f"Failed to download file {url_a}. Status code: {response_a.status_code}")
-    
-    response_t = requests.get(url_t, stream=True)
-    if response_t.status_code == 200:
-        with open(local_filename_t, 'wb') as f:
-            for chunk in response_t.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        print(f"Downloaded {local_filename_t} successfully.")
-    else:
-        raise Exception(f"Failed to download file {url_t}. Status code: {response_t.status_code}")
+import asyncio
+import os
+import time
+import httpx
+from services.realtime.realtime_parser import read_feed_timestamp
+
+REALTIME_FETCH_TIMEOUT = float(os.getenv("REALTIME_FETCH_TIMEOUT", 10))
+# Debug only: when set, every new payload is also written to this directory.
+REALTIME_ARCHIVE_DIR = os.getenv("REALTIME_ARCHIVE_DIR")
+
+REALTIME_FEEDS = {
+    'bus': ('https://gtfs.ztp.krakow.pl/VehiclePositions_A.pb', 'vehicle_positions_a'),
+    'tram': ('https://gtfs.ztp.krakow.pl/VehiclePositions_T.pb', 'vehicle_positions_t'),
+}
+
+
+class RealtimeFeed:
+    def __init__(self, url, name):
+        self.url = url
+        self.name = name
+        self.etag = None
+        self.last_modified = None
+        self.feed_timestamp = None
+        # Validators of the last download, remembered only once its payload
+        # has been parsed and published. Until then a failed cycle must not
+        # turn the next request into a 304 for data nobody has seen.
+        self.pending = None
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def commit(self):
+        if self.pending is not None:
+            self.etag, self.last_modified, self.feed_timestamp = self.pending
+            self.pending = None
+
+
+class RealtimeFeedFetcher:
+    def __init__(self, feeds=REALTIME_FEEDS, timeout=REALTIME_FETCH_TIMEOUT, archive_dir=REALTIME_ARCHIVE_DIR):
+        self.feeds = {key: RealtimeFeed(url, name) for key, (url, name) in feeds.items()}
+        self.timeout = timeout
+        self.archive_dir = archive_dir
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=len(self.feeds), max_keepalive_connections=len(self.feeds)),
+            )
+        return self._client
+
+    async def fetch_feed(self, feed):
+        # The new payload, or None when the feed has not changed.
+        feed.pending = None
+        response = await self._get_client().get(feed.url, headers=feed.conditional_headers())
+        if response.status_code == 304:
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Failed to download file {feed.url}. Status code: {response.status_code}")
+
+        payload = response.content
+        feed_timestamp = read_feed_timestamp(payload)
+        if feed_timestamp is not None and feed_timestamp == feed.feed_timestamp:
+            return None
+        feed.pending = (
+            response.headers.get('ETag', feed.etag),
+            response.headers.get('Last-Modified', feed.last_modified),
+            feed_timestamp,
+        )
+
+        if self.archive_dir:
+            self.archive_payload(feed, payload, feed_timestamp)
+        return payload
+
+    def archive_payload(self, feed, payload, feed_timestamp):
+        # The pid keeps concurrent workers from writing to the same file.
+        filename = f"{feed.name}_{feed_timestamp or int(time.time())}_{os.getpid()}.pb"
+        try:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(os.path.join(self.archive_dir, filename), 'wb') as f:
+                f.write(payload)
+        except OSError as e:
+            print(f"Failed to archive {feed.url}: {e}")
+
+    async def fetch(self):
+        # {key: payload or None}. A feed that fails to download counts as
+        # unchanged, so the other one is still refreshed.
+        keys = list(self.feeds)
+        results = await asyncio.gather(*(self.fetch_feed(self.feeds[key]) for key in keys), return_exceptions=True)
+        payloads = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                print(f"Error fetching {self.feeds[key].url}: {result}")
+                result = None
+            payloads[key] = result
+        return payloads
+
+    def discard(self, key):
+        self.feeds[key].pending = None
+
+    def commit(self):
+        for feed in self.feeds.values():
+            feed.commit()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+REALTIME_LEADER_LOCK_PATH = os.getenv(
+    "REALTIME_LEADER_LOCK_PATH",
+    os.path.join(tempfile.gettempdir(), "realtime_transit_ingestion.lock"),
+)
+
+
+class IngestionLeaderLock:
+    # Non-blocking exclusive lock on a local file. Only the process holding
+    # it runs realtime ingestion. The operating system releases the lock when
+    # the holder exits or crashes, so another worker picks it up on its next
+    # try_acquire() without any explicit failover step.
+    def __init__(self, path=REALTIME_LEADER_LOCK_PATH):
+        self.path = path
+        self._file = None
+
+    def is_leader(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+
+        lock_file = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+
+        if fcntl is not None:
+            lock_file.truncate(0)
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+        self._file = lock_file
+        print(f"Process {os.getpid()} is now the realtime ingestion leader.")
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        self._file.close()
+        self._file = None
@@ -1,41 +1,117 @@
+import numpy as np
+import pandas as pd
 import services.gtfs_realtime_pb2 as gtfs_realtime_pb2
 
+VEHICLE_POSITION_COLUMNS = [
+    'trip_id', 'route_id', 'direction_id', 'license_plate', 'latitude', 'longitude',
+    'bearing', 'stop_id', 'current_stop_sequence', 'timestamp',
+]
+VEHICLE_POSITION_DTYPES = {
+    'direction_id': np.int8,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'bearing': np.float64,
+    'current_stop_sequence': np.int32,
+    'timestamp': np.int64,
+}
 
-def parse_vehicle_positions(file_path):
 
-    vehicles = []
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def read_feed_timestamp(data):
+    if isinstance(data, bytearray):
+        data = memoryview(data)
+    # FeedMessage.header is field 1, so only the header bytes are decoded
+    # instead of the whole feed.
     try:
-        with open(file_path, 'rb') as f:
-            data = f.read()
+        tag, position = read_varint(data, 0)
+        if tag != (1 << 3 | 2):
+            return None
+        length, position = read_varint(data, position)
+        header = gtfs_realtime_pb2.FeedHeader.FromString(data[position:position + length])
+    except Exception:
+        return None
+    return header.timestamp if header.HasField('timestamp') else None
+
 
+def parse_vehicle_positions(data):
+    # Accepts the payload straight from the network buffer; bytearrays are
+    # wrapped in a memoryview because protobuf does not take them directly.
+    if isinstance(data, bytearray):
+        data = memoryview(data)
+
+    columns = {column: [] for column in VEHICLE_POSITION_COLUMNS}
+    try:
         feed = gtfs_realtime_pb2.FeedMessage()
         feed.ParseFromString(data)
 
+        # One pass over the feed, appending straight into column lists.
+        trip_ids, route_ids, direction_ids = columns['trip_id'], columns['route_id'], columns['direction_id']
+        license_plates, latitudes, longitudes = columns['license_plate'], columns['latitude'], columns['longitude']
+        bearings, stop_ids = columns['bearing'], columns['stop_id']
+        stop_sequences, timestamps = columns['current_stop_sequence'], columns['timestamp']
         for entity in feed.entity:
             if entity.HasField('vehicle'):
                 vehicle = entity.vehicle
-                vehicle_info = {
-                    'trip': {
-                        'trip_id': vehicle.trip.trip_id,
-                        'route_id': vehicle.trip.route_id,
-                        'direction_id': vehicle.trip.direction_id,
-                    },
-                    'vehicle': {
-                        'license_plate': vehicle.vehicle.license_plate
-                    },
-                    'position': {
-                        'latitude': vehicle.position.latitude,
-                        'longitude': vehicle.position.longitude,
-                        'bearing': vehicle.position.bearing,
-                    },
-                    'current_stop_sequence': vehicle.current_stop_sequence,
-                    'stop_id': vehicle.stop_id,
-                    'timestamp': vehicle.timestamp
-                }
-                vehicles.append(vehicle_info)
+                trip = vehicle.trip
+                position = vehicle.position
+                trip_ids.append(trip.trip_id)
+                route_ids.append(trip.route_id)
+                direction_ids.append(trip.direction_id)
+                license_plates.append(vehicle.vehicle.license_plate)
+                latitudes.append(position.latitude)
+                longitudes.append(position.longitude)
+                bearings.append(position.bearing)
+                stop_ids.append(vehicle.stop_id)
+                stop_sequences.append(vehicle.current_stop_sequence)
+                timestamps.append(vehicle.timestamp)
 
     except Exception as e:
-        print(f"Failed to parse {file_path}: {e}")
+        print(f"Failed to parse vehicle positions feed: {e}")
         raise
 
-    return vehicles
+    return pd.DataFrame({
+        column: np.array(values, dtype=VEHICLE_POSITION_DTYPES[column]) if column in VEHICLE_POSITION_DTYPES else values
+        for column, values in columns.items()
+    }, columns=VEHICLE_POSITION_COLUMNS)
+
+
+def empty_vehicle_positions():
+    return pd.DataFrame({
+        column: np.array([], dtype=VEHICLE_POSITION_DTYPES.get(column, object))
+        for column in VEHICLE_POSITION_COLUMNS
+    }, columns=VEHICLE_POSITION_COLUMNS)
+
+
+def vehicle_positions_to_records(positions):
+    return [
+        {
+            'trip': {
+                'trip_id': row.trip_id,
+                'route_id': row.route_id,
+                'direction_id': row.direction_id,
+            },
+            'vehicle': {
+                'license_plate': row.license_plate
+            },
+            'position': {
+                'latitude': row.latitude,
+                'longitude': row.longitude,
+                'bearing': row.bearing,
+            },
+            'current_stop_sequence': row.current_stop_sequence,
+            'stop_id': row.stop_id,
+            'timestamp': row.timestamp
+        }
+        for row in positions.itertuples(index=False)
+    ]
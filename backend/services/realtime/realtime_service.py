@@ -1,6 +1,14 @@
-from services.realtime.realtime_fetcher import download_gtfs_realtime_file
-from services.realtime.realtime_parser import parse_vehicle_positions
+from services.realtime.realtime_fetcher import RealtimeFeedFetcher
+from services.realtime.realtime_parser import empty_vehicle_positions, parse_vehicle_positions
+from services.realtime.realtime_snapshot import RealtimeSnapshotStore
+from services.realtime.realtime_worker import RealtimeIngestionWorker
+from services.realtime.realtime_leader import IngestionLeaderLock
+from services.realtime.realtime_shared import SharedRealtimeState, frame_records
+from services.realtime.realtime_spatial import REALTIME_CLUSTER_MAX_ZOOM
+from services.realtime.realtime_stream import RealtimeBroadcaster, VehicleFilter, encode_vehicle_delta, unique_vehicles
+import asyncio
 from typing import List, Dict
+import pandas as pd
 from database.session import SessionLocal
 from database.crud import update_vehicles_status, log_new_vehicle_to_daily_logs
 from fastapi import Depends
@@ -13,164 +21,280 @@ def get_gtfs_data(request: Request = None):
     gtfs_data = gtfs_data_instance.get_data()
     return gtfs_data
 
-def get_vehicle_realtime_raw_data() -> List[Dict]:
-    try:
-        download_gtfs_realtime_file()
-        
-        vehicle_positions_a = parse_vehicle_positions('services/realtime/realtime_data/vehicle_positions_a.pb')
-        vehicle_positions_t = parse_vehicle_positions('services/realtime/realtime_data/vehicle_positions_t.pb')
-        
-        return vehicle_positions_a, vehicle_positions_t
-    except Exception as e:
-        print(f"Error in get_vehicle_with_route_name: {e}")
-        raise
+realtime_feed_fetcher = RealtimeFeedFetcher()
+realtime_shared_state = SharedRealtimeState()
+
+async def get_vehicle_realtime_raw_data(previous_snapshot=None):
+    # Every feed is handled on its own: one that did not change, failed to
+    # download or failed to parse keeps its previous positions.
+    payloads = await realtime_feed_fetcher.fetch()
+    positions = {}
+    changed = False
+    for key, previous_positions in (('bus', 'positions_a'), ('tram', 'positions_t')):
+        payload = payloads[key]
+        if payload is not None:
+            try:
+                positions[key] = parse_vehicle_positions(payload)
+                changed = True
+                continue
+            except Exception as e:
+                print(f"Error parsing the {key} realtime feed: {e}")
+                realtime_feed_fetcher.discard(key)
+        if previous_snapshot is not None:
+            positions[key] = getattr(previous_snapshot, previous_positions)
+        else:
+            positions[key] = empty_vehicle_positions()
+
+    if not changed:
+        if previous_snapshot is None:
+            raise Exception("No realtime feed could be downloaded")
+        return None
+    return positions['bus'], positions['tram']
 
 
 def get_vehicle_with_route_name(gtfs_data):
-    vehicles_a, vehicles_t = get_vehicle_realtime_raw_data()
-
-    if 'trip_id' not in gtfs_data['trips_a'].index.names:
-        gtfs_data['trips_a'].set_index('trip_id', inplace=True)
-    if 'route_id' not in gtfs_data['routes_a'].index.names:
-        gtfs_data['routes_a'].set_index('route_id', inplace=True)
-    if 'trip_id' not in gtfs_data['trips_t'].index.names:
-        gtfs_data['trips_t'].set_index('trip_id', inplace=True)
-    if 'route_id' not in gtfs_data['routes_t'].index.names:
-        gtfs_data['routes_t'].set_index('route_id', inplace=True)
-
-    vehicle_list = []
-    for vehicle in vehicles_a:
-        trip_id_a = vehicle['trip']['trip_id']
-
-        if trip_id_a in gtfs_data['trips_a'].index:
-            route_id_a = gtfs_data['trips_a'].loc[trip_id_a]['route_id']
-            route_short_name_a = gtfs_data['routes_a'].loc[route_id_a]['route_short_name']
-            trip_headsign_a = gtfs_data['trips_a'].loc[str(trip_id_a)]['trip_headsign']
-            shape_id_a = gtfs_data['trips_a'].loc[str(trip_id_a)]['shape_id']
-            block_id_a = gtfs_data['trips_a'].loc[str(trip_id_a)]['block_id']
-            service_id_a = gtfs_data['trips_a'].loc[str(trip_id_a)]['service_id']
-            schedule_number = get_schedule_number_from_block_id(gtfs_data, block_id_a, service_id_a, "bus")
-
-            
-            vehicle_a = {
-                'vehicle_id': vehicle['vehicle']['license_plate'],
-                'schedule_number': schedule_number,
-                'route_short_name': route_short_name_a,
-                'block_id' : block_id_a,
-                'latitude': vehicle['position']['latitude'],
-                'longitude': vehicle['position']['longitude'],
-                'timestamp': vehicle['timestamp'],
-                'stop_id': vehicle['stop_id'],
-                'trip_id': trip_id_a,
-                'route_id': route_id_a,
-                'trip_headsign': trip_headsign_a,
-                'shape_id': shape_id_a,
-                'bearing': vehicle['position']['bearing'],
-                'type': 'bus'
-            }
-            vehicle_list.append(vehicle_a)
-
-    for vehicle in vehicles_t:
-        trip_id_t = vehicle['trip']['trip_id']
-
-        if trip_id_t in gtfs_data['trips_t'].index:
-            route_id_t = gtfs_data['trips_t'].loc[trip_id_t]['route_id']
-            route_short_name_t = gtfs_data['routes_t'].loc[route_id_t]['route_short_name']
-            trip_headsign_t = gtfs_data['trips_t'].loc[str(trip_id_t)]['trip_headsign']
-            shape_id_t = gtfs_data['trips_t'].loc[str(trip_id_t)]['shape_id']
-            block_id_t = gtfs_data['trips_t'].loc[str(trip_id_t)]['block_id']
-            service_id_t = gtfs_data['trips_t'].loc[str(trip_id_t)]['service_id']
-            schedule_number = get_schedule_number_from_block_id(gtfs_data, block_id_t, service_id_t, "tram")
-            vehicle_t = {
-                'vehicle_id': vehicle['vehicle']['license_plate'],
-                'schedule_number': schedule_number,
-                'route_short_name': route_short_name_t,
-                'block_id' : block_id_t,
-                'latitude': vehicle['position']['latitude'],
-                'longitude': vehicle['position']['longitude'],
-                'timestamp': vehicle['timestamp'],
-                'stop_id': vehicle['stop_id'],
-                'trip_id': trip_id_t,
-                'route_id': route_id_t,
-                'trip_headsign': trip_headsign_t,
-                'shape_id': shape_id_t,
-                'bearing': vehicle['position']['bearing'],
-                'type': 'tram'
-            }
-            vehicle_list.append(vehicle_t)
-    
-    return vehicle_list
+    snapshot = get_current_realtime_snapshot()
+    if snapshot is None:
+        return []
+    return snapshot.vehicle_records()
+
+def get_current_vehicles():
+    snapshot = get_current_realtime_snapshot()
+    if snapshot is None:
+        return pd.DataFrame(columns=ENRICHED_VEHICLE_COLUMNS)
+    return snapshot.vehicles
+
+
+ENRICHED_VEHICLE_COLUMNS = [
+    'vehicle_id', 'schedule_number', 'route_short_name', 'block_id', 'latitude', 'longitude', 'timestamp',
+    'stop_id', 'trip_id', 'route_id', 'trip_headsign', 'shape_id', 'bearing', 'type',
+]
+
+def enrich_positions_for_vehicle_type(gtfs_data, positions, vehicle_type):
+    suffix = 'a' if vehicle_type == 'bus' else 't'
+    trips = gtfs_data[f'trips_{suffix}']
+    routes = gtfs_data[f'routes_{suffix}']
+    schedule_numbers = gtfs_data[f'schedule_num_{suffix}']
+
+    if 'trip_id' not in trips.index.names:
+        trips = trips.set_index('trip_id')
+    if 'route_id' in routes.index.names:
+        route_short_names = routes['route_short_name']
+    else:
+        route_short_names = routes.set_index('route_id')['route_short_name']
+
+    positions = positions[positions['trip_id'].isin(trips.index)]
+    # Plain object columns: the trips columns are categoricals, which the
+    # snapshot diffing and sharing code does not expect.
+    trip_rows = trips.loc[positions['trip_id'].values, ['route_id', 'trip_headsign', 'shape_id', 'block_id', 'service_id']].astype(object)
+
+    schedule_lookup = schedule_numbers.drop_duplicates(['block_id', 'service_id']).set_index(['block_id', 'service_id'])['schedule_number']
+    schedule_keys = pd.MultiIndex.from_arrays([trip_rows['block_id'].values, trip_rows['service_id'].values])
+    schedule_number = schedule_lookup.reindex(schedule_keys)
+
+    return pd.DataFrame({
+        'vehicle_id': positions['license_plate'].values,
+        'schedule_number': schedule_number.astype(object).where(schedule_number.notna(), None).values,
+        'route_short_name': route_short_names.reindex(trip_rows['route_id'].values).values,
+        'block_id': trip_rows['block_id'].values,
+        'latitude': positions['latitude'].values,
+        'longitude': positions['longitude'].values,
+        'timestamp': positions['timestamp'].values,
+        'stop_id': positions['stop_id'].values,
+        'trip_id': positions['trip_id'].values,
+        'route_id': trip_rows['route_id'].values,
+        'trip_headsign': trip_rows['trip_headsign'].values,
+        'shape_id': trip_rows['shape_id'].values,
+        'bearing': positions['bearing'].values,
+        'type': vehicle_type,
+    }, columns=ENRICHED_VEHICLE_COLUMNS)
+
+
+def enrich_vehicle_positions(gtfs_data, positions_a, positions_t):
+    vehicles_a = enrich_positions_for_vehicle_type(gtfs_data, positions_a, 'bus')
+    vehicles_t = enrich_positions_for_vehicle_type(gtfs_data, positions_t, 'tram')
+    return unique_vehicles(pd.concat([vehicles_a, vehicles_t], ignore_index=True))
  
 
+async def build_realtime_snapshot_data(previous_snapshot):
+    raw_data = await get_vehicle_realtime_raw_data(previous_snapshot)
+    if raw_data is None:
+        return None
+    positions_a, positions_t = raw_data
+    gtfs_data = get_gtfs_data()
+    vehicles = enrich_vehicle_positions(gtfs_data, positions_a, positions_t)
+    return positions_a, positions_t, vehicles
+
+def read_shared_realtime_snapshot(previous_snapshot):
+    header = realtime_shared_state.read_header()
+    if header is None:
+        return previous_snapshot
+    generation, version, created_at, refreshed_at = header
+    if previous_snapshot is not None and previous_snapshot.version == version:
+        previous_snapshot.refreshed_at = refreshed_at
+        return previous_snapshot
+
+    frames = realtime_shared_state.read(generation)
+    snapshot = realtime_snapshot_store.publish(
+        frames['positions_a'], frames['positions_t'], frames['vehicles'], version=version, created_at=created_at
+    )
+    snapshot.refreshed_at = refreshed_at
+    snapshot.spatial_index()
+    return snapshot
+
+def publish_shared_realtime_snapshot(snapshot, changed):
+    try:
+        if changed:
+            realtime_shared_state.write(snapshot)
+        else:
+            realtime_shared_state.touch(snapshot)
+    except Exception as e:
+        print(f"Error sharing realtime data: {e}")
+
+async def run_realtime_ingestion_cycle(is_leader=True):
+    previous_snapshot = realtime_snapshot_store.current()
+    if not is_leader:
+        return read_shared_realtime_snapshot(previous_snapshot)
+
+    if previous_snapshot is None:
+        # Continue the version sequence of the previous leader, if any.
+        header = realtime_shared_state.read_header()
+        if header is not None:
+            realtime_snapshot_store.advance_version(header[1])
+
+    snapshot_data = await build_realtime_snapshot_data(previous_snapshot)
+    if snapshot_data is None:
+        if previous_snapshot is not None:
+            previous_snapshot.mark_refreshed()
+            publish_shared_realtime_snapshot(previous_snapshot, changed=False)
+        return previous_snapshot
+
+    snapshot = realtime_snapshot_store.publish(*snapshot_data)
+    snapshot.spatial_index()
+    publish_shared_realtime_snapshot(snapshot, changed=True)
+    realtime_feed_fetcher.commit()
+    try:
+        prepare_realtime_data_for_database(snapshot)
+    except Exception as e:
+        print(f"Error saving realtime data: {e}")
+    return snapshot
+
+realtime_snapshot_store = RealtimeSnapshotStore()
+realtime_ingestion_worker = RealtimeIngestionWorker(
+    run_realtime_ingestion_cycle,
+    close=realtime_feed_fetcher.close,
+    leader_lock=IngestionLeaderLock(),
+)
+realtime_snapshot_store.request_refresh = realtime_ingestion_worker.request_refresh
+realtime_broadcaster = RealtimeBroadcaster()
+
+async def dispatch_realtime_snapshots():
+    loop = asyncio.get_running_loop()
+    while True:
+        snapshot = await loop.run_in_executor(None, realtime_ingestion_worker.next_snapshot, 1.0)
+        if snapshot is not None:
+            realtime_snapshot_store.notify(snapshot)
+            realtime_broadcaster.publish(snapshot)
+
+async def get_realtime_snapshot():
+    return await realtime_snapshot_store.get_snapshot()
+
+def get_current_realtime_snapshot():
+    return realtime_snapshot_store.current()
+
+def get_vehicle_delta(since):
+    # Encoded once per (current snapshot, base version) and shared by every
+    # client asking with the same version. Versions that already left the
+    # history all share the full snapshot response.
+    snapshot = get_current_realtime_snapshot()
+    if snapshot is None:
+        return None
+    previous = realtime_snapshot_store.snapshot_for_version(since)
+    key = previous.version if previous is not None else None
+    delta = snapshot.deltas.get(key)
+    if delta is None:
+        delta = encode_vehicle_delta(previous, snapshot)
+        snapshot.deltas[key] = delta
+    return delta
+
+def get_viewport_vehicles(bbox=None, zoom=None):
+    snapshot = get_current_realtime_snapshot()
+    if snapshot is None:
+        return None
+    index = snapshot.spatial_index()
+    rows = index.query(bbox)
+    clusters = []
+    if zoom is not None and zoom < REALTIME_CLUSTER_MAX_ZOOM:
+        latitudes, longitudes, counts, rows = index.clusters(rows, zoom)
+        clusters = [
+            {'latitude': latitude, 'longitude': longitude, 'count': count}
+            for latitude, longitude, count in zip(latitudes.tolist(), longitudes.tolist(), counts.tolist())
+        ]
+    return {
+        'version': snapshot.version,
+        'vehicles': frame_records(snapshot.vehicles.iloc[rows]),
+        'clusters': clusters,
+    }
+
+def stream_realtime_vehicles(routes=None, vehicle_types=None, bbox=None):
+    return realtime_broadcaster.stream(VehicleFilter(routes, vehicle_types, bbox))
+
 def get_routes_list(gtfs_data, trip_id, vehicle_type):
     parts = trip_id.split("_")
     block_id = f"block_{parts[1]}".strip()
     routes_list = get_routes_list_from_block_id(gtfs_data, vehicle_type, block_id)
     return routes_list
 
-def prepare_realtime_data_for_database():
+def prepare_realtime_data_for_database(snapshot):
     
     print("New realtime data processing started.")
     gtfs_data = get_gtfs_data()
-    vehicles_list = get_vehicle_with_route_name(gtfs_data)
+    vehicles = snapshot.vehicles
     formated_vehicles_list = []
     
-    for vehicle in vehicles_list:
-        if vehicle['vehicle_id'][0]:
-            rotues_list = get_routes_list(gtfs_data, vehicle['trip_id'], vehicle['type'])
-            schedule_number = get_schedule_number_from_trip_id(gtfs_data, vehicle['trip_id'], vehicle['type'])
-            if schedule_number:
-                formated_vehicle = {
-                    'vehicle_id': vehicle['vehicle_id'],
-                    'schedule_number': schedule_number,
-                    'latitude': vehicle['latitude'],
-                    'longitude': vehicle['longitude'], 
-                    'timestamp': vehicle['timestamp'],
-                    'routes_list': rotues_list 
-                }
-                formated_vehicles_list.append(formated_vehicle)
+    for vehicle in vehicles[vehicles['vehicle_id'].str.len() > 0].itertuples(index=False):
+        rotues_list = get_routes_list(gtfs_data, vehicle.trip_id, vehicle.type)
+        schedule_number = get_schedule_number_from_trip_id(gtfs_data, vehicle.trip_id, vehicle.type)
+        if schedule_number:
+            formated_vehicle = {
+                'vehicle_id': vehicle.vehicle_id,
+                'schedule_number': schedule_number,
+                'latitude': vehicle.latitude,
+                'longitude': vehicle.longitude, 
+                'timestamp': vehicle.timestamp,
+                'routes_list': rotues_list 
+            }
+            formated_vehicles_list.append(formated_vehicle)
     
     with SessionLocal() as session:
         update_vehicles_status(session, formated_vehicles_list)
 
 
 def get_realtime_stop_details(gtfs_data, schedule_number_list):
-    vehicles_list = get_vehicle_with_route_name(gtfs_data)
+    if isinstance(schedule_number_list, str):
+        schedule_number_list = [schedule_number_list]
+    vehicles = get_current_vehicles()
     founded_vehicles = []
     
-    for vehicle in vehicles_list:
-        if vehicle["schedule_number"] in schedule_number_list:
-            vehicle_id = vehicle["vehicle_id"]
-            trip_id = vehicle["trip_id"]
-            stop_id = vehicle["stop_id"]
-            vehicle_type = vehicle["type"]
-            timestamp = vehicle["timestamp"]
-            delay = get_stop_delay(gtfs_data, vehicle_type, trip_id, stop_id, timestamp)
-            
-            founded_vehicles.append({
-                'vehicle_id': vehicle_id,
-                'delay': delay,
-                'schedule_number': vehicle["schedule_number"]
-            })
+    for vehicle in vehicles[vehicles['schedule_number'].isin(schedule_number_list)].itertuples(index=False):
+        delay = get_stop_delay(gtfs_data, vehicle.type, vehicle.trip_id, vehicle.stop_id, vehicle.timestamp)
+        
+        founded_vehicles.append({
+            'vehicle_id': vehicle.vehicle_id,
+            'delay': delay,
+            'schedule_number': vehicle.schedule_number
+        })
 
     return founded_vehicles
 
 def get_vehicle_realtime_status(gtfs_data, vehicle_id):
-    vehicles_list = get_vehicle_with_route_name(gtfs_data)
-    for vehicle in vehicles_list:
-        if vehicle['vehicle_id'] == vehicle_id:
-            vehicle_id = vehicle["vehicle_id"]
-            trip_id = vehicle["trip_id"]
-            block_id = vehicle["block_id"]
-            stop_id = vehicle["stop_id"]
-            vehicle_type = vehicle["type"]
-            timestamp = vehicle["timestamp"]
-            latitude = vehicle["latitude"]
-            longitude = vehicle["longitude"]
-            schedule_number = vehicle["schedule_number"]
-            delay = get_stop_delay(gtfs_data, vehicle_type, trip_id, stop_id, timestamp)
-            return trip_id, stop_id, vehicle_type, timestamp, delay, latitude, longitude, schedule_number, block_id
-    return None
+    vehicles = get_current_vehicles()
+    matching_vehicles = vehicles[vehicles['vehicle_id'] == vehicle_id]
+    if matching_vehicles.empty:
+        return None
+    vehicle = frame_records(matching_vehicles.iloc[:1])[0]
+    delay = get_stop_delay(gtfs_data, vehicle['type'], vehicle['trip_id'], vehicle['stop_id'], vehicle['timestamp'])
+    return vehicle['trip_id'], vehicle['stop_id'], vehicle['type'], vehicle['timestamp'], delay, vehicle['latitude'], vehicle['longitude'], vehicle['schedule_number'], vehicle['block_id']
 
 def save_vehicle_to_daily_log(vehicle_id, schedule_number, routes):
     timestamp = int(datetime.now().timestamp())
@@ -0,0 +1,215 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+
+REALTIME_SHARED_DIR = os.getenv(
+    "REALTIME_SHARED_DIR",
+    os.path.join(tempfile.gettempdir(), "realtime_transit_shared"),
+)
+# Older generations are kept around so a reader that is still materializing
+# one of them never sees its file disappear.
+REALTIME_SHARED_KEEP_GENERATIONS = 3
+
+HEADER_MAGIC = b'RTSS'
+HEADER_LAYOUT = 2
+# magic, layout, seq, generation, snapshot version, created_at, refreshed_at
+HEADER = struct.Struct('<4sIQQQdd')
+HEADER_READ_RETRIES = 1000
+SNAPSHOT_FRAMES = ('positions_a', 'positions_t', 'vehicles')
+
+
+def code_dtype(category_count):
+    # The dtype pandas itself uses for the codes of a categorical with that
+    # many categories, so wrapping the mapped codes does not copy them.
+    for dtype in (np.int8, np.int16, np.int32):
+        if category_count < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def encode_column(values):
+    # Strings are stored as codes into a dictionary of their distinct
+    # values, missing ones as -1, so readers get categoricals backed by the
+    # mapped file instead of one Python object per row.
+    if values.dtype != object and not isinstance(values.dtype, pd.CategoricalDtype):
+        return np.ascontiguousarray(values), None
+    codes, categories = pd.factorize(values)
+    return codes.astype(code_dtype(len(categories))), np.asarray(categories, dtype=object).astype(str)
+
+
+def decode_column(buffer, column, length):
+    values = np.frombuffer(buffer, dtype=np.dtype(column['dtype']), count=length, offset=column['offset'])
+    if column['categories_offset'] is None:
+        return values
+    categories = np.frombuffer(
+        buffer, dtype=np.dtype(column['categories_dtype']), count=column['categories_length'], offset=column['categories_offset']
+    )
+    return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(pd.Index(categories, dtype=object)), validate=False)
+
+
+def frame_records(frame):
+    # to_dict(orient='records') with missing strings as None, also for frames
+    # read from the shared state, whose categoricals would give NaN.
+    categorical = [column for column, dtype in frame.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    if categorical:
+        frame = frame.astype({column: object for column in categorical})
+        frame[categorical] = frame[categorical].where(frame[categorical].notna(), None)
+    return frame.to_dict(orient='records')
+
+
+class SharedRealtimeState:
+    # Publishes realtime snapshots from the ingestion leader to the other
+    # workers on the same host. Each generation is written once into its own
+    # immutable columnar file; a small memory-mapped header holds the current
+    # generation behind a sequence counter, so followers poll it without any
+    # system call and only map the data file when the generation changes.
+    def __init__(self, directory=REALTIME_SHARED_DIR):
+        self.directory = directory
+        self.header_path = os.path.join(directory, 'realtime_state')
+        self._header_file = None
+        self._header = None
+        # (generation, frames) of the last generation read, so it is mapped
+        # once. Frames of older generations may still be used by snapshots
+        # kept for delta queries, so their mappings are closed only once
+        # nothing exports them any more.
+        self._current = None
+        self._mappings = {}
+
+    def _data_path(self, generation):
+        return os.path.join(self.directory, f'realtime_snapshot_{generation}.bin')
+
+    def _open_header(self, create=False):
+        if self._header is not None:
+            return self._header
+        if not os.path.exists(self.header_path):
+            if not create:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.header_path, 'ab') as f:
+                if f.tell() < HEADER.size:
+                    f.write(b'\0' * (HEADER.size - f.tell()))
+        self._header_file = open(self.header_path, 'r+b')
+        self._header = mmap.mmap(self._header_file.fileno(), HEADER.size)
+        return self._header
+
+    def read_header(self):
+        header = self._open_header()
+        if header is None:
+            return None
+        # A writer that died halfway leaves an odd sequence behind, so give up
+        # after a bounded number of retries instead of spinning forever.
+        for _ in range(HEADER_READ_RETRIES):
+            magic, layout, seq, generation, version, created_at, refreshed_at = HEADER.unpack_from(header)
+            if magic != HEADER_MAGIC or layout != HEADER_LAYOUT:
+                return None
+            if seq % 2:
+                continue
+            if HEADER.unpack_from(header)[2] == seq:
+                return generation, version, created_at, refreshed_at
+        return None
+
+    def _write_header(self, generation, version, created_at, refreshed_at):
+        header = self._open_header(create=True)
+        seq = HEADER.unpack_from(header)[2] if header[:4] == HEADER_MAGIC else 0
+        seq += 1 if seq % 2 == 0 else 0
+        HEADER.pack_into(header, 0, HEADER_MAGIC, HEADER_LAYOUT, seq, generation, version, created_at, refreshed_at)
+        HEADER.pack_into(header, 0, HEADER_MAGIC, HEADER_LAYOUT, seq + 1, generation, version, created_at, refreshed_at)
+
+    def write(self, snapshot):
+        current = self.read_header()
+        generation = (current[0] if current else 0) + 1
+
+        index = {}
+        blobs = []
+        offset = 0
+        for frame_name in SNAPSHOT_FRAMES:
+            frame = getattr(snapshot, frame_name)
+            columns = []
+            for column in frame.columns:
+                values, categories = encode_column(frame[column].values)
+                entry = {'name': column, 'dtype': values.dtype.str, 'offset': offset, 'categories_offset': None}
+                blobs.append(values.tobytes())
+                offset += -(-values.nbytes // 8) * 8
+                if categories is not None:
+                    entry.update({
+                        'categories_offset': offset,
+                        'categories_dtype': categories.dtype.str,
+                        'categories_length': len(categories),
+                    })
+                    blobs.append(categories.tobytes())
+                    offset += -(-categories.nbytes // 8) * 8
+                columns.append(entry)
+            index[frame_name] = {'length': len(frame), 'columns': columns}
+
+        index_bytes = json.dumps(index).encode()
+        data_start = -(-(8 + len(index_bytes)) // 8) * 8
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._data_path(generation)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(struct.pack('<Q', len(index_bytes)))
+            f.write(index_bytes)
+            f.write(b'\0' * (data_start - 8 - len(index_bytes)))
+            for blob in blobs:
+                f.write(blob)
+                f.write(b'\0' * (-len(blob) % 8))
+        os.replace(path + '.tmp', path)
+
+        self._write_header(generation, snapshot.version, snapshot.created_at, snapshot.refreshed_at)
+        self._remove_old_generations(generation)
+        return generation
+
+    def touch(self, snapshot):
+        current = self.read_header()
+        if current is not None and current[1] == snapshot.version:
+            self._write_header(current[0], snapshot.version, snapshot.created_at, snapshot.refreshed_at)
+
+    def read(self, generation):
+        if self._current is not None and self._current[0] == generation:
+            return self._current[1]
+        self._close_unused_mappings()
+
+        path = self._data_path(generation)
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_length = struct.unpack_from('<Q', buffer)[0]
+        index = json.loads(bytes(buffer[8:8 + index_length]))
+        data_start = -(-(8 + index_length) // 8) * 8
+        data = memoryview(buffer)[data_start:]
+
+        frames = {}
+        for frame_name in SNAPSHOT_FRAMES:
+            frame_index = index[frame_name]
+            length = frame_index['length']
+            frames[frame_name] = pd.DataFrame({
+                column['name']: decode_column(data, column, length)
+                for column in frame_index['columns']
+            }, columns=[column['name'] for column in frame_index['columns']], copy=False)
+        self._mappings[generation] = buffer
+        self._current = (generation, frames)
+        return frames
+
+    def _close_unused_mappings(self):
+        self._current = None
+        for generation, buffer in list(self._mappings.items()):
+            try:
+                buffer.close()
+            except BufferError:
+                continue
+            del self._mappings[generation]
+
+    def _remove_old_generations(self, generation):
+        stale_generation = generation - REALTIME_SHARED_KEEP_GENERATIONS
+        while stale_generation > 0:
+            path = self._data_path(stale_generation)
+            if not os.path.exists(path):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                break
+            stale_generation -= 1
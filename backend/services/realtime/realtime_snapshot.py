@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from collections import deque
+from services.realtime.realtime_shared import frame_records
+from services.realtime.realtime_spatial import VehicleGridIndex
+
+REALTIME_SNAPSHOT_MAX_AGE = float(os.getenv("REALTIME_SNAPSHOT_MAX_AGE", 45))
+REALTIME_REFRESH_INTERVAL = float(os.getenv("REALTIME_REFRESH_INTERVAL", 20))
+REALTIME_REFRESH_TIMEOUT = float(os.getenv("REALTIME_REFRESH_TIMEOUT", 15))
+# Number of recent snapshots kept for delta queries (since=<version>).
+REALTIME_DELTA_HISTORY = int(os.getenv("REALTIME_DELTA_HISTORY", 15))
+
+
+class RealtimeSnapshot:
+    def __init__(self, version, positions_a, positions_t, vehicles, created_at=None):
+        self.version = version
+        self.created_at = created_at if created_at is not None else time.time()
+        self.refreshed_at = self.created_at
+        self.positions_a = positions_a
+        self.positions_t = positions_t
+        self.vehicles = vehicles
+        self._vehicle_records = None
+        self._spatial_index = None
+        self.deltas = {}
+
+    def vehicle_records(self):
+        if self._vehicle_records is None:
+            self._vehicle_records = frame_records(self.vehicles)
+        return self._vehicle_records
+
+    def spatial_index(self):
+        if self._spatial_index is None:
+            self._spatial_index = VehicleGridIndex(self.vehicles)
+        return self._spatial_index
+
+    def age(self):
+        return time.time() - self.refreshed_at
+
+    def mark_refreshed(self):
+        self.refreshed_at = time.time()
+
+    def is_stale(self, max_age):
+        return self.age() > max_age
+
+
+class RealtimeSnapshotStore:
+    # Readers only dereference self._snapshot, so they never take a lock.
+    # Snapshots are produced by the ingestion worker; a reader that finds the
+    # snapshot stale asks the worker for an early cycle and waits for it, so
+    # any number of concurrent stale readers cause a single refresh.
+    def __init__(self, max_age=REALTIME_SNAPSHOT_MAX_AGE, refresh_timeout=REALTIME_REFRESH_TIMEOUT, history_size=REALTIME_DELTA_HISTORY):
+        self.max_age = max_age
+        self.refresh_timeout = refresh_timeout
+        self.request_refresh = None
+        self._snapshot = None
+        self._history = deque(maxlen=history_size)
+        self._version = 0
+        self._refreshed = asyncio.Event()
+
+    def current(self):
+        return self._snapshot
+
+    async def get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.is_stale(self.max_age):
+            await self.wait_for_refresh()
+        return self._snapshot
+
+    async def wait_for_refresh(self):
+        refreshed = self._refreshed
+        if self.request_refresh is not None:
+            self.request_refresh()
+        try:
+            await asyncio.wait_for(refreshed.wait(), self.refresh_timeout)
+        except asyncio.TimeoutError:
+            print("Timed out waiting for realtime data refresh.")
+
+    def publish(self, positions_a, positions_t, vehicles, version=None, created_at=None):
+        # Followers pass the leader's version so every worker on the host
+        # reports the same version for the same data.
+        self._version = version if version is not None else self._version + 1
+        snapshot = RealtimeSnapshot(self._version, positions_a, positions_t, vehicles, created_at)
+        self._history.append(snapshot)
+        self._snapshot = snapshot
+        return snapshot
+
+    def snapshot_for_version(self, version):
+        for snapshot in tuple(self._history):
+            if snapshot.version == version:
+                return snapshot
+        return None
+
+    def advance_version(self, version):
+        self._version = max(self._version, version)
+
+    def notify(self, snapshot):
+        # Called on the API event loop for every finished ingestion cycle.
+        refreshed = self._refreshed
+        self._refreshed = asyncio.Event()
+        refreshed.set()
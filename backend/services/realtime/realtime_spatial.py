@@ -0,0 +1,92 @@
+import os
+import numpy as np
+
+# Grid cell edge in degrees, roughly 1 km around Krakow.
+REALTIME_GRID_CELL_SIZE = float(os.getenv("REALTIME_GRID_CELL_SIZE", 0.01))
+# Below this zoom level viewport queries return clusters.
+REALTIME_CLUSTER_MAX_ZOOM = int(os.getenv("REALTIME_CLUSTER_MAX_ZOOM", 14))
+# Vehicles closer than this many screen pixels are merged into one cluster.
+REALTIME_CLUSTER_RADIUS = int(os.getenv("REALTIME_CLUSTER_RADIUS", 60))
+# min_lon,min_lat,max_lon,max_lat of the area served by the feeds. Vehicles
+# reported outside of it (a GPS fix of 0, 0 and the like) are left out of the
+# grid so they cannot stretch it over half the globe.
+REALTIME_SERVICE_AREA = tuple(float(value) for value in os.getenv("REALTIME_SERVICE_AREA", "19.0,49.5,21.0,50.7").split(","))
+TILE_SIZE = 256
+
+
+class VehicleGridIndex:
+    # Uniform grid over the vehicle positions of one snapshot. Row numbers
+    # are sorted by cell so every grid row of a bounding box is a single
+    # contiguous slice of self.rows.
+    def __init__(self, vehicles, cell_size=REALTIME_GRID_CELL_SIZE, area=REALTIME_SERVICE_AREA):
+        self.cell_size = cell_size
+        self.longitude = vehicles['longitude'].to_numpy(dtype=float)
+        self.latitude = vehicles['latitude'].to_numpy(dtype=float)
+
+        # Without a bounding box every vehicle with a position is returned,
+        # the grid itself only holds the ones inside the service area.
+        self.all_rows = np.flatnonzero(np.isfinite(self.longitude) & np.isfinite(self.latitude))
+        min_lon, min_lat, max_lon, max_lat = area
+        longitude = self.longitude[self.all_rows]
+        latitude = self.latitude[self.all_rows]
+        rows = self.all_rows[(longitude >= min_lon) & (longitude <= max_lon) & (latitude >= min_lat) & (latitude <= max_lat)]
+        if len(rows) == 0:
+            self.rows = rows
+            self.width = self.height = 0
+            return
+
+        cell_x = np.floor(self.longitude[rows] / cell_size).astype(np.int64)
+        cell_y = np.floor(self.latitude[rows] / cell_size).astype(np.int64)
+        self.origin_x = int(cell_x.min())
+        self.origin_y = int(cell_y.min())
+        self.width = int(cell_x.max()) - self.origin_x + 1
+        self.height = int(cell_y.max()) - self.origin_y + 1
+
+        cells = (cell_y - self.origin_y) * self.width + (cell_x - self.origin_x)
+        order = np.argsort(cells, kind='stable')
+        self.rows = rows[order]
+        self.cell_start = np.searchsorted(cells[order], np.arange(self.width * self.height + 1))
+
+    def query(self, bbox=None):
+        if bbox is None:
+            return self.all_rows
+        if self.width == 0:
+            return self.rows
+
+        min_lon, min_lat, max_lon, max_lat = bbox
+        x0 = max(int(np.floor(min_lon / self.cell_size)) - self.origin_x, 0)
+        x1 = min(int(np.floor(max_lon / self.cell_size)) - self.origin_x, self.width - 1)
+        y0 = max(int(np.floor(min_lat / self.cell_size)) - self.origin_y, 0)
+        y1 = min(int(np.floor(max_lat / self.cell_size)) - self.origin_y, self.height - 1)
+        if x0 > x1 or y0 > y1:
+            return self.rows[:0]
+
+        candidates = np.concatenate([
+            self.rows[self.cell_start[y * self.width + x0]:self.cell_start[y * self.width + x1 + 1]]
+            for y in range(y0, y1 + 1)
+        ])
+        longitude = self.longitude[candidates]
+        latitude = self.latitude[candidates]
+        inside = (longitude >= min_lon) & (longitude <= max_lon) & (latitude >= min_lat) & (latitude <= max_lat)
+        return np.sort(candidates[inside])
+
+    def clusters(self, rows, zoom, radius=REALTIME_CLUSTER_RADIUS):
+        # Groups rows on a grid of `radius` pixels at the given zoom level.
+        # Returns (cluster latitudes, longitudes, counts) for the groups with
+        # more than one vehicle and the rows that ended up alone.
+        if len(rows) == 0:
+            return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64), rows
+        cell = 360 / (TILE_SIZE * 2 ** zoom) * radius
+        longitude = self.longitude[rows]
+        latitude = self.latitude[rows]
+        cell_x = np.floor(longitude / cell).astype(np.int64)
+        cell_y = np.floor(latitude / cell).astype(np.int64)
+
+        _, group, counts = np.unique(np.stack([cell_x, cell_y]), axis=1, return_inverse=True, return_counts=True)
+        group = group.reshape(-1)
+        cluster_latitude = np.bincount(group, weights=latitude) / counts
+        cluster_longitude = np.bincount(group, weights=longitude) / counts
+
+        merged = counts > 1
+        single_rows = rows[~merged[group]]
+        return cluster_latitude[merged], cluster_longitude[merged], counts[merged], single_rows
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import numpy as np
+import pandas as pd
+from services.realtime.realtime_shared import frame_records
+
+REALTIME_STREAM_KEEPALIVE = float(os.getenv("REALTIME_STREAM_KEEPALIVE", 15))
+
+# A vehicle is the same vehicle across snapshots when these match; vehicles
+# without a license plate are still told apart by type and trip.
+VEHICLE_KEY_COLUMNS = ['type', 'vehicle_id', 'trip_id']
+# A vehicle is reported as moved when any of these differ from the
+# previous snapshot.
+VEHICLE_CHANGE_COLUMNS = ['latitude', 'longitude', 'bearing', 'trip_id', 'stop_id', 'schedule_number']
+
+
+class VehicleFilter:
+    def __init__(self, routes=None, vehicle_types=None, bbox=None):
+        self.routes = tuple(sorted(routes)) if routes else None
+        self.vehicle_types = tuple(sorted(vehicle_types)) if vehicle_types else None
+        self.bbox = tuple(bbox) if bbox else None
+        self.key = (self.routes, self.vehicle_types, self.bbox)
+
+    def mask(self, vehicles):
+        mask = np.ones(len(vehicles), dtype=bool)
+        if self.routes is not None:
+            mask &= vehicles['route_short_name'].isin(self.routes).values
+        if self.vehicle_types is not None:
+            mask &= vehicles['type'].isin(self.vehicle_types).values
+        if self.bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            longitude = vehicles['longitude'].values
+            latitude = vehicles['latitude'].values
+            mask &= (longitude >= min_lon) & (longitude <= max_lon) & (latitude >= min_lat) & (latitude <= max_lat)
+        return mask
+
+
+def vehicle_keys(vehicles):
+    # Missing key values count as '', so two rows without a license plate on
+    # the same trip are one vehicle.
+    return pd.MultiIndex.from_arrays([
+        pd.Series(np.asarray(vehicles[column].values, dtype=object)).fillna('').astype(str).values
+        for column in VEHICLE_KEY_COLUMNS
+    ])
+
+
+def unique_vehicles(vehicles):
+    # Applied once when a snapshot is built, so the full list, the deltas
+    # and the stream all carry the same vehicles.
+    return vehicles[~vehicle_keys(vehicles).duplicated(keep='last')].reset_index(drop=True)
+
+
+def removed_vehicles(vehicles, mask):
+    return frame_records(vehicles.loc[mask, VEHICLE_KEY_COLUMNS])
+
+
+def comparable_values(values):
+    # Categoricals read from different shared generations have different
+    # categories, so they are compared by value.
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return np.asarray(values, dtype=object)
+    return values
+
+
+def align_vehicles(previous_vehicles, vehicles):
+    # Both frames must be unique on their vehicle keys. Returns, for every current
+    # row, its position in the previous frame (-1 when new), for every
+    # previous row its position in the current frame (-1 when removed), and
+    # which current rows changed since the previous frame.
+    current_ids = vehicle_keys(vehicles)
+    previous_ids = vehicle_keys(previous_vehicles)
+    previous_position = previous_ids.get_indexer(current_ids)
+    current_position = current_ids.get_indexer(previous_ids)
+
+    known = previous_position >= 0
+    changed = np.ones(len(current_ids), dtype=bool)
+    previous_rows = previous_vehicles.iloc[previous_position[known]]
+    current_rows = vehicles.loc[known]
+    unchanged = np.ones(int(known.sum()), dtype=bool)
+    for column in VEHICLE_CHANGE_COLUMNS:
+        current_values = comparable_values(current_rows[column].values)
+        previous_values = comparable_values(previous_rows[column].values)
+        unchanged &= (current_values == previous_values) | (pd.isna(current_values) & pd.isna(previous_values))
+    changed[known] = ~unchanged
+    return previous_position, current_position, changed
+
+
+def encode_vehicle_delta(previous, snapshot):
+    vehicles = snapshot.vehicles
+    if previous is None:
+        return json.dumps({
+            'version': snapshot.version,
+            'full': True,
+            'vehicles': frame_records(vehicles),
+            'removed': [],
+        }, default=str).encode()
+
+    previous_vehicles = previous.vehicles
+    previous_position, current_position, changed = align_vehicles(previous_vehicles, vehicles)
+    return json.dumps({
+        'version': snapshot.version,
+        'since': previous.version,
+        'full': False,
+        'vehicles': frame_records(vehicles[changed]),
+        'removed': removed_vehicles(previous_vehicles, current_position < 0),
+    }, default=str).encode()
+
+
+def encode_event(event, version, payload):
+    return b'event: ' + event + b'\nid: ' + str(version).encode() + b'\ndata: ' + payload + b'\n\n'
+
+
+def join_records(records, mask):
+    return b'[' + b','.join([records[i] for i in np.flatnonzero(mask)]) + b']'
+
+
+class RealtimeUpdate:
+    # Everything a stream client needs for one ingestion cycle. The diff
+    # against the previous cycle is aligned once, every vehicle is encoded
+    # to JSON once, and each distinct filter's event is built once and then
+    # shared by every client subscribed with that filter.
+    def __init__(self, snapshot, previous=None):
+        self.version = snapshot.version
+        self.previous_version = previous.version if previous is not None else None
+        self.vehicles = snapshot.vehicles
+        self.previous_vehicles = previous.vehicles if previous is not None else None
+        self._records = None
+        self._alignment = None
+        self._events = {}
+
+    def records(self):
+        if self._records is None:
+            self._records = [
+                json.dumps(record, ensure_ascii=False, default=str).encode()
+                for record in frame_records(self.vehicles)
+            ]
+        return self._records
+
+    def alignment(self):
+        if self._alignment is None:
+            self._alignment = align_vehicles(self.previous_vehicles, self.vehicles)
+        return self._alignment
+
+    def snapshot_event(self, vehicle_filter):
+        key = ('snapshot', vehicle_filter.key)
+        if key not in self._events:
+            payload = b'{"version":' + str(self.version).encode() + b',"vehicles":' + \
+                join_records(self.records(), vehicle_filter.mask(self.vehicles)) + b'}'
+            self._events[key] = encode_event(b'snapshot', self.version, payload)
+        return self._events[key]
+
+    def diff_event(self, vehicle_filter):
+        key = ('diff', vehicle_filter.key)
+        if key not in self._events:
+            previous_position, current_position, changed = self.alignment()
+            current_mask = vehicle_filter.mask(self.vehicles)
+            previous_mask = vehicle_filter.mask(self.previous_vehicles)
+
+            was_visible = np.where(previous_position >= 0, previous_mask[previous_position], False)
+            still_visible = np.where(current_position >= 0, current_mask[current_position], False)
+            added = current_mask & ~was_visible
+            moved = current_mask & was_visible & changed
+            removed = removed_vehicles(self.previous_vehicles, previous_mask & ~still_visible)
+
+            records = self.records()
+            payload = b'{"version":' + str(self.version).encode() + \
+                b',"previous_version":' + str(self.previous_version).encode() + \
+                b',"added":' + join_records(records, added) + \
+                b',"moved":' + join_records(records, moved) + \
+                b',"removed":' + json.dumps(removed, ensure_ascii=False, default=str).encode() + b'}'
+            self._events[key] = encode_event(b'diff', self.version, payload)
+        return self._events[key]
+
+    def event_for(self, vehicle_filter, client_version):
+        if client_version is not None and client_version == self.previous_version:
+            return self.diff_event(vehicle_filter)
+        return self.snapshot_event(vehicle_filter)
+
+
+class RealtimeBroadcaster:
+    # Fans every new snapshot out to the stream clients of this worker.
+    # publish() is O(1): it stores the update and wakes the waiting clients,
+    # which then pull the event for their own filter. A client that missed
+    # a cycle gets a fresh snapshot instead of a diff it could not apply.
+    def __init__(self, keepalive=REALTIME_STREAM_KEEPALIVE):
+        self.keepalive = keepalive
+        self._latest = None
+        self._published = asyncio.Event()
+
+    def publish(self, snapshot):
+        latest = self._latest
+        if latest is not None and latest.version == snapshot.version:
+            return
+        # Only the previous update's vehicles are kept, so diffs never
+        # reach back further than one cycle.
+        if latest is not None:
+            latest.previous_vehicles = None
+        self._latest = RealtimeUpdate(snapshot, latest)
+        published = self._published
+        self._published = asyncio.Event()
+        published.set()
+
+    async def stream(self, vehicle_filter):
+        client_version = None
+        while True:
+            update = self._latest
+            if update is not None and update.version != client_version:
+                yield update.event_for(vehicle_filter, client_version)
+                client_version = update.version
+                continue
+            published = self._published
+            try:
+                await asyncio.wait_for(published.wait(), self.keepalive)
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from services.realtime.realtime_snapshot import REALTIME_REFRESH_INTERVAL
+
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", 2))
+REALTIME_SHUTDOWN_TIMEOUT = float(os.getenv("REALTIME_SHUTDOWN_TIMEOUT", 15))
+REALTIME_FOLLOWER_POLL_INTERVAL = float(os.getenv("REALTIME_FOLLOWER_POLL_INTERVAL", 1))
+
+
+class RealtimeIngestionWorker:
+    # Runs the ingestion cycle (download, parse, enrich, database update) on
+    # its own thread and event loop so the API event loop is never blocked by
+    # it. Every finished cycle hands its snapshot to the API side through a
+    # bounded queue; when the API side falls behind, the oldest entry is
+    # dropped because only the newest snapshot matters.
+    #
+    # With several uvicorn workers only the holder of the leader lock
+    # downloads and enriches the feeds. The others run the cycle as followers
+    # on a much shorter interval, which only picks up what the leader shared,
+    # and retry the lock on every tick.
+    def __init__(self, cycle, close=None, leader_lock=None, interval=REALTIME_REFRESH_INTERVAL,
+                 follower_interval=REALTIME_FOLLOWER_POLL_INTERVAL, queue_size=REALTIME_QUEUE_SIZE):
+        self.cycle = cycle
+        self.close = close
+        self.leader_lock = leader_lock
+        self.interval = interval
+        self.follower_interval = follower_interval
+        self.snapshots = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="realtime-ingestion", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=REALTIME_SHUTDOWN_TIMEOUT):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print("Realtime ingestion worker did not stop in time.")
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_leader(self):
+        return self.leader_lock is None or self.leader_lock.is_leader()
+
+    def request_refresh(self):
+        self._wake_event.set()
+
+    def next_snapshot(self, timeout=None):
+        try:
+            return self.snapshots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _offer(self, snapshot):
+        while True:
+            try:
+                self.snapshots.put_nowait(snapshot)
+                return
+            except queue.Full:
+                try:
+                    self.snapshots.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            next_run = time.monotonic()
+            while not self._stop_event.is_set():
+                started = time.monotonic()
+                is_leader = self.leader_lock is None or self.leader_lock.try_acquire()
+                try:
+                    snapshot = loop.run_until_complete(self.cycle(is_leader))
+                    if snapshot is not None:
+                        self._offer(snapshot)
+                except Exception as e:
+                    print(f"Error: {e}")
+
+                finished = time.monotonic()
+                interval = self.interval if is_leader else self.follower_interval
+                next_run += interval
+                if finished > next_run:
+                    # Cycle overran its slot: skip the missed ticks instead of
+                    # starting them back to back.
+                    skipped = int((finished - next_run) // interval) + 1
+                    next_run += skipped * interval
+                    print(f"Realtime ingestion cycle took {finished - started:.1f}s, skipping {skipped} cycle(s).")
+
+                requested = self._wake_event.wait(max(0, next_run - time.monotonic()))
+                if requested:
+                    self._wake_event.clear()
+                    next_run = time.monotonic()
+        finally:
+            if self.leader_lock is not None:
+                self.leader_lock.release()
+            if self.close is not None:
+                try:
+                    loop.run_until_complete(self.close())
+                except Exception as e:
+                    print(f"Error closing realtime ingestion: {e}")
+            loop.close()
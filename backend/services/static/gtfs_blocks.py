@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+
+def adjust_end_time(end_time):
+    time_parts = end_time.split(":")
+    hours = int(time_parts[0])
+    minutes = int(time_parts[1])
+
+    if hours >= 24:
+        hours -= 24
+
+    return f"{hours:02}:{minutes:02}"
+
+
+def block_sort_key(block_id):
+    try:
+        return 0, int(block_id.split('_')[1])
+    except (ValueError, IndexError):
+        return 1, 0
+
+
+def first_departure_times(stop_times_by_trip, stop_times, trip_ids):
+    # Departure time of the first stop_times row of every trip, None for
+    # trips without stop times.
+    groups = stop_times_by_trip.keys.get_indexer(trip_ids)
+    lengths = np.diff(stop_times_by_trip.offsets)
+    has_stop_times = groups >= 0
+    has_stop_times[has_stop_times] = lengths[groups[has_stop_times]] > 0
+    first_rows = stop_times_by_trip.order[stop_times_by_trip.offsets[groups[has_stop_times]]]
+
+    departure_times = np.full(len(groups), None, dtype=object)
+    departure_times[has_stop_times] = np.asarray(stop_times['departure_time'].values, dtype=object)[first_rows]
+    return departure_times
+
+
+class BlockSummaries:
+    # What the schedule plan shows about every block, built once per feed
+    # version: its schedule number, service and service days, the routes it
+    # runs and when its first and last trips start. Blocks of a route are
+    # kept in order of block number.
+    def __init__(self, gtfs_index, trips, stop_times):
+        trips_by_block = gtfs_index.trips_by_block
+        block_sizes = np.diff(trips_by_block.offsets)
+        blocks = np.flatnonzero(block_sizes)
+        first_rows = trips_by_block.order[trips_by_block.offsets[blocks]]
+        last_rows = trips_by_block.order[trips_by_block.offsets[blocks + 1] - 1]
+        service_ids = np.asarray(trips['service_id'].values, dtype=object)[first_rows]
+        start_times = first_departure_times(gtfs_index.stop_times_by_trip, stop_times, trips.index[first_rows])
+        end_times = first_departure_times(gtfs_index.stop_times_by_trip, stop_times, trips.index[last_rows])
+
+        # Distinct routes of every block, in table order of its trips.
+        block_routes = pd.DataFrame({
+            'block': np.repeat(np.arange(len(block_sizes)), block_sizes),
+            'route_id': np.asarray(trips['route_id'].values, dtype=object)[trips_by_block.order],
+        }).drop_duplicates()
+        route_short_names = {
+            block: tuple(gtfs_index.route_short_name_by_route_id.get(route_id) for route_id in route_ids)
+            for block, route_ids in block_routes.groupby('block', sort=False)['route_id']
+        }
+
+        self.by_block = {}
+        for block, service_id, start_time, end_time in zip(blocks.tolist(), service_ids, start_times, end_times):
+            block_id = trips_by_block.keys[block]
+            self.by_block[block_id] = {
+                'block_id': block_id,
+                'schedule_number': gtfs_index.schedule_number_by_block.get((block_id, service_id)),
+                'service_id': service_id,
+                'start_time': start_time,
+                'end_time': adjust_end_time(end_time) if isinstance(end_time, str) else None,
+                'service_days': tuple(gtfs_index.service_days.get(service_id, ())),
+                'route_short_names': route_short_names[block],
+            }
+
+        block_values = np.asarray(trips['block_id'].values, dtype=object)
+        self.by_route = {
+            route_id: tuple(sorted(
+                (block_id for block_id in pd.unique(block_values[gtfs_index.trips_by_route.get(route_id)]) if block_id in self.by_block),
+                key=block_sort_key,
+            ))
+            for route_id in gtfs_index.trips_by_route.keys
+        }
+
+    def for_route(self, route_id):
+        return [self.by_block[block_id] for block_id in self.by_route.get(route_id, ())]
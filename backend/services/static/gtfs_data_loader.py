@@ -1,17 +1,52 @@
+import numpy as np
 import pandas as pd
 import os
 import requests
+import time
 import zipfile
+from contextvars import ContextVar
+from services.static.gtfs_departures import compile_departure_trips, compile_departures
+from services.static.gtfs_diff import GTFSChangeSet, content_hashes
+from services.static.gtfs_index import GTFSIndex
+from services.static.gtfs_patterns import stop_display_names
+from services.static.gtfs_schedule_numbers import create_schedule_numbers_bus, create_schedule_numbers_tram, update_schedule_numbers
+from services.static.gtfs_shapes import compile_shapes
+from services.static.gtfs_tiles import VectorTiles
+from services.static.gtfs_timetables import compile_timetables
+from services.static.gtfs_snapshot import gtfs_file_lock, read_feed_version, read_gtfs_tables, write_feed_files, write_feed_headers, write_feed_version
+
+GTFS_DATA_PATH = os.path.join(os.path.dirname(__file__), 'gtfs_data')
+GTFS_FEEDS = {
+    'bus': "https://gtfs.ztp.krakow.pl/GTFS_KRK_A.zip",
+    'tram': "https://gtfs.ztp.krakow.pl/GTFS_KRK_T.zip",
+}
+SCHEDULE_NUMBER_BUILDERS = {
+    'bus': create_schedule_numbers_bus,
+    'tram': create_schedule_numbers_tram,
+}
+GTFS_FEED_FILES = ['stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt', 'calendar.txt', 'shapes.txt']
+GTFS_DOWNLOAD_TIMEOUT = float(os.getenv("GTFS_DOWNLOAD_TIMEOUT", 120))
+
+# The model a request started with, pinned by the API middleware so a
+# request keeps using it even if a new feed version is swapped in meanwhile.
+gtfs_request_data = ContextVar('gtfs_request_data', default=None)
 
 class GTFSData:
     def __init__(self):
         self.data = None
 
     def load_data(self, data):
+        # A single reference assignment, so readers see either the old or
+        # the new model, never a mix of both.
         self.data = data
 
     def get_data(self):
-        return self.data
+        data = gtfs_request_data.get()
+        return data if data is not None else self.data
+
+    def get_version(self):
+        data = self.get_data()
+        return data['version'] if data is not None else None
 
 gtfs_data_instance = GTFSData()
 
@@ -19,7 +54,8 @@ def should_download_files(folder_path):
     if not os.path.exists(folder_path):
         return True 
 
-    files = list(os.scandir(folder_path))
+    # Hidden entries are the compiled snapshots and lock files, not GTFS data.
+    files = [entry for entry in os.scandir(folder_path) if not entry.name.startswith('.')]
     return len(files) <= 1 
 
 def download_and_extract_gtfs(url, extract_to):
@@ -31,7 +67,7 @@ def download_and_extract_gtfs(url, extract_to):
     zip_path = os.path.join(extract_to, os.path.basename(url))
 
     print(f"Downloading {url}...")
-    response = requests.get(url, stream=True)
+    response = requests.get(url, stream=True, timeout=GTFS_DOWNLOAD_TIMEOUT)
     
     if response.status_code == 200:
         with open(zip_path, 'wb') as file:
@@ -41,78 +77,211 @@ def download_and_extract_gtfs(url, extract_to):
 
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(extract_to)
+            write_feed_files(extract_to, [name for name in zip_ref.namelist() if not name.endswith('/')])
         print(f"Unziped int: {extract_to}")
 
+        write_feed_version(extract_to, zip_path)
+        write_feed_headers(extract_to, response.headers, time.time())
         os.remove(zip_path)
     else:
         raise Exception(f"Downloading failed: {url}")
 
+# Repeated string columns are stored as categoricals. The small lookup
+# tables (stops, routes, calendar, schedule numbers) are left as they are.
+CATEGORY_COLUMNS = {
+    'trips': ['route_id', 'service_id', 'trip_headsign', 'shape_id', 'block_id'],
+    'stop_times': ['trip_id', 'arrival_time', 'departure_time', 'stop_id'],
+    'shapes': ['shape_id'],
+}
+FLOAT32_COLUMNS = {
+    'shapes': ['shape_pt_lat', 'shape_pt_lon'],
+}
+# Tables compiled from the feed for the index only; they are kept by the
+# index and not in the model.
+INDEX_TABLES = [
+    'content_hashes',
+    'departures', 'departure_groups', 'departure_trips',
+    'timetable_rows', 'timetable_groups', 'timetable_routes', 'timetable_directions', 'timetable_services',
+    'shape_points', 'shape_groups', 'shape_polylines',
+]
+# Integer columns of these tables are downcast to the smallest type that
+# holds their values.
+DOWNCAST_TABLES = ['stop_times', 'shapes']
+
+def time_to_seconds(times):
+    # HH:MM:SS (hours may exceed 24) to seconds after midnight, -1 when
+    # missing. Categoricals are parsed once per distinct time.
+    if isinstance(times.dtype, pd.CategoricalDtype):
+        seconds = time_to_seconds(pd.Series(times.cat.categories))
+        return np.append(seconds, -1).astype(np.int32)[times.cat.codes.values]
+    parts = times.str.split(':', expand=True).astype(float)
+    seconds = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return seconds.fillna(-1).astype(np.int32).values
+
+def prepare_gtfs_tables(tables, vehicle_type, previous=None):
+    for table_name, columns in CATEGORY_COLUMNS.items():
+        df = tables[table_name]
+        for column in columns:
+            if column in df.columns and df[column].dtype == object:
+                df[column] = df[column].astype('category')
+    # Hashed before any column is downcast, so the same values hash the same
+    # in every version.
+    tables['content_hashes'] = content_hashes(tables)
+    changes = GTFSChangeSet(previous, tables) if previous is not None else None
+
+    # Schedule numbers are derived from the raw tables, so they end up in
+    # the snapshot of the feed version they were computed for.
+    builder = SCHEDULE_NUMBER_BUILDERS[vehicle_type]
+    if changes is not None:
+        tables['schedule_numbers'] = update_schedule_numbers(builder, tables['routes'], tables['trips'], tables['calendar'], previous['schedule_numbers'], changes)
+    else:
+        tables['schedule_numbers'] = builder(tables['routes'], tables['trips'], tables['calendar'])
+
+    for table_name, columns in FLOAT32_COLUMNS.items():
+        df = tables[table_name]
+        for column in columns:
+            if column in df.columns:
+                df[column] = df[column].astype(np.float32)
+    for table_name in DOWNCAST_TABLES:
+        df = tables[table_name]
+        for column in df.select_dtypes(include='integer').columns:
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+
+    stop_times = tables['stop_times']
+    stop_times['departure_seconds'] = time_to_seconds(stop_times['departure_time'])
+    stops = tables['stops']
+    stops['stop_display_name'] = stop_display_names(stops['stop_id'], stops['stop_name'], vehicle_type)
+
+    # The per-row arrays of the departure boards, timetables and shapes are
+    # compiled into the snapshot too, so workers map them instead of each
+    # building its own copy.
+    tables.update(compile_departures(tables['trips'], stop_times))
+    tables.update(compile_departure_trips(tables['trips'], stop_times, tables['routes'], tables['schedule_numbers'], previous, changes))
+    tables.update(compile_timetables(tables['trips'], stop_times))
+    tables.update(compile_shapes(tables['shapes']))
+    return tables
+
+def report_memory_usage(gtfs_data):
+    total = 0
+    for name, df in gtfs_data.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        size = df.memory_usage(index=True, deep=True).sum()
+        total += size
+        print(f"GTFS {name}: {len(df)} rows, {size / 2**20:.1f} MiB")
+    print(f"GTFS total: {total / 2**20:.1f} MiB")
+
+def read_feed_tables(vehicle_type, previous=None):
+    # previous are the tables of the loaded version of the feed, which a new
+    # version is compiled incrementally against.
+    source_files = {file_name[:-len('.txt')]: file_name for file_name in GTFS_FEED_FILES}
+    return read_gtfs_tables(os.path.join(GTFS_DATA_PATH, vehicle_type), source_files,
+                            prepare=lambda tables: prepare_gtfs_tables(tables, vehicle_type, previous))
+
+def get_feed_versions():
+    return {
+        vehicle_type: read_feed_version(os.path.join(GTFS_DATA_PATH, vehicle_type), GTFS_FEED_FILES)
+        for vehicle_type in GTFS_FEEDS
+    }
+
+def get_feed_version(feed_versions=None):
+    # Version of the feeds currently on disk, e.g. to compare it with the
+    # version of the loaded model.
+    feed_versions = feed_versions or get_feed_versions()
+    return '-'.join(feed_versions[vehicle_type][:12] for vehicle_type in GTFS_FEEDS)
+
 def load_gtfs_data():
-    base_path = os.path.dirname(__file__)
-    extracted_path = os.path.join(base_path, 'gtfs_data')
-
-    bus_path = os.path.join(extracted_path, 'bus')
-    tram_path = os.path.join(extracted_path, 'tram')
-
-    url_gtfs_a = "https://gtfs.ztp.krakow.pl/GTFS_KRK_A.zip"
-    url_gtfs_t = "https://gtfs.ztp.krakow.pl/GTFS_KRK_T.zip"
-
-    download_and_extract_gtfs(url_gtfs_a, bus_path)
-    download_and_extract_gtfs(url_gtfs_t, tram_path)
-
-    stops_df_a = pd.read_csv(os.path.join(bus_path, 'stops.txt'))
-    routes_df_a = pd.read_csv(os.path.join(bus_path, 'routes.txt'))
-    trips_df_a = pd.read_csv(os.path.join(bus_path, 'trips.txt'))
-    stop_times_df_a = pd.read_csv(os.path.join(bus_path, 'stop_times.txt'))
-    calendar_df_a = pd.read_csv(os.path.join(bus_path, 'calendar.txt'))
-    schedule_numbers_df_a = pd.read_csv(os.path.join(bus_path, 'schedule_numbers_a.txt'))
-    shapes_df_a = pd.read_csv(os.path.join(bus_path, 'shapes.txt'))
-
-    stops_df_t = pd.read_csv(os.path.join(tram_path, 'stops.txt'))
-    routes_df_t = pd.read_csv(os.path.join(tram_path, 'routes.txt'))
-    trips_df_t = pd.read_csv(os.path.join(tram_path, 'trips.txt'))
-    stop_times_df_t = pd.read_csv(os.path.join(tram_path, 'stop_times.txt'))
-    calendar_df_t = pd.read_csv(os.path.join(tram_path, 'calendar.txt'))
-    schedule_numbers_df_t = pd.read_csv(os.path.join(tram_path, 'schedule_numbers_t.txt'))
-    shapes_df_t = pd.read_csv(os.path.join(tram_path, 'shapes.txt'))
+    for vehicle_type, url in GTFS_FEEDS.items():
+        folder_path = os.path.join(GTFS_DATA_PATH, vehicle_type)
+        with gtfs_file_lock(folder_path):
+            download_and_extract_gtfs(url, folder_path)
+
+    gtfs_data_instance.load_data(build_gtfs_data())
+
+def model_tables(gtfs_data, suffix):
+    return {
+        'routes': gtfs_data[f'routes_{suffix}'],
+        'trips': gtfs_data[f'trips_{suffix}'],
+        'stop_times': gtfs_data[f'stop_times_{suffix}'],
+        'stops': gtfs_data[f'stops_{suffix}'],
+        'calendar': gtfs_data[f'calendar_{suffix}'],
+        'shapes': gtfs_data[f'shapes_{suffix}'],
+        'schedule_numbers': gtfs_data[f'schedule_num_{suffix}'],
+    }
+
+def previous_feed_tables(gtfs_data, suffix):
+    # The tables of a loaded feed with the compiled ones its index keeps, as
+    # the next version of the feed is compared with them.
+    tables = model_tables(gtfs_data, suffix)
+    gtfs_index = gtfs_data[f'index_{suffix}']
+    tables['content_hashes'] = gtfs_index.content_hashes
+    tables['departure_trips'] = gtfs_index.departure_trips
+    return tables
+
+def build_feed_data(vehicle_type, suffix, previous=None):
+    previous_tables = previous_feed_tables(previous, suffix) if previous is not None else None
+    tables = read_feed_tables(vehicle_type, previous_tables)
+    changes = GTFSChangeSet(previous_tables, tables) if previous is not None else None
+    if changes is not None:
+        print(f"GTFS feed {vehicle_type} changed: {changes.summary()}")
+    trips_df = tables['trips']
+    stop_times_df = tables['stop_times']
 
     try:
-        if 'trip_id' in trips_df_a.columns:
-            trips_df_a.set_index('trip_id', inplace=True)
+        if 'trip_id' in trips_df.columns:
+            trips_df.set_index('trip_id', inplace=True)
         else:
-            raise KeyError("Column 'trip_id' does not exist in trips_df_a")
-        
-        stop_times_df_a.set_index('trip_id', inplace=True)
+            raise KeyError(f"Column 'trip_id' does not exist in trips_df_{suffix}")
 
-        if 'trip_id' in trips_df_t.columns:
-            trips_df_t.set_index('trip_id', inplace=True)
-        else:
-            raise KeyError("Column 'trip_id' does not exist in trips_df_t")
-        
-        stop_times_df_t.set_index('trip_id', inplace=True)
+        stop_times_df.set_index('trip_id', inplace=True)
 
     except KeyError as e:
         print(f"Key error: {e}")
         raise
 
-    routes_df_a['route_short_name'] = routes_df_a['route_short_name'].astype(str)
-    routes_df_t['route_short_name'] = routes_df_t['route_short_name'].astype(str)
-
-    gtfs_data = {
-        'stops_a': stops_df_a,
-        'routes_a': routes_df_a,
-        'trips_a': trips_df_a,  
-        'stop_times_a': stop_times_df_a,
-        'calendar_a': calendar_df_a,
-        'schedule_num_a': schedule_numbers_df_a,
-        'shapes_a': shapes_df_a,
-        'stops_t': stops_df_t,
-        'routes_t': routes_df_t,
-        'trips_t': trips_df_t,  
-        'stop_times_t': stop_times_df_t,
-        'calendar_t': calendar_df_t,
-        'schedule_num_t': schedule_numbers_df_t,
-        'shapes_t': shapes_df_t
+    tables['routes']['route_short_name'] = tables['routes']['route_short_name'].astype(str)
+
+    feed_data = {
+        f'stops_{suffix}': tables['stops'],
+        f'routes_{suffix}': tables['routes'],
+        f'trips_{suffix}': trips_df,
+        f'stop_times_{suffix}': stop_times_df,
+        f'calendar_{suffix}': tables['calendar'],
+        f'schedule_num_{suffix}': tables['schedule_numbers'],
+        f'shapes_{suffix}': tables['shapes'],
     }
+    index_tables = model_tables(feed_data, suffix)
+    index_tables.update({table_name: tables[table_name] for table_name in INDEX_TABLES})
+    previous_index = previous[f'index_{suffix}'] if previous is not None else None
+    feed_data[f'index_{suffix}'] = GTFSIndex(index_tables, vehicle_type, previous_index, changes)
+    return feed_data
+
+def stop_location_records(gtfs_data):
+    # The stops of both feeds as /api/stops/list/location returns them,
+    # built once per model; missing values are None.
+    stop_locations = pd.concat([gtfs_data['index_a'].stop_locations, gtfs_data['index_t'].stop_locations], ignore_index=True)
+    return stop_locations.astype(object).where(stop_locations.notna(), None).to_dict(orient='records')
+
+def build_gtfs_data(previous=None):
+    # Builds a complete model from the feeds on disk without touching the
+    # one that is being served. The bus and tram feeds are published
+    # separately, and a feed whose version did not change is taken over from
+    # the previous model as it is, tables and index. A changed feed is
+    # compared with the previous version, and what is derived from it is
+    # rebuilt only where the change set reaches.
+    feed_versions = get_feed_versions()
+    gtfs_data = {'version': get_feed_version(feed_versions), 'feed_versions': feed_versions}
+    for suffix, vehicle_type in (('a', 'bus'), ('t', 'tram')):
+        if previous is not None and previous.get('feed_versions', {}).get(vehicle_type) == feed_versions[vehicle_type]:
+            print(f"GTFS feed {vehicle_type} unchanged, reusing the loaded one")
+            # Every table and the index of a feed are stored under keys
+            # ending with its suffix.
+            feed_data = {key: value for key, value in previous.items() if key.endswith(f'_{suffix}')}
+        else:
+            feed_data = build_feed_data(vehicle_type, suffix, previous if previous is not None and f'index_{suffix}' in previous else None)
+        gtfs_data.update(feed_data)
+    gtfs_data['stop_locations'] = stop_location_records(gtfs_data)
+    gtfs_data['tiles'] = VectorTiles(gtfs_data)
 
-    gtfs_data_instance.load_data(gtfs_data)
+    report_memory_usage(gtfs_data)
+    return gtfs_data
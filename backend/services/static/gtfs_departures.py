@@ -0,0 +1,179 @@
+import numpy as np
+import pandas as pd
+from services.static.gtfs_schedule_numbers import route_short_names
+
+
+def category_codes(values):
+    if isinstance(values, (pd.Categorical, pd.CategoricalIndex)):
+        return np.asarray(values.codes), pd.Index(values.categories)
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return codes, pd.Index(uniques)
+
+
+class CodedValues:
+    # A column as codes into its distinct values, missing values as None, so
+    # a categorical mapped from the snapshot is looked up without expanding
+    # it into an object array.
+    def __init__(self, values):
+        codes, uniques = category_codes(values)
+        self.codes = codes
+        self.values = np.append(np.asarray(uniques, dtype=object), None)
+        self.values.setflags(write=False)
+
+    def take(self, rows):
+        return self.values[self.codes[rows]]
+
+
+def compile_departures(trips, stop_times):
+    # The departure rows of every stop, compiled with the feed tables so the
+    # snapshot stores them and every worker maps the same pages. The rows of
+    # stop_times are grouped by (stop_id, service of the trip id) and sorted
+    # by the minute of the day they depart at; each row keeps only the codes
+    # of its trip and departure time.
+    trip_codes, trip_ids = category_codes(stop_times['trip_id'].values)
+    stop_codes, stop_ids = category_codes(stop_times['stop_id'].values)
+    time_codes, _ = category_codes(stop_times['departure_time'].values)
+    trip_services = pd.Series(np.asarray(trip_ids, dtype=object)).astype(str).str.split('_').str[5]
+    service_codes, services = category_codes(trip_services.values)
+    has_trip = pd.Index(trips['trip_id'].values).get_indexer(trip_ids) >= 0
+
+    # Departures are shown at the minute they leave; times after
+    # midnight of the service day count from midnight again.
+    seconds = np.asarray(stop_times['departure_seconds'].values, dtype=np.int64)
+    hours = seconds // 3600
+    hours = np.where(hours >= 24, hours - 24, hours)
+    minutes = hours * 3600 + seconds % 3600 // 60 * 60
+    row_services = np.where(trip_codes >= 0, service_codes[trip_codes], -1)
+    valid = (seconds >= 0) & (hours < 24) & (stop_codes >= 0) & (row_services >= 0) & (time_codes >= 0)
+    valid &= np.where(trip_codes >= 0, has_trip[trip_codes], False)
+
+    rows = np.flatnonzero(valid)
+    rows = rows[np.lexsort((minutes[rows], row_services[rows], stop_codes[rows]))]
+    group_keys = stop_codes[rows].astype(np.int64) * len(services) + row_services[rows]
+    boundaries = np.flatnonzero(np.r_[True, np.diff(group_keys) != 0, True]) if len(rows) else np.zeros(1, dtype=np.int64)
+    starts, ends = boundaries[:-1], boundaries[1:]
+    return {
+        'departures': pd.DataFrame({
+            'minute': minutes[rows].astype(np.int32),
+            'trip': trip_codes[rows].astype(np.int32),
+            'time': time_codes[rows].astype(np.int32),
+        }),
+        'departure_groups': pd.DataFrame({
+            'stop_id': np.asarray(stop_ids, dtype=object)[group_keys[starts] // len(services)],
+            'service': np.asarray(services, dtype=object)[group_keys[starts] % len(services)],
+            'start': starts.astype(np.int64),
+            'end': ends.astype(np.int64),
+        }),
+    }
+
+
+def object_values(values):
+    return np.asarray(values, dtype=object)
+
+
+def first_schedule_numbers(schedule_numbers):
+    schedule_numbers = schedule_numbers.drop_duplicates(['block_id', 'service_id'])
+    return pd.Series(
+        object_values(schedule_numbers['schedule_number'].values),
+        index=pd.MultiIndex.from_arrays([object_values(schedule_numbers['block_id'].values), object_values(schedule_numbers['service_id'].values)]),
+    )
+
+
+def changed_schedule_keys(previous_numbers, schedule_numbers):
+    previous_numbers = first_schedule_numbers(previous_numbers).to_dict()
+    schedule_numbers = first_schedule_numbers(schedule_numbers).to_dict()
+    return [key for key in previous_numbers.keys() | schedule_numbers.keys() if previous_numbers.get(key) != schedule_numbers.get(key)]
+
+
+DEPARTURE_TRIP_COLUMNS = ['trip_id', 'block', 'service', 'route_short_name', 'trip_headsign', 'schedule_number']
+
+
+def compile_departure_trips(trips, stop_times, routes, schedule_numbers, previous=None, changes=None):
+    # What a departure board shows about every trip, one row per trip code
+    # of compile_departures: the short name of its route, its headsign and
+    # the schedule number of the block and service in its trip id. Given
+    # the previous version of the feed and the change set, only trips that
+    # changed, run a changed route or have a changed schedule number are
+    # looked up again; the rows of the others are taken over.
+    _, trip_ids = category_codes(stop_times['trip_id'].values)
+    trip_ids = object_values(trip_ids)
+    trip_rows = pd.Index(trips['trip_id'].values).get_indexer(trip_ids)
+    has_trip = trip_rows >= 0
+    route_ids = np.where(has_trip, object_values(trips['route_id'].values)[trip_rows], None)
+    columns = {column: np.full(len(trip_ids), None, dtype=object) for column in DEPARTURE_TRIP_COLUMNS}
+
+    rebuild = np.ones(len(trip_ids), dtype=bool)
+    if previous is not None:
+        previous_trips = previous['departure_trips']
+        positions = pd.Index(object_values(previous_trips['trip_id'].values)).get_indexer(trip_ids)
+        rebuild = (positions < 0) | pd.Index(trip_ids).isin(changes.trips) | pd.Index(route_ids).isin(changes.changed['routes'])
+        changed_keys = changed_schedule_keys(previous['schedule_numbers'], schedule_numbers)
+        if changed_keys:
+            previous_keys = pd.MultiIndex.from_arrays([object_values(previous_trips['block'].values), object_values(previous_trips['service'].values)])
+            found = positions >= 0
+            rebuild[found] |= previous_keys.isin(changed_keys)[positions[found]]
+        kept = np.flatnonzero(~rebuild)
+        for column in DEPARTURE_TRIP_COLUMNS:
+            columns[column][kept] = object_values(previous_trips[column].values)[positions[kept]]
+
+    rows = np.flatnonzero(rebuild)
+    trip_parts = pd.Series(trip_ids[rows]).astype(str).str.split('_')
+    blocks = ("block_" + trip_parts.str[1]).str.strip().values
+    services = ("service_" + trip_parts.str[5]).str.strip().values
+    numbers = first_schedule_numbers(schedule_numbers).reindex(pd.MultiIndex.from_arrays([object_values(blocks), object_values(services)]))
+    short_names = route_short_names(routes).reindex(route_ids[rows])
+    columns['trip_id'][rows] = trip_ids[rows]
+    columns['block'][rows] = blocks
+    columns['service'][rows] = services
+    columns['route_short_name'][rows] = np.where(short_names.notna().values & has_trip[rows], short_names.values, None)
+    columns['trip_headsign'][rows] = np.where(has_trip[rows], object_values(trips['trip_headsign'].values)[trip_rows[rows]], None)
+    columns['schedule_number'][rows] = np.where(numbers.notna().values, numbers.values, None)
+    return {'departure_trips': pd.DataFrame(columns)}
+
+
+class StopDepartures:
+    # Departure boards of every stop over the rows of compile_departures,
+    # which stay as they were loaded (memory-mapped from the snapshot), so a
+    # departure board is a binary search and a slice. Columns a board shows
+    # are kept per trip (compile_departure_trips) and per distinct departure
+    # time.
+    def __init__(self, stop_times, departures, departure_groups, departure_trips):
+        _, times = category_codes(stop_times['departure_time'].values)
+        self.trip_route_short_names = CodedValues(departure_trips['route_short_name'].values)
+        self.trip_headsigns = CodedValues(departure_trips['trip_headsign'].values)
+        self.trip_schedule_numbers = CodedValues(departure_trips['schedule_number'].values)
+        self.departure_labels = np.array([':'.join(str(time).split(':')[:2]) for time in times], dtype=object)
+
+        self.groups = {
+            (stop_id, service): (start, end)
+            for stop_id, service, start, end in zip(
+                departure_groups['stop_id'].values, departure_groups['service'].values,
+                departure_groups['start'].values.tolist(), departure_groups['end'].values.tolist(),
+            )
+        }
+        self.minutes = departures['minute'].values
+        self.trip_codes = departures['trip'].values
+        self.time_codes = departures['time'].values
+        for array in (self.minutes, self.trip_codes, self.time_codes, self.departure_labels):
+            array.setflags(write=False)
+
+    def departures(self, stop_id, service, from_seconds=0):
+        # Departures of one stop and service leaving at or after
+        # from_seconds (seconds after midnight), earliest first.
+        start, end = self.groups.get((stop_id, service), (0, 0))
+        start += int(np.searchsorted(self.minutes[start:end], from_seconds, side='left'))
+        trip_codes = self.trip_codes[start:end]
+        return [
+            {
+                'route_short_name': route_short_name,
+                'trip_headsign': trip_headsign,
+                'schedule_number': schedule_number,
+                'departure_time': departure_time,
+            }
+            for route_short_name, trip_headsign, schedule_number, departure_time in zip(
+                self.trip_route_short_names.take(trip_codes),
+                self.trip_headsigns.take(trip_codes),
+                self.trip_schedule_numbers.take(trip_codes),
+                self.departure_labels[self.time_codes[start:end]],
+            )
+        ]
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+# The tables two versions of a feed are compared by, with the key their
+# rows belong to. stop_times rows belong to their trip.
+CONTENT_KEYS = {
+    'routes': 'route_id',
+    'trips': 'trip_id',
+    'stop_times': 'trip_id',
+    'calendar': 'service_id',
+    'shapes': 'shape_id',
+    'stops': 'stop_id',
+}
+
+
+def key_values(df, column):
+    # A key column of a raw table, or the index of a loaded one.
+    if column in df.columns:
+        return df[column].values
+    return df.index.get_level_values(column).values
+
+
+def content_hashes(tables):
+    # One row per key of every table in CONTENT_KEYS with a hash of the
+    # values of all its rows, compiled with the feed so the next version is
+    # compared against it. A key hashes the wrapping sum of its row hashes,
+    # so it does not depend on where its rows are in the file.
+    hashes = []
+    for table_name, key_column in CONTENT_KEYS.items():
+        df = tables[table_name]
+        keys = key_values(df, key_column)
+        if isinstance(keys, pd.Categorical):
+            codes, uniques = np.asarray(keys.codes), np.asarray(keys.categories, dtype=object)
+        else:
+            codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+            uniques = np.asarray(uniques, dtype=object)
+        row_hashes = pd.util.hash_pandas_object(df, index=False).values
+
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        counts = np.bincount(codes[order], minlength=len(uniques))
+        present = np.flatnonzero(counts)
+        starts = np.zeros(len(uniques), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        sums = np.add.reduceat(row_hashes[order], starts[present]) if len(present) else np.zeros(0, dtype=np.uint64)
+        hashes.append(pd.DataFrame({
+            'table': table_name,
+            'key': uniques[present],
+            'hash': sums.astype(np.uint64),
+        }))
+    return pd.concat(hashes, ignore_index=True)
+
+
+def table_hashes(hashes):
+    # {table name: hashes by key} of a content_hashes table.
+    tables = np.asarray(hashes['table'].values, dtype=object)
+    keys = np.asarray(hashes['key'].values, dtype=object)
+    values = np.asarray(hashes['hash'].values)
+    boundaries = np.flatnonzero(np.r_[True, tables[1:] != tables[:-1], True]) if len(tables) else np.zeros(1, dtype=np.int64)
+    return {
+        tables[start]: pd.Series(values[start:end], index=pd.Index(keys[start:end]))
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    }
+
+
+def changed_keys(previous_hashes, hashes):
+    # Keys added, removed or with different rows in the new version.
+    positions = previous_hashes.index.get_indexer(hashes.index)
+    differs = positions < 0
+    differs[~differs] = previous_hashes.values[positions[~differs]] != hashes.values[~differs]
+    removed = hashes.index.get_indexer(previous_hashes.index) < 0
+    return set(hashes.index[differs]) | set(previous_hashes.index[removed])
+
+
+def isin(values, keys):
+    # values.isin(keys) of a column, looked up once per category when it is
+    # a categorical.
+    if not keys:
+        return np.zeros(len(values), dtype=bool)
+    if isinstance(values, (pd.Categorical, pd.CategoricalIndex)):
+        found = np.append(pd.Index(values.categories).isin(keys), False)
+        return found[np.asarray(values.codes)]
+    return pd.Index(np.asarray(values, dtype=object)).isin(keys)
+
+
+def present(values):
+    return {value for value in values if not pd.isna(value)}
+
+
+class GTFSChangeSet:
+    # What changed from one version of a feed to the next: the keys of every
+    # table in CONTENT_KEYS whose rows were added, removed or changed, and
+    # the trips, routes, services, blocks and stops they affect in either
+    # version. Derived tables and indexes are rebuilt for these only.
+    def __init__(self, previous, tables):
+        previous_hashes = table_hashes(previous['content_hashes'])
+        hashes = table_hashes(tables['content_hashes'])
+        empty = pd.Series([], index=pd.Index([], dtype=object), dtype=np.uint64)
+        self.changed = {
+            table_name: changed_keys(previous_hashes.get(table_name, empty), hashes.get(table_name, empty))
+            for table_name in CONTENT_KEYS
+        }
+        self.trips = self.changed['trips'] | self.changed['stop_times']
+        self.routes = set(self.changed['routes'])
+        self.services = set(self.changed['calendar'])
+        self.stops = set(self.changed['stops'])
+        self.blocks = set()
+
+        versions = [(previous['trips'], previous['stop_times']), (tables['trips'], tables['stop_times'])]
+        for trips, stop_times in versions:
+            trip_ids = key_values(trips, 'trip_id')
+            changed = isin(trip_ids, self.trips)
+            self.routes |= present(np.asarray(trips['route_id'].values[changed], dtype=object))
+            self.services |= present(np.asarray(trips['service_id'].values[changed], dtype=object))
+            self.blocks |= present(np.asarray(trips['block_id'].values[changed], dtype=object))
+
+            stop_time_trips = key_values(stop_times, 'trip_id')
+            stop_ids = stop_times['stop_id'].values
+            self.stops |= present(pd.unique(np.asarray(stop_ids[isin(stop_time_trips, self.trips)], dtype=object)))
+            # A stop renamed or moved changes the stop lists of the routes
+            # through it.
+            through_changed_stops = present(pd.unique(np.asarray(stop_time_trips[isin(stop_ids, self.changed['stops'])], dtype=object)))
+            self.routes |= present(np.asarray(trips['route_id'].values[isin(trip_ids, through_changed_stops)], dtype=object))
+
+        # Blocks are numbered by the routes of all their trips, so the
+        # services of a changed block are numbered again too.
+        trips = tables['trips']
+        in_changed_blocks = isin(trips['block_id'].values, self.blocks)
+        self.services |= present(np.asarray(trips['service_id'].values[in_changed_blocks], dtype=object))
+
+    def is_empty(self):
+        return not any(self.changed.values())
+
+    def summary(self):
+        return ', '.join(f"{table_name} {len(keys)}" for table_name, keys in self.changed.items())
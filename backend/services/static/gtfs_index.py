@@ -0,0 +1,127 @@
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+from services.static.gtfs_blocks import BlockSummaries
+from services.static.gtfs_departures import StopDepartures
+from services.static.gtfs_patterns import StopPatterns, route_stop_lists
+from services.static.gtfs_shapes import ShapeStore
+from services.static.gtfs_timetables import RouteTimetables
+
+
+def read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+def first_mapping(keys, values):
+    # Like filtering with a mask and taking .values[0]: the first row wins.
+    return MappingProxyType(dict(zip(reversed(list(keys)), reversed(list(values)))))
+
+
+def grouped_mapping(keys, values):
+    groups = {}
+    for key, value in zip(keys, values):
+        groups.setdefault(key, []).append(value)
+    return MappingProxyType({key: tuple(group) for key, group in groups.items()})
+
+
+class GroupedRows:
+    # Row positions of a table grouped by one key column, stored as one
+    # array sorted by key plus offsets. Rows of a group keep table order.
+    def __init__(self, keys):
+        if isinstance(keys, (pd.Categorical, pd.CategoricalIndex)):
+            codes = np.asarray(keys.codes)
+            uniques = keys.categories
+        else:
+            codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+
+        order = np.argsort(codes, kind='stable')
+        order = order[codes[order] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        self.keys = pd.Index(uniques)
+        self.order = read_only(order.astype(np.int32 if len(codes) < 2**31 else np.int64))
+        self.offsets = read_only(offsets)
+
+    def get(self, key):
+        try:
+            code = self.keys.get_loc(key)
+        except (KeyError, TypeError):
+            return self.order[:0]
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+
+class GTFSIndex:
+    # Lookups over the static tables of one vehicle type, built once at load
+    # time and never mutated, so request handlers can share it between
+    # threads without copying or re-indexing the frames. Given the index of
+    # the previous version of the feed and the change set between the two,
+    # the stop patterns and stop lists of unaffected routes are taken over.
+    def __init__(self, tables, vehicle_type, previous=None, changes=None):
+        routes = tables['routes']
+        trips = tables['trips']
+        stop_times = tables['stop_times']
+        stops = tables['stops']
+        calendar = tables['calendar']
+        schedule_numbers = tables['schedule_numbers']
+
+        self.route_short_name_by_route_id = first_mapping(routes['route_id'], routes['route_short_name'])
+        self.route_ids_by_short_name = grouped_mapping(routes['route_short_name'], routes['route_id'])
+
+        self.trip_ids = trips.index
+        self.trips_by_block = GroupedRows(trips['block_id'].values)
+        self.trips_by_route = GroupedRows(trips['route_id'].values)
+
+        self.stop_times_by_trip = GroupedRows(stop_times.index)
+        self.stop_times_by_stop = GroupedRows(stop_times['stop_id'].values)
+
+        self.stop_name_by_id = first_mapping(stops['stop_id'], stops['stop_name'])
+        self.stop_ids_by_name = grouped_mapping(stops['stop_name'], stops['stop_id'])
+        self.stop_display_name_by_id = first_mapping(stops['stop_id'], stops['stop_display_name'])
+        self.stop_locations = pd.DataFrame({
+            'stop_id': stops['stop_id'].values,
+            'stop_name': stops['stop_display_name'].values,
+            'stop_lat': stops['stop_lat'].values,
+            'stop_lon': stops['stop_lon'].values,
+            'type': vehicle_type,
+        })
+
+        self.service_days = first_mapping(calendar['service_id'], [
+            [column for column in calendar.columns if row[column] == 1]
+            for _, row in calendar.iterrows()
+        ])
+
+        schedule_keys = list(zip(schedule_numbers['block_id'], schedule_numbers['service_id']))
+        self.schedule_number_by_block = first_mapping(schedule_keys, schedule_numbers['schedule_number'])
+        self.block_by_schedule_number = first_mapping(
+            zip(schedule_numbers['schedule_number'], schedule_numbers['service_id']), schedule_numbers['block_id']
+        )
+
+        changed_routes = changes.routes if changes is not None else None
+        self.stop_patterns = StopPatterns(
+            trips, stop_times, self.stop_times_by_trip, self.stop_display_name_by_id,
+            previous.stop_patterns if previous is not None else None, changed_routes
+        )
+        self.stop_departures = StopDepartures(stop_times, tables['departures'], tables['departure_groups'], tables['departure_trips'])
+        self.timetables = RouteTimetables(stop_times, tables)
+        self.block_summaries = BlockSummaries(self, trips, stop_times)
+        self.shapes = ShapeStore(tables['shape_points'], tables['shape_groups'], tables['shape_polylines'])
+        self.route_stops = route_stop_lists(
+            trips, self.trips_by_route, self.route_short_name_by_route_id, self.stop_patterns,
+            previous.route_stops if previous is not None else None, changed_routes
+        )
+        # Compiled tables the next version of the feed is compared with and
+        # carries rows over from.
+        self.content_hashes = tables['content_hashes']
+        self.departure_trips = tables['departure_trips']
+
+    def trip_position(self, trip_id):
+        return self.trip_ids.get_loc(trip_id)
+
+    def trip_rows_for_block(self, trips, block_id, service_id=None):
+        rows = self.trips_by_block.get(block_id)
+        if service_id is not None:
+            rows = rows[trips['service_id'].values[rows] == service_id]
+        return rows
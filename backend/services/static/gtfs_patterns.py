@@ -0,0 +1,166 @@
+from collections import Counter
+from types import MappingProxyType
+import numpy as np
+import pandas as pd
+
+
+def stop_display_names(stop_ids, stop_names, vehicle_type):
+    # "Name (NN)", where NN is the digit of the stop_id that numbers the
+    # platform: the last one for buses, the one before it for trams. Names
+    # that already end with it and ids without a digit there stay as they are.
+    number_index = -1 if vehicle_type == "bus" else -2
+    stop_ids = pd.Series(np.asarray(stop_ids, dtype=object)).astype(str)
+    display_names = pd.Series(np.array(stop_names, dtype=object))
+    digits = stop_ids.str[number_index]
+    has_number = digits.str.isdecimal().eq(True).values
+
+    # A single digit always makes a five character suffix, " (0N)".
+    suffixes = " (" + digits[has_number].astype(int).astype(str).str.zfill(2) + ")"
+    names = display_names[has_number]
+    display_names[has_number] = names.where(names.str[-5:] == suffixes, names + suffixes)
+    return display_names.values
+
+
+class StopPatterns:
+    # The distinct ordered stop sequences of one feed, found once per feed
+    # version. Every trip gets the id of its sequence; the sequences are
+    # compared by a hash of (stop, position) pairs, so no per-trip frames
+    # are built. Given the StopPatterns of the previous version of the feed,
+    # only the routes in changed_routes are summarized again.
+    def __init__(self, trips, stop_times, stop_times_by_trip, stop_name_by_id, previous=None, changed_routes=None):
+        stop_ids = stop_times['stop_id'].values
+        if isinstance(stop_ids, pd.Categorical):
+            stop_codes, stop_uniques = np.asarray(stop_ids.codes), np.asarray(stop_ids.categories, dtype=object)
+        else:
+            stop_codes, stop_uniques = pd.factorize(np.asarray(stop_ids, dtype=object))
+
+        order = stop_times_by_trip.order
+        offsets = stop_times_by_trip.offsets
+        lengths = np.diff(offsets)
+        positions = np.arange(len(order)) - np.repeat(offsets[:-1], lengths)
+        row_hashes = pd.util.hash_array(stop_codes[order].astype(np.int64) * (1 << 24) + positions)
+        non_empty = np.flatnonzero(lengths)
+        sums = np.zeros(len(lengths), dtype=np.uint64)
+        if len(non_empty):
+            sums[non_empty] = np.add.reduceat(row_hashes, offsets[non_empty])
+        group_keys = sums ^ pd.util.hash_array(lengths.astype(np.int64))
+        group_patterns, _ = pd.factorize(group_keys)
+        group_patterns[lengths == 0] = -1
+
+        # Stops of every pattern in trip order, taken from its first trip.
+        # Stops visited twice are listed twice, and stops missing from
+        # stops.txt have no name.
+        pattern_count = group_patterns.max() + 1 if len(group_patterns) else 0
+        _, first_groups = np.unique(group_patterns, return_index=True)
+        first_groups = first_groups[group_patterns[first_groups] >= 0]
+        self.pattern_stops = [None] * pattern_count
+        for group in first_groups:
+            stops = []
+            for code in stop_codes[order[offsets[group]:offsets[group + 1]]]:
+                stop_id = stop_uniques[code] if code >= 0 else None
+                stops.append({'stop_id': stop_id, 'stop_name': stop_name_by_id.get(stop_id)})
+            self.pattern_stops[group_patterns[group]] = stops
+
+        trip_groups = stop_times_by_trip.keys.get_indexer(trips.index)
+        self.trip_pattern = np.where(trip_groups >= 0, group_patterns[trip_groups], -1)
+        self.trip_pattern.setflags(write=False)
+        if previous is None:
+            self.by_route = self.summarize(trips)
+        else:
+            self.by_route = {route_id: directions for route_id, directions in previous.by_route.items() if route_id not in changed_routes}
+            self.by_route.update(self.summarize(trips, changed_routes))
+
+    def summarize(self, trips, route_ids=None):
+        # {route_id: {direction_id: [pattern, ...]}} with the most used
+        # pattern of every direction first, of all routes or of route_ids.
+        frame = pd.DataFrame({
+            'route_id': np.asarray(trips['route_id'].values, dtype=object),
+            'direction_id': trips['direction_id'].values,
+            'trip_headsign': np.asarray(trips['trip_headsign'].values, dtype=object),
+            'pattern': self.trip_pattern,
+        })
+        frame = frame[frame['pattern'] >= 0]
+        if route_ids is not None:
+            frame = frame[frame['route_id'].isin(route_ids)]
+        headsign_counts = frame.groupby(['route_id', 'direction_id', 'pattern', 'trip_headsign'], sort=False).size()
+
+        by_route = {}
+        for (route_id, direction_id, pattern), counts in headsign_counts.groupby(level=[0, 1, 2], sort=False):
+            by_route.setdefault(route_id, {}).setdefault(int(direction_id), []).append({
+                'trip_count': int(counts.sum()),
+                'headsigns': [
+                    {'trip_headsign': headsign, 'trip_count': int(count)}
+                    for headsign, count in counts.droplevel([0, 1, 2]).sort_values(ascending=False, kind='stable').items()
+                ],
+                'stops': self.pattern_stops[pattern],
+            })
+        for directions in by_route.values():
+            for patterns in directions.values():
+                patterns.sort(key=lambda pattern: -pattern['trip_count'])
+        return by_route
+
+    def trip_stops(self, trip_row):
+        pattern = self.trip_pattern[trip_row]
+        return self.pattern_stops[pattern] if pattern >= 0 else []
+
+
+def listed_stops(stops):
+    # A stop sequence as the stop list of a route shows it: stops known to
+    # stops.txt, each (stop, name) pair once.
+    listed = []
+    seen = set()
+    for stop in stops:
+        key = (stop['stop_id'], stop['stop_name'])
+        if stop['stop_name'] is None or key in seen:
+            continue
+        seen.add(key)
+        listed.append(stop)
+    return listed
+
+
+def route_stop_lists(trips, trips_by_route, route_short_name_by_route_id, stop_patterns, previous=None, changed_routes=None):
+    # {route_id: {direction_id: [headsigns, stops]}} as the stop list of a
+    # route is shown: the headsigns used by more trips than a threshold, and
+    # the longest stop list among the first trip of every shape of those
+    # headsigns, skipping the first trip of a block. Built for every route
+    # once per feed version; given the stop lists of the previous version,
+    # only for the routes in changed_routes.
+    headsigns = np.asarray(trips['trip_headsign'].values, dtype=object)
+    shape_ids = np.asarray(trips['shape_id'].values, dtype=object)
+    block_ids = np.asarray(trips['block_id'].values, dtype=object)
+    direction_ids = np.asarray(trips['direction_id'].values)
+    trip_ids = trips.index
+
+    route_stops = {}
+    for route_id in trips_by_route.keys:
+        route_number = route_short_name_by_route_id.get(route_id)
+        if route_number is None:
+            continue
+        if previous is not None and route_id not in changed_routes and route_id in previous:
+            route_stops[route_id] = previous[route_id]
+            continue
+        rows = trips_by_route.get(route_id)
+        # Tram lines need more trips than they have blocks in direction 1.
+        if len(route_number) <= 2:
+            test_number = len(pd.unique(block_ids[rows[direction_ids[rows] == 1]])) + 1
+        else:
+            test_number = 1
+
+        route_headsigns = headsigns[rows]
+        directions = {}
+        for direction_id in (0, 1):
+            headsign_counts = Counter(route_headsigns[direction_ids[rows] == direction_id])
+            trip_headsigns = [trip_headsign for trip_headsign, count in headsign_counts.items() if count > test_number]
+            longest_stops = None
+            for trip_headsign in trip_headsigns:
+                headsign_rows = rows[route_headsigns == trip_headsign]
+                first_of_shape = ~pd.Series(shape_ids[headsign_rows]).duplicated().values
+                for row in headsign_rows[first_of_shape]:
+                    if str(trip_ids[row]).split('_')[3:4] == ['1']:
+                        continue
+                    stops = listed_stops(stop_patterns.trip_stops(row))
+                    if len(stops) > (len(longest_stops) if longest_stops is not None else 0):
+                        longest_stops = stops
+            directions[direction_id] = [trip_headsigns, longest_stops]
+        route_stops[route_id] = directions
+    return MappingProxyType(route_stops)
@@ -1,22 +1,21 @@
 import datetime
+import numpy as np
 import pandas as pd
-from collections import Counter, defaultdict
-from operator import itemgetter
-from database.crud import get_vehicle_ids_with_timestamps_by_schedule_number, get_vehicle_status_by_id, get_vehicle_info_by_id, get_vehicle_schedule_and_routes, get_all_schedules_and_vehicles
+from collections import Counter
+from database.crud import get_vehicle_ids_with_timestamps_by_schedule_numbers, get_vehicle_status_by_id, get_vehicle_info_by_id, get_vehicle_schedule_and_routes, get_all_schedules_and_vehicles
 from database.session import SessionLocal
 from datetime import datetime, timedelta
 
-def get_bus_routes_list(gtfs_data):
-    if 'route_id' in gtfs_data['routes_a'].index.names:
-        gtfs_data['routes_a'].reset_index(inplace=True)
+# The GTFS tables and their indexes are shared by all requests, so the
+# functions below only read them and never reset or set an index in place.
+def get_gtfs_index(gtfs_data, vehicle_type):
+    return gtfs_data['index_a'] if vehicle_type == "bus" else gtfs_data['index_t']
 
+def get_bus_routes_list(gtfs_data):
     routes_a = gtfs_data['routes_a'][['route_id', 'route_short_name']]
     return routes_a
 
 def get_tram_routes_list(gtfs_data):
-    if 'route_id' in gtfs_data['routes_t'].index.names:
-        gtfs_data['routes_t'].reset_index(inplace=True)
-
     routes_t = gtfs_data['routes_t'][['route_id', 'route_short_name']]
     return routes_t
 
@@ -96,183 +95,42 @@ def get_routes_list(gtfs_data):
     return routes_list
 
 
-def get_stops_list_for_route(gtfs_data, route_number):
-    routes_list = get_routes_dict(gtfs_data)
-    
-    matching_routes = routes_list[routes_list['route_short_name'] == str(route_number)]
-    if matching_routes.empty:
+def get_route_id_for_route_number(gtfs_data, route_number):
+    matching_routes = [
+        route_id
+        for vehicle_type in ("bus", "tram")
+        for route_id in get_gtfs_index(gtfs_data, vehicle_type).route_ids_by_short_name.get(str(route_number), ())
+    ]
+    if not matching_routes:
         raise ValueError(f"No route found for route number {route_number}")
     if len(matching_routes) > 1:
         raise ValueError(f"Multiple routes found for route number {route_number}")
-    
-    route_id = matching_routes.iloc[0]['route_id']
-    trips_key = 'trips_a' if len(route_number) == 3 else 'trips_t'
-    stop_times_key = 'stop_times_a' if len(route_number) == 3 else 'stop_times_t'
-    stops_key = 'stops_a' if len(route_number) == 3 else 'stops_t'
-
-    trips = gtfs_data[trips_key]
-    stop_times = gtfs_data[stop_times_key]
-    stops_raw = gtfs_data[stops_key].copy()
-    stops = add_stop_number_to_stop_name(stops_raw, 'bus' if len(route_number) == 3 else 'tram')
-    trips_for_route = trips[trips['route_id'] == route_id]
-    filtered_trips = trips[trips['route_id'] == route_id][['direction_id', 'trip_headsign']].drop_duplicates()
-
-    direction_ids = [0,1]
-    for direction_id in direction_ids:
-        filtered_trips = trips_for_route[trips_for_route['direction_id'] == direction_id]
-
-    if len(route_number) <= 2:
-        test_number = len(filtered_trips['block_id'].drop_duplicates()) + 1
-    else:
-        test_number = 1
-
-    directions_with_trip_headsign_list = []
-    grouped_directions_dict = {} 
-
-    for direction_id in direction_ids:
-        filtered_trips = trips_for_route[trips_for_route['direction_id'] == direction_id]['trip_headsign'].values
-        trip_headsign_counts = Counter(filtered_trips)
-        valid_trip_headsigns = [trip_headsign for trip_headsign, count in trip_headsign_counts.items() if count > test_number]
-        for trip_headsign in valid_trip_headsigns:
-            directions_with_trip_headsign_list.append({direction_id: trip_headsign})
-        grouped_directions_dict[direction_id] = valid_trip_headsigns
-    
-    if 'trip_id' in stop_times.index.names:
-            stop_times = stop_times.reset_index()
-
-    for direction_id, trip_headsigns in grouped_directions_dict.items():
-        longest_stops_dict_length = 0
-        longest_stops_dict = None
-        for trip_headsign in trip_headsigns:
-            filtered_trips = trips_for_route[trips_for_route['trip_headsign'] == trip_headsign]
-            if filtered_trips.empty:
-                continue 
-            trip_ids = filtered_trips['shape_id'].drop_duplicates().index
-            for trip_id in trip_ids:
-                trip_number = trip_id.split("_")[3]
-                if trip_number == '1':
-                    continue
-                stop_times_with_correct_trip_id = stop_times[stop_times['trip_id'] == trip_id]
-                stops_for_all_trips = stop_times_with_correct_trip_id.merge(stops, on='stop_id', how='inner')
-                stops_dict = stops_for_all_trips[['stop_id', 'stop_name']].drop_duplicates().to_dict(orient='records')
-                if len(stops_dict) > longest_stops_dict_length:
-                    longest_stops_dict_length = len(stops_dict)
-                    longest_stops_dict = stops_dict
-
-        grouped_directions_dict[direction_id] = [trip_headsigns, longest_stops_dict]
-    return grouped_directions_dict
+    return matching_routes[0]
 
+def get_stops_list_for_route(gtfs_data, route_number):
+    route_id = get_route_id_for_route_number(gtfs_data, route_number)
+    vehicle_type = 'bus' if len(route_number) == 3 else 'tram'
+    route_stops = get_gtfs_index(gtfs_data, vehicle_type).route_stops
+    # A route looked up in the feed of the other vehicle type has no trips.
+    return route_stops.get(route_id, {0: [[], None], 1: [[], None]})
 
-def get_route_short_name_from_route_id(gtfs_data, route_id, vehicle_type):
+def get_stop_patterns_for_route(gtfs_data, route_number):
+    route_id = get_route_id_for_route_number(gtfs_data, route_number)
+    vehicle_type = 'bus' if len(route_number) == 3 else 'tram'
+    return get_gtfs_index(gtfs_data, vehicle_type).stop_patterns.by_route.get(route_id, {})
 
-    if vehicle_type == "bus":
-        routes_list = get_bus_routes_list(gtfs_data)
-    else:
-        routes_list = get_tram_routes_list(gtfs_data)
 
-    route_short_name = routes_list[routes_list["route_id"] == route_id]["route_short_name"].values[0]
-    return route_short_name
+def get_route_short_name_from_route_id(gtfs_data, route_id, vehicle_type):
+    return get_gtfs_index(gtfs_data, vehicle_type).route_short_name_by_route_id[route_id]
 
 def get_route_short_name_from_trip_id(gtfs_data, trip_id, vehicle_type):
-    if vehicle_type == "bus":
-        routes_list = get_bus_routes_list(gtfs_data)
-        trips_list = gtfs_data["trips_a"]
-    else:
-        routes_list = get_tram_routes_list(gtfs_data)
-        trips_list = gtfs_data["trips_t"]
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
+    trips_list = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
 
-    route_id = trips_list.loc[trip_id]["route_id"]
-    route_short_name = routes_list[routes_list["route_id"] == route_id]["route_short_name"].values[0]
+    route_id = trips_list['route_id'].values[gtfs_index.trip_position(trip_id)]
+    return gtfs_index.route_short_name_by_route_id[route_id]
 
-    return route_short_name
 
-
-def create_csv_with_schedule_numbers(gtfs_data):
-    try:
-        file_path_a = "./services/static/gtfs_data/bus/schedule_numbers_a.txt"
-        file_path_t = "./services/static/gtfs_data/tram/schedule_numbers_t.txt"
-        
-        routes_data_a = gtfs_data['routes_a']
-        trips_data_a = gtfs_data['trips_a']
-        calendar_df_a = gtfs_data['calendar_a']
-        routes_data_t = gtfs_data['routes_t']
-        trips_data_t = gtfs_data['trips_t']
-        calendar_df_t = gtfs_data['calendar_t']
-        
-        schedule_number_df_a = create_df_with_schedule_numbers(routes_data_a, trips_data_a, calendar_df_a)
-        schedule_number_df_a.to_csv(file_path_a, sep=",", index=False) 
-        schedule_number_df_t = create_df_with_schedule_numbers_tram(routes_data_t, trips_data_t, calendar_df_t)
-        schedule_number_df_t.to_csv(file_path_t, sep=",", index=False) 
-
-        return "Data saved"
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-def create_df_with_schedule_numbers_tram(routes_data, trips_data, calendar_df):
-    service_ids = calendar_df['service_id'].tolist()
-    final_schedule_list = []
-    for service_id in service_ids:
-        shedule_list = []
-        block_ids = trips_data[trips_data['service_id'] == service_id]['block_id'].drop_duplicates().values
-        for block_id in block_ids:
-            route_ids = trips_data[trips_data['block_id'] == block_id]['route_id'].drop_duplicates().values
-            if(len(route_ids) > 1):
-                route_id = route_ids[-1]
-            else:
-                route_id = route_ids[0]
-            shedule_list.append({"block_id" : block_id, "route_id": route_id, "service_id" : service_id})
-        
-        sorted_objects = sorted(shedule_list, key=itemgetter('route_id', 'block_id'))
-        route_counters = {}
-        for obj in sorted_objects:
-            route_id = obj['route_id']
-            if route_id not in route_counters:
-                route_counters[route_id] = 1
-            route_short_name = routes_data[routes_data["route_id"] == route_id]["route_short_name"].values[0]
-
-            obj['schedule_number'] = f"{route_short_name}/{route_counters[route_id]:02}"
-            route_counters[route_id] += 1
-            if 'route_id' in obj:
-                del obj['route_id']
-            final_schedule_list.append(obj)
-    schedule_number_df = pd.DataFrame(final_schedule_list)
-    return schedule_number_df
-    
-
-def create_df_with_schedule_numbers(routes_data, trips_data, calendar_df):
-    route_short_names = routes_data['route_short_name'].drop_duplicates().values.tolist()
-    service_ids = calendar_df['service_id'].tolist()
-    shedule_list = []
-
-    for service_id in service_ids:
-        filtered_trips_data = trips_data[trips_data['service_id'] == service_id]
-        block_ids = filtered_trips_data['block_id'].drop_duplicates().values
-        sorted_route_short_names = sorted(route_short_names, key=int)
-        routes_list = []
-        for route_short_name in sorted_route_short_names:
-            route_id = routes_data[routes_data["route_short_name"] == route_short_name]["route_id"].values[0]  
-            block_ids = filtered_trips_data[filtered_trips_data['route_id'] == route_id]['block_id'].drop_duplicates().values.tolist()
-            block_numbers = [block.split('_')[1] for block in block_ids]
-            block_numbers.sort(key=int)
-            if len(block_numbers) > 0:
-                routes_list.append({route_short_name: block_numbers})
-        first_key = next(iter(routes_list[0]))
-        first_block_id = int(routes_list[0][first_key][0])
-        last_bloc = first_block_id - 1
-        for route_block in routes_list:
-            for route, blocks in route_block.items():
-                if blocks:
-                    schedule_num = 1
-                    for block in blocks:
-                        if int(block) == last_bloc + 1:
-                            last_bloc = int(block)
-                            shedule_list.append({"block_id" : f"block_{block}", "schedule_number": f"{route}/{str(schedule_num).zfill(2)}", "service_id" : service_id})
-                            schedule_num += 1
-                            continue
-
-    schedule_number_df = pd.DataFrame(shedule_list)
-    return schedule_number_df
-    
 def get_block_id_list_for_route_short_name(gtfs_data, route_short_name, vehicle_type):
     if vehicle_type == "bus":
         schedule_data = gtfs_data['schedule_num_a']
@@ -282,73 +140,34 @@ def get_block_id_list_for_route_short_name(gtfs_data, route_short_name, vehicle_
     filtered_schedule_data = schedule_data[schedule_data["schedule_number"].str.contains(route_short_name)]
     return filtered_schedule_data.values
 
-def check_for_realtime_data(schedule_number):
+def check_for_realtime_data(schedule_numbers):
+    # Vehicles of every given schedule number, with one query.
+    schedule_numbers = list(dict.fromkeys(
+        schedule_number for schedule_number in schedule_numbers if schedule_number is not None
+    ))
+    if not schedule_numbers:
+        return {}
     with SessionLocal() as session:
-        return get_vehicle_ids_with_timestamps_by_schedule_number(session, schedule_number)
-    return None
-
-def adjust_end_time(end_time):
-    time_parts = end_time.split(":")
-    hours = int(time_parts[0])
-    minutes = int(time_parts[1])
-
-    if hours >= 24:
-        hours -= 24
-
-    return f"{hours:02}:{minutes:02}"
+        return get_vehicle_ids_with_timestamps_by_schedule_numbers(session, schedule_numbers)
 
 def get_schedule_data(gtfs_data, route_name):
     vehicle_type = 'tram' if len(route_name) < 3 else 'bus'
-    routes_data = gtfs_data[f'routes_{"t" if vehicle_type == "tram" else "a"}']
-    trips_data = gtfs_data[f'trips_{"t" if vehicle_type == "tram" else "a"}']
-    stop_times_data = gtfs_data[f'stop_times_{"t" if vehicle_type == "tram" else "a"}']
-    calendar_data = gtfs_data[f'calendar_{"t" if vehicle_type == "tram" else "a"}']
-    if 'route_id' in routes_data.index.names:
-        routes_data.reset_index(inplace=True)
-    route_id = routes_data.loc[routes_data['route_short_name'] == route_name, 'route_id'].iloc[0]
-    filtered_data = trips_data[trips_data['route_id'] == route_id]
-
-    block_ids = filtered_data['block_id'].drop_duplicates().tolist()
-    sorted_block_ids = sorted(block_ids, key=lambda x: int(x.split('_')[1]))
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
+    route_id = gtfs_index.route_ids_by_short_name[route_name][0]
+    blocks = gtfs_index.block_summaries.for_route(route_id)
 
-    schedule_number_list = []
     today = datetime.today().strftime('%A').lower()
+    vehicles_by_schedule_number = check_for_realtime_data(
+        block['schedule_number'] for block in blocks if today in block['service_days']
+    )
 
-    for block_id in sorted_block_ids:
-        block_filtered_data = trips_data[trips_data['block_id'] == block_id]
-
-        route_short_names_list = [
-            get_route_short_name_from_route_id(gtfs_data, route_id, vehicle_type)
-            for route_id in block_filtered_data['route_id'].drop_duplicates()
-        ]
-
-        service_id = block_filtered_data['service_id'].iloc[0]
-        schedule_number = get_schedule_number_from_block_id(gtfs_data, block_id, service_id, vehicle_type)
-        
-        first_trip_id = block_filtered_data.index[0]
-        last_trip_id = block_filtered_data.index[-1]
-        start_value = stop_times_data.loc[first_trip_id, 'departure_time']
-        end_value = stop_times_data.loc[last_trip_id, 'departure_time']
-
-        start_time = start_value if isinstance(start_value, str) else start_value.iloc[0]
-        end_time = end_value if isinstance(end_value, str) else end_value.iloc[0]
-
-        adjusted_end_time = adjust_end_time(end_time)
-
-        service_day = calendar_data[calendar_data['service_id'] == service_id]
-        days_with_service = service_day.loc[:, service_day.iloc[0] == 1].columns.tolist()
-
-        vehicle_list = check_for_realtime_data(schedule_number) if today in days_with_service else None
-
+    schedule_number_list = []
+    for block in blocks:
         schedule_number_list.append({
-            'block_id': block_id,
-            'schedule_number': schedule_number,
-            'service_id': service_id,
-            'start_time': start_time,
-            'end_time': adjusted_end_time,
-            'service_days': days_with_service,
-            'route_short_names': route_short_names_list,
-            'vehicles': vehicle_list
+            **block,
+            'service_days': list(block['service_days']),
+            'route_short_names': list(block['route_short_names']),
+            'vehicles': vehicles_by_schedule_number.get(block['schedule_number'], []) if today in block['service_days'] else None
         })
 
     return schedule_number_list
@@ -365,8 +184,8 @@ def get_trips_data_from_vehicle_type(gtfs_data, vehicle_type):
 def get_schedule_route_short_name(gtfs_data, trip_id, vehicle_type):
     block_id = "_".join(trip_id.split("_")[:2])
     trips_data = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
-    filtered_data = trips_data[trips_data['block_id'] == block_id]
-    route_ids = filtered_data['route_id'].values
+    block_rows = get_gtfs_index(gtfs_data, vehicle_type).trips_by_block.get(block_id)
+    route_ids = np.asarray(trips_data['route_id'].values[block_rows], dtype=object)
     counter = Counter(route_ids)
     schedule_route_id = counter.most_common(1)[0][0]
 
@@ -384,21 +203,19 @@ def get_schedule_from_block_id(gtfs_data, schedule_number, service_id):
 
     block_id = get_block_id_from_schedule_number(gtfs_data, schedule_number, vehicle_type, service_id)
     trips_data = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
     result = []
-    filtered_data = trips_data[trips_data['block_id'] == block_id]
-
-    if 'trip_id' in filtered_data.index.names:
-        filtered_data = filtered_data.reset_index(drop=False)
-    if 'trip_id' not in stop_times.index.names:
-        stop_times = stop_times.set_index('trip_id')
-    for row in filtered_data.values:
-        route_id = row[1]
+    block_rows = gtfs_index.trips_by_block.get(block_id)
+    departure_times = stop_times['departure_time'].values
+
+    for row in block_rows:
+        route_id = trips_data['route_id'].values[row]
         route_short_name = get_route_short_name_from_route_id(gtfs_data, route_id, vehicle_type)
-        trip_id = row[0]
-        trip_headsign = row[3]
-        filted_stop_times = stop_times.loc[trip_id]['departure_time'].values.tolist()
-        first_stop_time = filted_stop_times[0]
-        last_stop_time = filted_stop_times[-1]
+        trip_id = trips_data.index[row]
+        trip_headsign = trips_data['trip_headsign'].values[row]
+        stop_rows = gtfs_index.stop_times_by_trip.get(trip_id)
+        first_stop_time = departure_times[stop_rows[0]]
+        last_stop_time = departure_times[stop_rows[-1]]
         result.append({
             'trip_id': trip_id,
             'trip_headsign': trip_headsign,
@@ -406,26 +223,28 @@ def get_schedule_from_block_id(gtfs_data, schedule_number, service_id):
             'first_stop_time': first_stop_time,
             'last_stop_time': last_stop_time,
             })
-    if filtered_data.empty:
+    if len(block_rows) == 0:
         raise ValueError(f"No data found for block_id {block_id}")
 
     return result
 
 def get_block_ids_from_route_id(gtfs_data, route_id, vehicle_type):
     trips_data = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
-    filtered_data = trips_data[trips_data['route_id'] == route_id]
+    route_rows = get_gtfs_index(gtfs_data, vehicle_type).trips_by_route.get(route_id)
 
-    if filtered_data.empty:
+    if len(route_rows) == 0:
         raise ValueError(f"No data found for route_id {route_id}")
 
-    block_ids = sorted(set(filtered_data['block_id'].values))
+    block_ids = sorted(set(trips_data['block_id'].values[route_rows]))
     return block_ids
 
 def get_route_id_from_route_number(gtfs_data, route_number):
-    routes_list = get_routes_list(gtfs_data)
-    route_id = routes_list[routes_list["route_short_name"] == route_number]["route_id"].values[0]
+    for vehicle_type in ("bus", "tram"):
+        route_ids = get_gtfs_index(gtfs_data, vehicle_type).route_ids_by_short_name.get(route_number)
+        if route_ids:
+            return route_ids[0]
 
-    return route_id
+    raise ValueError(f"No route found for route number {route_number}")
 
 def get_service_data(gtfs_data, route_number):
     if(len(route_number) >= 3):
@@ -441,60 +260,31 @@ def get_service_data(gtfs_data, route_number):
     return service_list
 
 
-def get_timetable_data(gtfs_data, route_number, direction, stop_id, service_id):
+def get_route_timetables_index(gtfs_data, route_number):
+    vehicle_type = "bus" if len(route_number) >= 3 else "tram"
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
+    route_id = get_route_id_from_route_number(gtfs_data, route_number)
+    if len(gtfs_index.trips_by_route.get(route_id)) == 0:
+        raise ValueError(f"No data found for route_id {route_id}")
+    return gtfs_index.timetables, route_id
 
-    if(len(route_number) >= 3):
-        stop_times_data = gtfs_data['stop_times_a']
-        trips_data = gtfs_data['trips_a']
-        block_ids = get_block_ids_from_route_id(gtfs_data, get_route_id_from_route_number(gtfs_data, route_number), "bus")
-    else:
-        stop_times_data = gtfs_data['stop_times_t']
-        trips_data = gtfs_data['trips_t']
-        block_ids = get_block_ids_from_route_id(gtfs_data, get_route_id_from_route_number(gtfs_data, route_number), "tram")
-
-
-    if 'trip_id' in stop_times_data.index.names:
-        stop_times_data.reset_index(inplace=True)
-    filtred_stop_times_data = stop_times_data[stop_times_data['stop_id'] == stop_id]
-    filtred_df = filtred_stop_times_data[['departure_time', 'stop_id', 'trip_id']].copy()
-    trips_data = trips_data['direction_id']
-    merged_df = pd.merge(filtred_df, trips_data, on="trip_id", how="left")
-    if 'trip_id' not in merged_df.index.names:
-        merged_df = merged_df.set_index('trip_id')
-    merged_df['block_id'] = merged_df.index.str.split('_').str[:2].str.join('_')
-    merged_df['trip_number'] = merged_df.index.str.split('_').str[3:4].str.join('_')
-    merged_df['service_id'] = merged_df.index.str.split('_').str[5:].str.join('_')
-    merged_df = merged_df[(merged_df['block_id'].isin(block_ids)) & ("service_" + merged_df['service_id'] == service_id)]
-    if direction == 0:
-        filtred_merged_df = merged_df[merged_df['direction_id'] == 0]
-    elif direction == 1:
-        filtred_merged_df = merged_df[merged_df['direction_id'] == 1]
-    
-    time_list  = filtred_merged_df['departure_time'].values.tolist()
-    time_list.sort()
-    time_dict = defaultdict(list)
+def get_timetable_data(gtfs_data, route_number, direction, stop_id, service_id):
+    timetables, route_id = get_route_timetables_index(gtfs_data, route_number)
+    return timetables.timetable(route_id, direction, service_id, stop_id)
 
-    for time in time_list:
-        hour, minute, _ = time.split(":")
-        time_dict[int(hour)].append(int(minute))
-    return time_dict 
+def get_route_timetables_data(gtfs_data, route_number, direction, service_id):
+    timetables, route_id = get_route_timetables_index(gtfs_data, route_number)
+    return timetables.route_timetables(route_id, direction, service_id)
 
 def get_schedule_number_from_block_id(gtfs_data, block_id, service_id, vehicle_type):
-    schedule_data = gtfs_data['schedule_num_a'] if vehicle_type == "bus" else gtfs_data['schedule_num_t']
-    filtered_data = schedule_data[(schedule_data['block_id'] == block_id) & (schedule_data['service_id'] == service_id)]
-    if not filtered_data.empty:
-        return filtered_data.iloc[0]['schedule_number'] 
-
-    return None
+    return get_gtfs_index(gtfs_data, vehicle_type).schedule_number_by_block.get((block_id, service_id))
 
 
 def get_routes_list_from_block_id(gtfs_data, vehicle_type, block_id):
-    if vehicle_type == "bus":
-        trips_data = gtfs_data['trips_a']
-    else:
-        trips_data = gtfs_data['trips_t']
+    trips_data = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
+    block_rows = get_gtfs_index(gtfs_data, vehicle_type).trips_by_block.get(block_id)
 
-    routes_list = trips_data[trips_data['block_id'] == block_id]['route_id'].unique()
+    routes_list = pd.unique(np.asarray(trips_data['route_id'].values[block_rows], dtype=object))
     route_short_names_list = []
     for route_id in routes_list:
         route_short_name = get_route_short_name_from_route_id(gtfs_data, route_id, vehicle_type)
@@ -514,77 +304,40 @@ def get_stops_list(gtfs_data):
     return sorted_list
 
 def get_stops_list_with_location(gtfs_data):
-    stops_data_a = gtfs_data['stops_a'].copy()
-    stops_data_t = gtfs_data['stops_t'].copy()
-    stops_data_a = add_stop_number_to_stop_name(stops_data_a, "bus")
-    stops_data_t = add_stop_number_to_stop_name(stops_data_t, "tram")
-    if 'stop_id' in stops_data_a.index.names:
-        stops_data_a.reset_index(inplace=True)
-    if 'stop_id' in stops_data_t.index.names:
-        stops_data_t.reset_index(inplace=True)
-    stops_data_a['type'] = "bus"
-    stops_data_t['type'] = "tram"
-    stops_list_a = stops_data_a[['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'type']]
-    stops_list_t = stops_data_t[['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'type']]
-
-    stops_list = pd.concat([stops_list_a, stops_list_t], ignore_index=True)
-    return stops_list
-
-def add_stop_number_to_stop_name(stops_data, vehicle_type):
-    if vehicle_type == "bus":
-        number_index = -1 
-    else:
-        number_index = -2  
-    
-    def add_number(row):
-        try:
-            stop_number = int(row['stop_id'][number_index]) 
-            stop_number_str = str(stop_number).zfill(2) 
-            if row['stop_name'].endswith(f" ({stop_number_str})"):
-                return row['stop_name'] 
-            else:
-                return f"{row['stop_name']} ({stop_number_str})"
-        except (ValueError, IndexError):
-            return row['stop_name']  
-
-    stops_data['stop_name'] = stops_data.apply(add_number, axis=1)
-    
-    return stops_data
+    return gtfs_data['stop_locations']
+
+def get_shape_id_for_trip_id(gtfs_data, trip_id, vehicle_type):
+    trips_data = get_trips_data_from_vehicle_type(gtfs_data, vehicle_type)
+    return trips_data['shape_id'].values[get_gtfs_index(gtfs_data, vehicle_type).trip_position(trip_id)]
 
 def get_shape_list_for_trip_id(gtfs_data, trip_id, vehicle_type):
-    if vehicle_type == "bus":
-        trips_data = gtfs_data['trips_a']
-        shapes_data = gtfs_data['shapes_a']
-    else:
-        trips_data = gtfs_data['trips_t']
-        shapes_data = gtfs_data['shapes_t']
+    shape_id = get_shape_id_for_trip_id(gtfs_data, trip_id, vehicle_type)
+    return get_gtfs_index(gtfs_data, vehicle_type).shapes.points(shape_id)
 
-    shape_id = trips_data.loc[trip_id].shape_id
-    filtred_shapes_data = shapes_data[shapes_data['shape_id'] == shape_id]
-    shapes_list = filtred_shapes_data[['shape_pt_sequence', 'shape_pt_lat', 'shape_pt_lon']]
-    return shapes_list
+def get_shape_polyline_for_trip_id(gtfs_data, trip_id, vehicle_type, zoom):
+    shape_id = get_shape_id_for_trip_id(gtfs_data, trip_id, vehicle_type)
+    polyline = get_gtfs_index(gtfs_data, vehicle_type).shapes.polyline(shape_id, zoom)
+    if polyline is None:
+        return None
+    shape_zoom, encoded_polyline = polyline
+    return {
+        'shape_id': shape_id,
+        'zoom': shape_zoom,
+        'polyline': encoded_polyline
+    }
 
 def get_stops_list_for_trip_with_delay(gtfs_data, vehicle_type, trip_id):
-    if vehicle_type == "bus":
-        stops = gtfs_data['stops_a']
-        stops_raw = gtfs_data['stops_a'].copy()
-        stops = add_stop_number_to_stop_name(stops_raw, 'bus')
-        stop_times = gtfs_data['stop_times_a']
-    else:
-        stops = gtfs_data['stops_t']
-        stops_raw = gtfs_data['stops_t'].copy()
-        stops = add_stop_number_to_stop_name(stops_raw, 'tram')
-        stop_times = gtfs_data['stop_times_t']
+    stop_times = gtfs_data['stop_times_a'] if vehicle_type == "bus" else gtfs_data['stop_times_t']
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
 
-    if 'trip_id' not in stop_times.index.names:
-        stop_times = stop_times.set_index('trip_id')
-    stop_times_filtred = stop_times.loc[trip_id]
+    stop_rows = gtfs_index.stop_times_by_trip.get(trip_id)
+    stop_ids = np.asarray(stop_times['stop_id'].values[stop_rows], dtype=object)
+    departure_times = np.asarray(stop_times['departure_time'].values[stop_rows], dtype=object)
 
-    stop_times_filtred.loc[:, 'stop_id'] = stop_times_filtred['stop_id'].astype(str) 
-    stops['stop_id'] = stops['stop_id'].astype(str)  
-    stop_times_filtred = stop_times_filtred.merge(stops[['stop_name', 'stop_id']], on='stop_id', how='left')
-
-    return stop_times_filtred[['stop_id', 'stop_name', 'departure_time']].values.tolist()
+    return [
+        [str(stop_id), gtfs_index.stop_display_name_by_id.get(stop_id), departure_time]
+        for stop_id, departure_time in zip(stop_ids, departure_times)
+    ]
 
 
 def get_today_service_id(gtfs_data):
@@ -597,97 +350,47 @@ def get_today_service_id(gtfs_data):
 
 def get_stop_details(gtfs_data, stop_name):
     service_id = get_today_service_id(gtfs_data)
-    stops_data_a = gtfs_data['stops_a']
-    stops_data_t = gtfs_data['stops_t']
-    stop_times_a = gtfs_data['stop_times_a']
-    stop_times_t = gtfs_data['stop_times_t']
-    trips_a = gtfs_data['trips_a']
-    trips_t = gtfs_data['trips_t']
-
-
-    if 'trip_id' not in stop_times_a.index.names:
-        stop_times_a = stop_times_a.set_index('trip_id')
-    if 'trip_id' not in stop_times_t.index.names:
-        stop_times_t = stop_times_t.set_index('trip_id')
-
-    stop_ids_a = stops_data_a[stops_data_a['stop_name'] == stop_name]['stop_id'].values.tolist()
-    stop_ids_t = stops_data_t[stops_data_t['stop_name'] == stop_name]['stop_id'].values.tolist()
 
     depature_list = []
     schedule_number_list = []
 
-    def process_stop_times(stop_ids, stop_times, transport_type):
-        
-        stop_number = None
-
-        now = datetime.now()
-        min_time = now - timedelta(minutes=20)  
-
-        for stop_id in stop_ids:
-            filtered_data = stop_times[stop_times['stop_id'] == stop_id]
-            for index, row in filtered_data.iterrows():
-                trip_id_parts = index.split('_')
-
-                if trip_id_parts[5] == service_id:
-                    if transport_type == "bus":
-                        number_index = -1
-                        trip_data = trips_a
-                    else:
-                        number_index = -2
-                        trip_data = trips_t
-
-                    try:
-                        stop_number = int(stop_id[number_index])
-                    except (ValueError, IndexError):
-                        stop_number = None
-
-                    departure_time = row['departure_time']
-                    departure_time_without_seconds = ':'.join(departure_time.split(':')[:2])
-
-                    try:
-                        dep_hour, dep_minute = map(int, departure_time_without_seconds.split(':'))
-
-                        if dep_hour >= 24:
-                            dep_hour -= 24 
-
-                        dep_time = now.replace(hour=dep_hour, minute=dep_minute, second=0, microsecond=0)
-
-                        if dep_time >= min_time: 
-                            route_id = trip_data.loc[index].route_id
-                            route_short_name = get_route_short_name_from_route_id(gtfs_data, route_id, transport_type)
-                            trip_headsign = trip_data.loc[index].trip_headsign
-
-                            schedule_number = get_schedule_number_from_trip_id(gtfs_data, index, transport_type)
-                            schedule_number_list.append(schedule_number)
-                            depature_list.append({
-                                'route_short_name': route_short_name,
-                                'trip_headsign': trip_headsign,
-                                'schedule_number': schedule_number,
-                                'departure_time': departure_time_without_seconds,
-                                'stop_number': stop_number,
-                                'vehicle_id': None, 
-                                'delay': None  
-                            })
-                    except ValueError:
-                        continue 
-
-    process_stop_times(stop_ids_a, stop_times_a, "bus")
-    process_stop_times(stop_ids_t, stop_times_t, "tram")
+    now = datetime.now()
+    min_time = now - timedelta(minutes=20)
+    if min_time.date() < now.date():
+        from_seconds = 0
+    else:
+        from_seconds = min_time.hour * 3600 + min_time.minute * 60 + min_time.second + (min_time.microsecond > 0)
+
+    for transport_type in ("bus", "tram"):
+        gtfs_index = get_gtfs_index(gtfs_data, transport_type)
+        number_index = -1 if transport_type == "bus" else -2
+
+        for stop_id in gtfs_index.stop_ids_by_name.get(stop_name, ()):
+            try:
+                stop_number = int(stop_id[number_index])
+            except (ValueError, IndexError):
+                stop_number = None
+
+            for departure in gtfs_index.stop_departures.departures(stop_id, service_id, from_seconds):
+                schedule_number_list.append(departure['schedule_number'])
+                departure.update({
+                    'stop_number': stop_number,
+                    'vehicle_id': None,
+                    'delay': None
+                })
+                depature_list.append(departure)
 
     from ..realtime.realtime_service import get_realtime_stop_details
     list_test = get_realtime_stop_details(gtfs_data, schedule_number_list)
+    realtime_by_schedule_number = {}
+    for entry in list_test:
+        realtime_by_schedule_number.setdefault(entry['schedule_number'], entry)
 
     for departure in depature_list:
-        schedule_number = departure['schedule_number']
-        
-        matching_entry = next((entry for entry in list_test if entry['schedule_number'] == schedule_number), None)
-        
+        matching_entry = realtime_by_schedule_number.get(departure['schedule_number'])
         if matching_entry:
             departure['vehicle_id'] = matching_entry['vehicle_id']
             departure['delay'] = matching_entry['delay']
-        else:
-            departure['vehicle_id'] = None
-            departure['delay'] = None
 
     depature_list.sort(key=lambda x: x['departure_time'])
 
@@ -697,57 +400,36 @@ def get_schedule_number_from_trip_id(gtfs_data, trip_id, vehicle_type):
     parts = trip_id.split("_")
     block_id = f"block_{parts[1]}".strip()
     service_id = f"service_{parts[5]}".strip()
-    if vehicle_type == "bus":
-        schedule_numbers = gtfs_data['schedule_num_a']
-    else:
-        schedule_numbers = gtfs_data['schedule_num_t']
-    schedule_number = schedule_numbers[
-        (schedule_numbers['block_id'] == block_id) &
-        (schedule_numbers['service_id'] == service_id)
-    ]['schedule_number'].values[0]
-    return schedule_number
+    return get_gtfs_index(gtfs_data, vehicle_type).schedule_number_by_block[(block_id, service_id)]
 
 def get_block_id_from_schedule_number(gtfs_data, schedule_number, vehicle_type, service_id):
     full_service_id = f"service_{service_id}"
-    if vehicle_type == "bus":
-        schedule_numbers = gtfs_data['schedule_num_a']
-    else:
-        schedule_numbers = gtfs_data['schedule_num_t']
-
-    matching_rows = schedule_numbers[
-        (schedule_numbers['schedule_number'] == schedule_number) &
-        (schedule_numbers['service_id'] == full_service_id)
-    ]
-
-    if matching_rows.empty:
-        return None
-
-    return matching_rows.iloc[0]['block_id']
+    return get_gtfs_index(gtfs_data, vehicle_type).block_by_schedule_number.get((schedule_number, full_service_id))
 
 def get_trips_data_for_block(gtfs_data, block_id, service_id, vehicle_type):
     full_service_id = f"service_{service_id}"
     if vehicle_type == "bus":
         stop_times = gtfs_data['stop_times_a']
         trips_data = gtfs_data['trips_a']
-        stops_data = gtfs_data['stops_a']
     else:
         stop_times = gtfs_data['stop_times_t']
         trips_data = gtfs_data['trips_t']
-        stops_data = gtfs_data['stops_t']
 
-    if 'trip_id' not in stop_times.index.names:
-        stop_times = stop_times.set_index('trip_id')
+    gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
+    stop_ids = stop_times['stop_id'].values
+    departure_times = stop_times['departure_time'].values
     response_data = []
 
-    trip_id_list = trips_data[(trips_data['block_id'] == block_id) & (trips_data['service_id'] == full_service_id)].index.tolist()
+    trip_id_list = trips_data.index[gtfs_index.trip_rows_for_block(trips_data, block_id, full_service_id)].tolist()
 
     for trip_id in trip_id_list:
         route_name = get_route_short_name_from_trip_id(gtfs_data, trip_id, vehicle_type)
         trip_id_parts = trip_id.split('_')
         trip_number = trip_id_parts[3]
-        filtred_data = stop_times.loc[trip_id][['stop_id', 'departure_time']].values.tolist()
-        for row in filtred_data:
-            row.append(stops_data[stops_data['stop_id'] == row[0]]['stop_name'].values[0])
+        filtred_data = [
+            [stop_ids[row], departure_times[row], gtfs_index.stop_name_by_id[stop_ids[row]]]
+            for row in gtfs_index.stop_times_by_trip.get(trip_id)
+        ]
         response_data.append({
             'trip_id':trip_id,
             'trip_number':trip_number,
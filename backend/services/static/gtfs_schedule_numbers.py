@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+# Schedule numbers ("route/NN") of every (block, service) of a feed, for
+# all services at once. Both functions take the raw routes, trips and
+# calendar tables and return the same rows, in the same order, as numbering
+# one service after another in calendar order.
+
+
+def service_positions(calendar, service_ids):
+    positions = pd.Series(np.arange(len(calendar)), index=calendar['service_id'].values)
+    positions = positions[~positions.index.duplicated()]
+    return positions.reindex(service_ids).values
+
+
+def trip_columns(trips):
+    # Plain object columns, so categoricals of the loaded model sort and
+    # group by value like the raw CSV columns.
+    trips = trips.reset_index() if 'trip_id' in trips.index.names else trips
+    return pd.DataFrame({column: np.asarray(trips[column], dtype=object) for column in ['service_id', 'route_id', 'block_id']})
+
+
+def route_short_names(routes):
+    # The first row of a route_id wins, like a mask followed by .values[0].
+    routes = routes.drop_duplicates('route_id')
+    return pd.Series(routes['route_short_name'].astype(str).values, index=routes['route_id'].values)
+
+
+def create_schedule_numbers_bus(routes, trips, calendar):
+    # Routes are taken in numeric order of their short name, with the first
+    # route_id of each short name. Blocks are numbered per route in numeric
+    # order, but only while they continue the sequence of block numbers
+    # started by the first block of the service; the others get no number.
+    short_names = pd.Series(pd.unique(routes['route_short_name'].astype(str)))
+    short_names = short_names.iloc[np.argsort(short_names.astype(int).values, kind='stable')]
+    first_routes = routes.assign(route_short_name=routes['route_short_name'].astype(str)).drop_duplicates('route_short_name')
+    route_rank = pd.Series(np.arange(len(short_names)), index=first_routes.set_index('route_short_name').loc[short_names.values, 'route_id'].values)
+
+    pairs = trip_columns(trips).dropna().drop_duplicates()
+    pairs = pairs.assign(
+        service_position=service_positions(calendar, pairs['service_id'].values),
+        route_rank=route_rank.reindex(pairs['route_id'].values).values,
+    ).dropna(subset=['service_position', 'route_rank'])
+    block_numbers = pairs['block_id'].astype(str).str.split('_').str[1]
+    pairs = pairs.assign(block_number=block_numbers, block_value=block_numbers.astype(int))
+    pairs = pairs.sort_values(['service_position', 'route_rank', 'block_value'], kind='stable')
+
+    service_ids = pairs['service_id'].values
+    ranks = pairs['route_rank'].values
+    numbers = pairs['block_value'].values
+    block_numbers = pairs['block_number'].values
+    short_name_by_rank = short_names.values
+    rows = []
+    last_block = last_service = last_rank = None
+    for position in range(len(pairs)):
+        # Whether a block gets a number depends on the last block that got
+        # one, so this last step is a single scan over the sorted pairs.
+        if service_ids[position] != last_service:
+            last_service = service_ids[position]
+            last_block = numbers[position] - 1
+            last_rank = None
+        if ranks[position] != last_rank:
+            last_rank = ranks[position]
+            schedule_num = 1
+        if numbers[position] == last_block + 1:
+            last_block = numbers[position]
+            rows.append((
+                f"block_{block_numbers[position]}",
+                f"{short_name_by_rank[int(ranks[position])]}/{str(schedule_num).zfill(2)}",
+                last_service,
+            ))
+            schedule_num += 1
+
+    return pd.DataFrame(rows, columns=['block_id', 'schedule_number', 'service_id'])
+
+
+def create_schedule_numbers_tram(routes, trips, calendar):
+    # A block belongs to the route it switches to last (the last distinct
+    # route among all of its trips, in file order). Blocks are numbered per
+    # route in order of block_id, separately for every service.
+    trips = trip_columns(trips)
+    block_routes = trips[['block_id', 'route_id']].dropna().drop_duplicates().groupby('block_id', sort=False)['route_id'].last()
+
+    blocks = trips[['service_id', 'block_id']].dropna().drop_duplicates()
+    blocks = blocks.assign(
+        route_id=block_routes.reindex(blocks['block_id'].values).values,
+        service_position=service_positions(calendar, blocks['service_id'].values),
+    ).dropna(subset=['service_position'])
+    blocks = blocks.sort_values(['service_position', 'route_id', 'block_id'], kind='stable')
+
+    counters = blocks.groupby(['service_position', 'route_id'], sort=False).cumcount() + 1
+    short_names = route_short_names(routes).reindex(blocks['route_id'].values).values
+    schedule_numbers = [f"{short_name}/{counter:02}" for short_name, counter in zip(short_names, counters.values)]
+    return pd.DataFrame({
+        'block_id': blocks['block_id'].values,
+        'service_id': blocks['service_id'].values,
+        'schedule_number': schedule_numbers,
+    })
+
+
+def update_schedule_numbers(builder, routes, trips, calendar, previous_numbers, changes):
+    # The schedule numbers of a new version of a feed from those of the
+    # previous one: only the services of the change set are numbered again,
+    # the rows of the others are taken over. Every service is numbered again
+    # when routes changed, since all of them are numbered by route.
+    if changes.changed['routes']:
+        return builder(routes, trips, calendar)
+
+    calendar_services = np.asarray(calendar['service_id'].values, dtype=object)
+    renumbered = builder(routes, trips, calendar[pd.Index(calendar_services).isin(changes.services)])
+    kept = previous_numbers[
+        ~pd.Index(np.asarray(previous_numbers['service_id'].values, dtype=object)).isin(changes.services)
+        & pd.Index(np.asarray(previous_numbers['service_id'].values, dtype=object)).isin(calendar_services)
+    ]
+    kept = pd.DataFrame({column: np.asarray(kept[column].values, dtype=object) for column in renumbered.columns})
+    schedule_numbers = pd.concat([kept, renumbered], ignore_index=True)
+    # Rows of a service stay together, services in calendar order.
+    order = np.argsort(service_positions(calendar, schedule_numbers['service_id'].values), kind='stable')
+    return schedule_numbers.iloc[order].reset_index(drop=True)
@@ -0,0 +1,191 @@
+import math
+import numpy as np
+import pandas as pd
+from services.static.gtfs_departures import category_codes
+
+# Map zoom levels shapes are simplified for. Every level drops the points
+# that move the line by less than one pixel at that zoom, so a client gets
+# the level at or above its own zoom.
+SHAPE_ZOOM_LEVELS = (10, 12, 14, 16, 18)
+SHAPE_MAX_ZOOM = 24
+METRES_PER_PIXEL_AT_ZOOM_0 = 156543.03
+
+
+def metres_per_pixel(zoom, latitude):
+    return METRES_PER_PIXEL_AT_ZOOM_0 * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+def segment_distances(x, y, points, starts, ends):
+    # Distance of every point to the segment between its start and end.
+    dx = x[ends] - x[starts]
+    dy = y[ends] - y[starts]
+    px = x[points] - x[starts]
+    py = y[points] - y[starts]
+    lengths = dx * dx + dy * dy
+    t = np.clip(np.divide(px * dx + py * dy, lengths, out=np.zeros_like(lengths), where=lengths > 0), 0, 1)
+    return np.hypot(px - t * dx, py - t * dy)
+
+
+def simplification_tolerances(x, y, offsets, min_tolerance):
+    # Douglas-Peucker for all shapes at once, one level of the recursion per
+    # step. Every point gets the largest tolerance it survives, so the line
+    # simplified with tolerance t is the points with a tolerance above t.
+    tolerances = np.zeros(len(x))
+    lengths = np.diff(offsets)
+    tolerances[offsets[:-1][lengths > 0]] = np.inf
+    tolerances[offsets[1:][lengths > 0] - 1] = np.inf
+
+    starts = offsets[:-1][lengths > 2]
+    ends = offsets[1:][lengths > 2] - 1
+    limits = np.full(len(starts), np.inf)
+    while len(starts):
+        counts = ends - starts - 1
+        segments = np.repeat(np.arange(len(starts)), counts)
+        points = np.arange(len(segments)) - np.repeat(np.cumsum(counts) - counts, counts) + starts[segments] + 1
+        distances = segment_distances(x, y, points, starts[segments], ends[segments])
+
+        first_points = np.cumsum(counts) - counts
+        max_distances = np.maximum.reduceat(distances, first_points)
+        farthest = distances == max_distances[segments]
+        _, farthest_positions = np.unique(segments[farthest], return_index=True)
+        splits = points[np.flatnonzero(farthest)[farthest_positions]]
+
+        split = max_distances > min_tolerance
+        splits, limits = splits[split], np.minimum(max_distances[split], limits[split])
+        starts, ends = starts[split], ends[split]
+        tolerances[splits] = limits
+
+        starts, ends, limits = np.r_[starts, splits], np.r_[splits, ends], np.r_[limits, limits]
+        keep = ends - starts > 1
+        starts, ends, limits = starts[keep], ends[keep], limits[keep]
+    return tolerances
+
+
+def encode_polylines(lats, lons, offsets):
+    # Encoded polyline strings (precision 5) of all shapes at once, as one
+    # string and the offsets of every shape in it.
+    coordinates = np.round(np.column_stack([lats, lons]).astype(np.float64) * 1e5).astype(np.int64)
+    deltas = np.diff(coordinates, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    shape_starts = offsets[:-1][np.diff(offsets) > 0]
+    deltas[shape_starts] = coordinates[shape_starts]
+
+    values = deltas.reshape(-1) << 1
+    values = np.where(deltas.reshape(-1) < 0, ~values, values)
+    chunk_count = 7
+    shifted = values[:, None] >> (5 * np.arange(chunk_count))
+    present = shifted > 0
+    present[:, 0] = True
+    more = np.zeros_like(present)
+    more[:, :-1] = present[:, 1:]
+    characters = ((shifted & 31) | np.where(more, 32, 0)) + 63
+
+    text = characters[present].astype(np.uint8).tobytes().decode('ascii')
+    point_lengths = present.sum(axis=1).reshape(-1, 2).sum(axis=1)
+    text_offsets = np.r_[0, np.cumsum(point_lengths)][offsets]
+    return text, text_offsets
+
+
+def compile_shapes(shapes):
+    # Points of every shape ordered by shape_pt_sequence, the coarsest zoom
+    # level each point is kept at, and the encoded polylines of every shape
+    # for each of SHAPE_ZOOM_LEVELS, compiled with the feed tables so the
+    # snapshot stores them and every worker maps the same pages.
+    shape_codes, shape_ids = category_codes(shapes['shape_id'].values)
+    sequences = shapes['shape_pt_sequence'].values
+    rows = np.flatnonzero(shape_codes >= 0)
+    rows = rows[np.lexsort((sequences[rows], shape_codes[rows]))]
+    offsets = np.zeros(len(shape_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(shape_codes[rows], minlength=len(shape_ids)), out=offsets[1:])
+    lats = shapes['shape_pt_lat'].values[rows]
+    lons = shapes['shape_pt_lon'].values[rows]
+
+    latitude = float(np.mean(lats)) if len(rows) else 0.0
+    x = lons.astype(np.float64) * 111320 * math.cos(math.radians(latitude))
+    y = lats.astype(np.float64) * 110574
+    tolerances = simplification_tolerances(x, y, offsets, metres_per_pixel(SHAPE_ZOOM_LEVELS[-1], latitude))
+
+    # Levels are ordered from the coarsest, and a point kept at one level is
+    # kept at all finer ones. The polylines of all levels are one string;
+    # every shape has a start and end in it per level.
+    point_levels = np.full(len(rows), len(SHAPE_ZOOM_LEVELS), dtype=np.int8)
+    for level, zoom in reversed(list(enumerate(SHAPE_ZOOM_LEVELS))):
+        point_levels[tolerances > metres_per_pixel(zoom, latitude)] = level
+    groups = {
+        'shape_id': np.asarray(shape_ids, dtype=object),
+        'start': offsets[:-1],
+        'end': offsets[1:],
+    }
+    texts = []
+    text_length = 0
+    for level in range(len(SHAPE_ZOOM_LEVELS)):
+        kept = point_levels <= level
+        text, text_offsets = encode_polylines(lats[kept], lons[kept], np.r_[0, np.cumsum(kept)][offsets])
+        groups[f'polyline_start_{level}'] = text_offsets[:-1] + text_length
+        groups[f'polyline_end_{level}'] = text_offsets[1:] + text_length
+        texts.append(text)
+        text_length += len(text)
+    return {
+        'shape_points': pd.DataFrame({
+            'shape_pt_sequence': sequences[rows],
+            'shape_pt_lat': lats,
+            'shape_pt_lon': lons,
+            'level': point_levels,
+        }),
+        'shape_groups': pd.DataFrame(groups),
+        'shape_polylines': pd.DataFrame({'character': np.frombuffer(''.join(texts).encode('ascii'), dtype=np.uint8)}),
+    }
+
+
+class ShapeStore:
+    # Shapes over the tables of compile_shapes, which stay as they were
+    # loaded (memory-mapped from the snapshot).
+    def __init__(self, shape_points, shape_groups, shape_polylines):
+        self.shape_ids = pd.Index(np.asarray(shape_groups['shape_id'].values, dtype=object))
+        self.offsets = np.r_[0, shape_groups['end'].values].astype(np.int64)
+        self.sequences = shape_points['shape_pt_sequence'].values
+        self.lats = shape_points['shape_pt_lat'].values
+        self.lons = shape_points['shape_pt_lon'].values
+        self.point_levels = shape_points['level'].values
+        self.polyline_starts = [shape_groups[f'polyline_start_{level}'].values for level in range(len(SHAPE_ZOOM_LEVELS))]
+        self.polyline_ends = [shape_groups[f'polyline_end_{level}'].values for level in range(len(SHAPE_ZOOM_LEVELS))]
+        self.polyline_characters = shape_polylines['character'].values
+        self.level_by_zoom = [
+            next((level for level, level_zoom in enumerate(SHAPE_ZOOM_LEVELS) if level_zoom >= zoom), len(SHAPE_ZOOM_LEVELS) - 1)
+            for zoom in range(SHAPE_MAX_ZOOM + 1)
+        ]
+        for array in (self.offsets, self.sequences, self.lats, self.lons, self.point_levels, self.polyline_characters):
+            array.setflags(write=False)
+
+    def shape_position(self, shape_id):
+        try:
+            return self.shape_ids.get_loc(shape_id)
+        except (KeyError, TypeError):
+            return None
+
+    def points(self, shape_id):
+        position = self.shape_position(shape_id)
+        if position is None:
+            return []
+        start, end = self.offsets[position], self.offsets[position + 1]
+        # Coordinates are stored as float32, which is exact to about a metre;
+        # rounding keeps the float32 noise out of the response.
+        return [
+            {'shape_pt_sequence': sequence, 'shape_pt_lat': lat, 'shape_pt_lon': lon}
+            for sequence, lat, lon in zip(
+                self.sequences[start:end].tolist(),
+                np.round(self.lats[start:end].astype(float), 5).tolist(),
+                np.round(self.lons[start:end].astype(float), 5).tolist(),
+            )
+        ]
+
+    def level(self, zoom):
+        return self.level_by_zoom[min(max(int(zoom), 0), SHAPE_MAX_ZOOM)]
+
+    def polyline(self, shape_id, zoom):
+        # (zoom level, encoded polyline) of the simplification for the zoom.
+        position = self.shape_position(shape_id)
+        if position is None:
+            return None
+        level = self.level(zoom)
+        start, end = self.polyline_starts[level][position], self.polyline_ends[level][position]
+        return SHAPE_ZOOM_LEVELS[level], self.polyline_characters[start:end].tobytes().decode('ascii')
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+GTFS_SNAPSHOT_ENABLED = os.getenv("GTFS_SNAPSHOT_ENABLED", "1") != "0"
+SNAPSHOT_DIR = '.snapshots'
+SNAPSHOT_FORMAT = 8
+FEED_VERSION_FILE = '.feed_version'
+FEED_HEADERS_FILE = '.feed_headers'
+FEED_FILES_FILE = '.feed_files'
+
+
+@contextmanager
+def gtfs_file_lock(folder_path):
+    # Blocking exclusive lock shared by all workers on the host, so only one
+    # of them downloads or compiles a feed while the others wait for it.
+    os.makedirs(folder_path, exist_ok=True)
+    lock_file = open(os.path.join(folder_path, '.gtfs.lock'), 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        lock_file.close()
+
+
+def hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest
+
+
+def write_feed_version(folder_path, zip_path):
+    with open(os.path.join(folder_path, FEED_VERSION_FILE), 'w') as f:
+        f.write(hash_file(zip_path).hexdigest())
+
+
+def read_feed_version(folder_path, source_files):
+    # The version is the hash of the downloaded zip. Feeds extracted before
+    # it was recorded get a hash of their text files instead, computed once.
+    version_path = os.path.join(folder_path, FEED_VERSION_FILE)
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            return f.read().strip()
+
+    digest = hashlib.sha256()
+    for file_name in sorted(source_files):
+        digest.update(file_name.encode())
+        hash_file(os.path.join(folder_path, file_name), digest)
+    version = digest.hexdigest()
+    with open(version_path, 'w') as f:
+        f.write(version)
+    return version
+
+
+def read_feed_files(folder_path):
+    # Names of the files the last installed zip contained. Feeds extracted
+    # before they were recorded list none, so nothing of theirs is removed.
+    try:
+        with open(os.path.join(folder_path, FEED_FILES_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def write_feed_files(folder_path, file_names):
+    files_path = os.path.join(folder_path, FEED_FILES_FILE)
+    with open(f'{files_path}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(sorted(file_names), f)
+    os.replace(f'{files_path}.{os.getpid()}.tmp', files_path)
+
+
+def read_feed_headers(folder_path):
+    # Validators of the last download (ETag, Last-Modified) and the time the
+    # feed URL was last checked, shared by all workers on the host.
+    try:
+        with open(os.path.join(folder_path, FEED_HEADERS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_feed_headers(folder_path, response_headers, checked_at):
+    feed_headers = {
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+        'checked_at': checked_at,
+    }
+    headers_path = os.path.join(folder_path, FEED_HEADERS_FILE)
+    with open(f'{headers_path}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(feed_headers, f)
+    os.replace(f'{headers_path}.{os.getpid()}.tmp', headers_path)
+
+
+def snapshot_key(feed_version):
+    return hashlib.sha256(f'{feed_version}:{SNAPSHOT_FORMAT}'.encode()).hexdigest()[:16]
+
+
+def save_table(snapshot_path, table_name, df):
+    columns = []
+    for position, column in enumerate(df.columns):
+        values = df[column].values
+        file_name = f'{table_name}.{position}'
+        if isinstance(values, pd.Categorical):
+            np.save(os.path.join(snapshot_path, file_name + '.npy'), values.codes)
+            np.save(os.path.join(snapshot_path, file_name + '.uniques.npy'), np.asarray(values.categories, dtype=object), allow_pickle=True)
+            kind = 'category'
+        elif values.dtype == object:
+            # Sorted like the categories of astype('category'), so the
+            # loaded categorical sorts as the strings did.
+            try:
+                codes, uniques = pd.factorize(values, sort=True)
+            except TypeError:
+                codes, uniques = pd.factorize(values)
+            np.save(os.path.join(snapshot_path, file_name + '.npy'), codes.astype(np.int32))
+            np.save(os.path.join(snapshot_path, file_name + '.uniques.npy'), np.asarray(uniques, dtype=object), allow_pickle=True)
+            kind = 'dictionary'
+        else:
+            np.save(os.path.join(snapshot_path, file_name + '.npy'), values)
+            kind = 'array'
+        columns.append({'name': column, 'kind': kind, 'file': file_name})
+    return {'rows': len(df), 'columns': columns}
+
+
+def load_table(snapshot_path, table):
+    # Numeric columns and categorical codes stay read-only views of the
+    # memory-mapped files, so every worker shares the same page cache pages
+    # instead of holding its own copy. copy=False keeps pandas from
+    # consolidating them into new blocks.
+    data = {}
+    for column in table['columns']:
+        path = os.path.join(snapshot_path, column['file'])
+        values = np.load(path + '.npy', mmap_mode='r')
+        if column['kind'] == 'category':
+            categories = np.load(path + '.uniques.npy', allow_pickle=True)
+            values = pd.Categorical.from_codes(values, categories=pd.Index(categories, dtype=object))
+        elif column['kind'] == 'dictionary':
+            # Loaded as a categorical over the mapped codes rather than
+            # expanded into an object array in every worker.
+            uniques = np.load(path + '.uniques.npy', allow_pickle=True)
+            values = pd.Categorical.from_codes(values, categories=pd.Index(uniques, dtype=object))
+        data[column['name']] = values
+    return pd.DataFrame(data, columns=[column['name'] for column in table['columns']], copy=False)
+
+
+def compile_snapshot(folder_path, key, tables):
+    snapshots_path = os.path.join(folder_path, SNAPSHOT_DIR)
+    snapshot_path = os.path.join(snapshots_path, key)
+    temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+    os.makedirs(temp_path, exist_ok=True)
+
+    manifest = {'format': SNAPSHOT_FORMAT, 'tables': {}}
+    for table_name, df in tables.items():
+        manifest['tables'][table_name] = save_table(temp_path, table_name, df)
+    with open(os.path.join(temp_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    try:
+        os.rename(temp_path, snapshot_path)
+    except OSError:
+        # Another worker finished the same snapshot first.
+        shutil.rmtree(temp_path, ignore_errors=True)
+        return
+
+    for entry in os.scandir(snapshots_path):
+        if entry.name != key and not entry.name.endswith('.tmp'):
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_snapshot(folder_path, key):
+    snapshot_path = os.path.join(folder_path, SNAPSHOT_DIR, key)
+    manifest_path = os.path.join(snapshot_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return {table_name: load_table(snapshot_path, table) for table_name, table in manifest['tables'].items()}
+
+
+def read_gtfs_tables(folder_path, source_files, prepare=None):
+    # Reads {table name: file name} from folder_path, from the compiled
+    # snapshot of this feed version when there is one, otherwise from CSV,
+    # compiling the snapshot for the next start. prepare(tables) runs on the
+    # CSV tables before they are compiled, so its result is what the
+    # snapshot stores; bump SNAPSHOT_FORMAT when it changes.
+    def read_csv_tables():
+        tables = {table_name: pd.read_csv(os.path.join(folder_path, file_name)) for table_name, file_name in source_files.items()}
+        return prepare(tables) if prepare is not None else tables
+
+    # The feed updater installs new files under the same lock, so the CSV
+    # files are never read while they are being replaced.
+    if not GTFS_SNAPSHOT_ENABLED:
+        with gtfs_file_lock(folder_path):
+            return read_csv_tables()
+
+    key = snapshot_key(read_feed_version(folder_path, list(source_files.values())))
+    tables = try_load_snapshot(folder_path, key)
+    if tables is not None:
+        return tables
+
+    with gtfs_file_lock(folder_path):
+        # Another worker may have compiled it while this one was waiting, or
+        # a new feed may have been installed meanwhile.
+        key = snapshot_key(read_feed_version(folder_path, list(source_files.values())))
+        tables = try_load_snapshot(folder_path, key)
+        if tables is not None:
+            return tables
+
+        tables = read_csv_tables()
+        try:
+            compile_snapshot(folder_path, key, tables)
+            print(f"Compiled GTFS snapshot {key} in {folder_path}")
+        except Exception as e:
+            print(f"Failed to compile GTFS snapshot in {folder_path}: {e}")
+            return tables
+
+    # Drop the private CSV frames in favour of the shared mapped ones.
+    return try_load_snapshot(folder_path, key) or tables
+
+
+def try_load_snapshot(folder_path, key):
+    try:
+        return load_snapshot(folder_path, key)
+    except Exception as e:
+        print(f"Failed to load GTFS snapshot {key} from {folder_path}: {e}")
+        return None
@@ -0,0 +1,238 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Mapbox Vector Tiles (spec 2.1) of the static model: a "stops" layer of
+# points and a "shapes" layer of route lines, encoded by hand since the
+# format is a small protobuf message.
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_MAX_ZOOM = 22
+STOPS_MIN_ZOOM = int(os.getenv("GTFS_TILE_STOPS_MIN_ZOOM", 12))
+GTFS_TILE_CACHE_SIZE = int(os.getenv("GTFS_TILE_CACHE_SIZE", 1024))
+# Tiles only change with the feed version: URLs carrying the version they
+# were requested for are cached for good, others until the next check.
+GTFS_TILE_MAX_AGE = int(os.getenv("GTFS_TILE_MAX_AGE", 86400))
+
+# Wire types and field numbers of vector_tile.proto.
+VARINT = 0
+LENGTH_DELIMITED = 2
+TILE_LAYERS = 3
+LAYER_NAME, LAYER_FEATURES, LAYER_KEYS, LAYER_VALUES, LAYER_EXTENT, LAYER_VERSION = 1, 2, 3, 4, 5, 15
+FEATURE_ID, FEATURE_TAGS, FEATURE_TYPE, FEATURE_GEOMETRY = 1, 2, 3, 4
+VALUE_STRING = 1
+POINT, LINESTRING = 1, 2
+MOVE_TO, LINE_TO = 1, 2
+
+
+def mercator(lons, lats):
+    # Web Mercator coordinates scaled to [0, 1], y growing southwards.
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -85.0511, 85.0511)
+    x = (lons + 180) / 360
+    y = (1 - np.log(np.tan(np.radians(lats)) + 1 / np.cos(np.radians(lats))) / math.pi) / 2
+    return x, y
+
+
+def varint(value):
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def packed_varints(values):
+    # Many varints at once, for geometries.
+    values = np.asarray(values, dtype=np.uint64)
+    shifted = values[:, None] >> (np.uint64(7) * np.arange(10, dtype=np.uint64))
+    present = shifted > 0
+    present[:, 0] = True
+    more = np.zeros_like(present)
+    more[:, :-1] = present[:, 1:]
+    return (((shifted & np.uint64(0x7f)) | np.where(more, np.uint64(0x80), np.uint64(0)))[present]).astype(np.uint8).tobytes()
+
+
+def zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def field(number, wire_type):
+    return varint((number << 3) | wire_type)
+
+
+def varint_field(number, value):
+    return field(number, VARINT) + varint(value)
+
+
+def bytes_field(number, payload):
+    return field(number, LENGTH_DELIMITED) + varint(len(payload)) + payload
+
+
+def command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+class LayerBuilder:
+    def __init__(self, name):
+        self.name = name
+        self.features = []
+        self.keys = {}
+        self.values = {}
+
+    def tags(self, properties):
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault(str(value), len(self.values)))
+        return tags
+
+    def add(self, geometry_type, geometry, properties):
+        self.features.append(
+            varint_field(FEATURE_ID, len(self.features) + 1)
+            + bytes_field(FEATURE_TAGS, b''.join(map(varint, self.tags(properties))))
+            + varint_field(FEATURE_TYPE, geometry_type)
+            + bytes_field(FEATURE_GEOMETRY, packed_varints(geometry))
+        )
+
+    def encode(self):
+        if not self.features:
+            return b''
+        return bytes_field(TILE_LAYERS, b''.join(
+            [varint_field(LAYER_VERSION, 2), bytes_field(LAYER_NAME, self.name.encode())]
+            + [bytes_field(LAYER_FEATURES, feature) for feature in self.features]
+            + [bytes_field(LAYER_KEYS, key.encode()) for key in self.keys]
+            + [bytes_field(LAYER_VALUES, bytes_field(VALUE_STRING, value.encode())) for value in self.values]
+            + [varint_field(LAYER_EXTENT, TILE_EXTENT)]
+        ))
+
+
+def line_geometry(x, y):
+    # Geometry commands of the parts of a line whose segments touch the
+    # buffered tile, in tile coordinates. Repeated points are dropped.
+    low, high = -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER
+    inside = (
+        (np.minimum(x[:-1], x[1:]) <= high) & (np.maximum(x[:-1], x[1:]) >= low)
+        & (np.minimum(y[:-1], y[1:]) <= high) & (np.maximum(y[:-1], y[1:]) >= low)
+    )
+    run_starts = np.flatnonzero(inside & ~np.r_[False, inside[:-1]])
+    run_ends = np.flatnonzero(inside & ~np.r_[inside[1:], False]) + 2
+
+    geometry = []
+    cursor_x = cursor_y = 0
+    for start, end in zip(run_starts, run_ends):
+        part_x, part_y = x[start:end], y[start:end]
+        moved = np.r_[True, (np.diff(part_x) != 0) | (np.diff(part_y) != 0)]
+        part_x, part_y = part_x[moved], part_y[moved]
+        if len(part_x) < 2:
+            continue
+        deltas = np.column_stack([np.diff(part_x, prepend=cursor_x), np.diff(part_y, prepend=cursor_y)])
+        zigzags = zigzag(deltas.reshape(-1)).tolist()
+        geometry += [command(MOVE_TO, 1)] + zigzags[:2] + [command(LINE_TO, len(part_x) - 1)] + zigzags[2:]
+        cursor_x, cursor_y = int(part_x[-1]), int(part_y[-1])
+    return geometry
+
+
+class VectorTiles:
+    # Tiles of one model version, generated on first request and kept in
+    # an LRU cache that is dropped together with the model.
+    def __init__(self, gtfs_data):
+        stop_frames = []
+        shape_parts = []
+        for suffix, vehicle_type in (('a', 'bus'), ('t', 'tram')):
+            gtfs_index = gtfs_data[f'index_{suffix}']
+            stop_frames.append(gtfs_index.stop_locations)
+
+            # The route of a shape is the route of the first trip using it.
+            trips = gtfs_data[f'trips_{suffix}']
+            shape_routes = pd.Series(np.asarray(trips['route_id'].values, dtype=object), index=np.asarray(trips['shape_id'].values, dtype=object))
+            shape_routes = shape_routes[~shape_routes.index.duplicated()]
+            shapes = gtfs_index.shapes
+            shape_parts.append((vehicle_type, shapes, [
+                gtfs_index.route_short_name_by_route_id.get(route_id)
+                for route_id in shape_routes.reindex(np.asarray(shapes.shape_ids, dtype=object)).values
+            ]))
+
+        self.stops = pd.concat(stop_frames, ignore_index=True).dropna(subset=['stop_lon', 'stop_lat'])
+        self.stop_x, self.stop_y = mercator(self.stops['stop_lon'].values, self.stops['stop_lat'].values)
+
+        self.shapes = []
+        for vehicle_type, shapes, route_short_names in shape_parts:
+            x, y = mercator(shapes.lons, shapes.lats)
+            offsets = shapes.offsets
+            non_empty = np.flatnonzero(np.diff(offsets))
+            bounds = np.full((len(offsets) - 1, 4), np.nan)
+            if len(non_empty):
+                starts = offsets[non_empty]
+                bounds[non_empty] = np.column_stack([
+                    np.minimum.reduceat(x, starts), np.minimum.reduceat(y, starts),
+                    np.maximum.reduceat(x, starts), np.maximum.reduceat(y, starts),
+                ])
+            self.shapes.append((vehicle_type, shapes, route_short_names, x, y, bounds))
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def tile(self, z, x, y):
+        key = (z, x, y)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        data = self.render(z, x, y)
+        with self._lock:
+            self._cache[key] = data
+            while len(self._cache) > GTFS_TILE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return data
+
+    def render(self, z, x, y):
+        scale = 2 ** z
+        margin = TILE_BUFFER / TILE_EXTENT / scale
+        min_x, min_y = x / scale - margin, y / scale - margin
+        max_x, max_y = (x + 1) / scale + margin, (y + 1) / scale + margin
+
+        def to_tile(mx, my):
+            return (
+                np.round((mx * scale - x) * TILE_EXTENT).astype(np.int64),
+                np.round((my * scale - y) * TILE_EXTENT).astype(np.int64),
+            )
+
+        shapes_layer = LayerBuilder('shapes')
+        for vehicle_type, shapes, route_short_names, shape_x, shape_y, bounds in self.shapes:
+            level = shapes.level(z)
+            visible = np.flatnonzero(
+                (bounds[:, 0] <= max_x) & (bounds[:, 2] >= min_x) & (bounds[:, 1] <= max_y) & (bounds[:, 3] >= min_y)
+            )
+            for position in visible:
+                start, end = shapes.offsets[position], shapes.offsets[position + 1]
+                kept = np.flatnonzero(shapes.point_levels[start:end] <= level) + start
+                geometry = line_geometry(*to_tile(shape_x[kept], shape_y[kept]))
+                if geometry:
+                    shapes_layer.add(LINESTRING, geometry, {
+                        'shape_id': shapes.shape_ids[position],
+                        'route_short_name': route_short_names[position],
+                        'type': vehicle_type,
+                    })
+
+        stops_layer = LayerBuilder('stops')
+        if z >= STOPS_MIN_ZOOM:
+            visible = np.flatnonzero(
+                (self.stop_x >= min_x) & (self.stop_x <= max_x) & (self.stop_y >= min_y) & (self.stop_y <= max_y)
+            )
+            tile_x, tile_y = to_tile(self.stop_x[visible], self.stop_y[visible])
+            for stop, stop_x, stop_y in zip(self.stops.iloc[visible].itertuples(index=False), tile_x.tolist(), tile_y.tolist()):
+                stops_layer.add(POINT, [command(MOVE_TO, 1)] + zigzag([stop_x, stop_y]).tolist(), {
+                    'stop_id': stop.stop_id,
+                    'stop_name': stop.stop_name,
+                    'type': stop.type,
+                })
+
+        return shapes_layer.encode() + stops_layer.encode()
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from services.static.gtfs_departures import category_codes
+
+
+def timetable_key(sizes, route, direction, service, stop):
+    _, direction_count, service_count, stop_count = sizes
+    return ((np.asarray(route, dtype=np.int64) * direction_count + direction) * service_count + service) * stop_count + stop
+
+
+def compile_timetables(trips, stop_times):
+    # Departure seconds of every (route, direction, service, stop), compiled
+    # with the feed tables so the snapshot stores them and every worker maps
+    # the same pages. A route's timetable holds every trip run by one of its
+    # blocks, so trips of other routes interlined on those blocks are
+    # included, like the timetables printed at stops. The groups are sorted
+    # by a combined key, so all stops of a route and direction are one
+    # contiguous range.
+    trip_codes, trip_ids = category_codes(stop_times['trip_id'].values)
+    stop_codes, stop_ids = category_codes(stop_times['stop_id'].values)
+
+    trip_parts = pd.Series(np.asarray(trip_ids, dtype=object)).astype(str).str.split('_')
+    trip_blocks = trip_parts.str[:2].str.join('_').values
+    service_codes, services = category_codes(("service_" + trip_parts.str[5:].str.join('_')).values)
+    trip_rows = pd.Index(trips['trip_id'].values).get_indexer(trip_ids)
+    directions = pd.Series(trips['direction_id'].values).reindex(trip_rows).values
+    direction_codes, direction_ids = pd.factorize(directions)
+
+    # Routes of every trip: the routes served by the block in its id.
+    block_routes = pd.DataFrame({
+        'block': np.asarray(trips['block_id'].values, dtype=object),
+        'route_id': np.asarray(trips['route_id'].values, dtype=object),
+    }).dropna().drop_duplicates()
+    route_codes, route_ids = category_codes(block_routes['route_id'].values)
+    block_routes = block_routes.assign(route=route_codes)
+    trip_routes = pd.DataFrame({'trip': np.arange(len(trip_ids)), 'block': trip_blocks}).merge(block_routes, on='block')
+    trip_routes = trip_routes.sort_values(['trip', 'route'], kind='stable')
+    route_counts = np.bincount(trip_routes['trip'].values, minlength=len(trip_ids))
+    route_offsets = np.r_[0, np.cumsum(route_counts)]
+
+    # One row per stop_times row and route of its trip.
+    valid = (trip_codes >= 0) & (stop_codes >= 0)
+    valid[valid] = (direction_codes[trip_codes[valid]] >= 0) & (service_codes[trip_codes[valid]] >= 0)
+    rows = np.flatnonzero(valid)
+    row_counts = route_counts[trip_codes[rows]]
+    rows = np.repeat(rows, row_counts)
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+    routes = trip_routes['route'].values[route_offsets[trip_codes[rows]] + within]
+
+    sizes = (len(route_ids), len(direction_ids), len(services), len(stop_ids))
+    keys = timetable_key(sizes, routes, direction_codes[trip_codes[rows]], service_codes[trip_codes[rows]], stop_codes[rows])
+    seconds = np.asarray(stop_times['departure_seconds'].values, dtype=np.int32)[rows]
+    order = np.lexsort((seconds, keys))
+    keys = keys[order]
+
+    boundaries = np.flatnonzero(np.r_[True, np.diff(keys) != 0, True]) if len(keys) else np.zeros(1, dtype=np.int64)
+    starts, ends = boundaries[:-1], boundaries[1:]
+    return {
+        'timetable_rows': pd.DataFrame({'second': seconds[order]}),
+        'timetable_groups': pd.DataFrame({
+            'key': keys[starts],
+            'start': starts.astype(np.int64),
+            'end': ends.astype(np.int64),
+        }),
+        'timetable_routes': pd.DataFrame({'route_id': np.asarray(route_ids, dtype=object)}),
+        'timetable_directions': pd.DataFrame({'direction_id': direction_ids}),
+        'timetable_services': pd.DataFrame({'service_id': np.asarray(services, dtype=object)}),
+    }
+
+
+class RouteTimetables:
+    # Timetables over the rows of compile_timetables, which stay as they
+    # were loaded (memory-mapped from the snapshot), so a timetable is a
+    # binary search and a slice.
+    def __init__(self, stop_times, tables):
+        _, self.stop_ids = category_codes(stop_times['stop_id'].values)
+        self.route_ids = pd.Index(tables['timetable_routes']['route_id'].values)
+        self.directions = pd.Index(tables['timetable_directions']['direction_id'].values)
+        self.services = pd.Index(tables['timetable_services']['service_id'].values)
+        self.sizes = (len(self.route_ids), len(self.directions), len(self.services), len(self.stop_ids))
+
+        groups = tables['timetable_groups']
+        self.group_keys = groups['key'].values
+        self.starts = groups['start'].values
+        self.ends = groups['end'].values
+        self.seconds = tables['timetable_rows']['second'].values
+        for array in (self.group_keys, self.starts, self.ends, self.seconds):
+            array.setflags(write=False)
+
+    def key(self, route, direction, service, stop):
+        return timetable_key(self.sizes, route, direction, service, stop)
+
+    def codes(self, route_id, direction, service_id):
+        try:
+            return self.route_ids.get_loc(route_id), self.directions.get_loc(direction), self.services.get_loc(service_id)
+        except (KeyError, TypeError):
+            return None
+
+    def timetable(self, route_id, direction, service_id, stop_id):
+        # {hour: [minute, ...]} of one stop, earliest first.
+        codes = self.codes(route_id, direction, service_id)
+        if codes is None or stop_id not in self.stop_ids:
+            return {}
+        key = self.key(*codes, self.stop_ids.get_loc(stop_id))
+        group = np.searchsorted(self.group_keys, key)
+        if group == len(self.group_keys) or self.group_keys[group] != key:
+            return {}
+        return hour_minutes(self.seconds[self.starts[group]:self.ends[group]])
+
+    def route_timetables(self, route_id, direction, service_id):
+        # {stop_id: {hour: [minute, ...]}} of every stop of the route.
+        codes = self.codes(route_id, direction, service_id)
+        if codes is None:
+            return {}
+        first, last = np.searchsorted(self.group_keys, [self.key(*codes, 0), self.key(*codes, self.sizes[3])])
+        return {
+            self.stop_ids[key % self.sizes[3]]: hour_minutes(self.seconds[self.starts[group]:self.ends[group]])
+            for group, key in zip(range(first, last), self.group_keys[first:last].tolist())
+        }
+
+
+def hour_minutes(seconds):
+    timetable = {}
+    for hour, minute in zip((seconds // 3600).tolist(), (seconds % 3600 // 60).tolist()):
+        timetable.setdefault(hour, []).append(minute)
+    return timetable
@@ -0,0 +1,165 @@
+import os
+import shutil
+import threading
+import time
+import zipfile
+import requests
+from services.static.gtfs_data_loader import GTFS_DATA_PATH, GTFS_DOWNLOAD_TIMEOUT, GTFS_FEED_FILES, GTFS_FEEDS, build_gtfs_data, get_feed_version, gtfs_data_instance
+from services.static.gtfs_snapshot import FEED_VERSION_FILE, gtfs_file_lock, hash_file, read_feed_files, read_feed_headers, read_feed_version, write_feed_files, write_feed_headers
+
+GTFS_UPDATE_ENABLED = os.getenv("GTFS_UPDATE_ENABLED", "1") != "0"
+GTFS_UPDATE_INTERVAL = float(os.getenv("GTFS_UPDATE_INTERVAL", 3600))
+# How often every worker compares the feeds on disk with the model it serves.
+GTFS_RELOAD_INTERVAL = float(os.getenv("GTFS_RELOAD_INTERVAL", 60))
+GTFS_UPDATE_SHUTDOWN_TIMEOUT = float(os.getenv("GTFS_UPDATE_SHUTDOWN_TIMEOUT", 15))
+
+
+def install_feed(staging_path, folder_path):
+    # Replaces the feed files one by one and the version file last. Workers
+    # only read the text files while holding the lock of the feed folder,
+    # and only look at the version file to decide whether to do so. Of the
+    # files already there only those of the previous zip are removed.
+    staged_files = set(os.listdir(staging_path)) - {FEED_VERSION_FILE}
+    for file_name in set(read_feed_files(folder_path)) - staged_files:
+        file_path = os.path.join(folder_path, file_name)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+    for file_name in staged_files:
+        os.replace(os.path.join(staging_path, file_name), os.path.join(folder_path, file_name))
+    write_feed_files(folder_path, staged_files)
+    os.replace(os.path.join(staging_path, FEED_VERSION_FILE), os.path.join(folder_path, FEED_VERSION_FILE))
+
+
+def update_feed(vehicle_type, min_check_interval=0):
+    # Downloads the feed again if the agency published a new one. Returns
+    # True when new files were installed. Must run under the gtfs_file_lock
+    # of the feed folder.
+    url = GTFS_FEEDS[vehicle_type]
+    folder_path = os.path.join(GTFS_DATA_PATH, vehicle_type)
+    feed_headers = read_feed_headers(folder_path)
+    checked_at = time.time()
+    if checked_at - feed_headers.get('checked_at', 0) < min_check_interval:
+        # Another worker checked it moments ago.
+        return False
+
+    request_headers = {}
+    if feed_headers.get('etag'):
+        request_headers['If-None-Match'] = feed_headers['etag']
+    if feed_headers.get('last_modified'):
+        request_headers['If-Modified-Since'] = feed_headers['last_modified']
+
+    response = requests.get(url, headers=request_headers, stream=True, timeout=GTFS_DOWNLOAD_TIMEOUT)
+    if response.status_code == 304:
+        write_feed_headers(folder_path, feed_headers_from(feed_headers, response.headers), checked_at)
+        return False
+    if response.status_code != 200:
+        raise Exception(f"Downloading failed: {url} ({response.status_code})")
+
+    staging_path = os.path.join(GTFS_DATA_PATH, f'.{vehicle_type}.staging')
+    zip_path = os.path.join(GTFS_DATA_PATH, f'.{vehicle_type}.zip')
+    shutil.rmtree(staging_path, ignore_errors=True)
+    os.makedirs(staging_path)
+    try:
+        with open(zip_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=8192):
+                file.write(chunk)
+
+        feed_version = hash_file(zip_path).hexdigest()
+        if feed_version == read_feed_version(folder_path, GTFS_FEED_FILES):
+            # Same file served without validators, or with new ones.
+            write_feed_headers(folder_path, response.headers, checked_at)
+            return False
+
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall(staging_path)
+        with open(os.path.join(staging_path, FEED_VERSION_FILE), 'w') as f:
+            f.write(feed_version)
+
+        install_feed(staging_path, folder_path)
+        write_feed_headers(folder_path, response.headers, checked_at)
+        print(f"Installed GTFS feed {feed_version[:12]} in {folder_path}")
+        return True
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+
+
+def feed_headers_from(feed_headers, response_headers):
+    # A 304 may omit the validators; keep the stored ones in that case.
+    return {
+        'ETag': response_headers.get('ETag') or feed_headers.get('etag'),
+        'Last-Modified': response_headers.get('Last-Modified') or feed_headers.get('last_modified'),
+    }
+
+
+class GTFSFeedUpdater:
+    # Checks the static feed URLs in the background and swaps in a freshly
+    # built model when a new timetable is published. Requests in flight keep
+    # the model they started with; the old one is freed once they finish.
+    #
+    # Every uvicorn worker runs one, but only the realtime ingestion leader
+    # downloads; is_leader is set to the ingestion worker's check at startup.
+    # Every worker reloads as soon as the files on disk are newer than the
+    # model it serves.
+    def __init__(self, interval=GTFS_UPDATE_INTERVAL, reload_interval=GTFS_RELOAD_INTERVAL):
+        self.interval = interval
+        self.reload_interval = reload_interval
+        self.is_leader = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="gtfs-updater", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=GTFS_UPDATE_SHUTDOWN_TIMEOUT):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print("GTFS feed updater did not stop in time.")
+            self._thread = None
+
+    def should_download(self):
+        return self.is_leader is None or self.is_leader()
+
+    def check(self):
+        if self.should_download():
+            self.download()
+        self.reload()
+
+    def download(self):
+        # The lock of the feed folder is the one snapshots are compiled
+        # under, so no worker reads the CSV files while they are replaced.
+        # A leader taking over skips feeds the previous one just checked.
+        for vehicle_type in GTFS_FEEDS:
+            with gtfs_file_lock(os.path.join(GTFS_DATA_PATH, vehicle_type)):
+                try:
+                    update_feed(vehicle_type, min_check_interval=self.interval / 2)
+                except Exception as e:
+                    print(f"Error updating GTFS feed {vehicle_type}: {e}")
+
+    def reload(self):
+        version = get_feed_version()
+        if version != gtfs_data_instance.get_version():
+            started = time.monotonic()
+            gtfs_data_instance.load_data(build_gtfs_data(previous=gtfs_data_instance.get_data()))
+            print(f"Loaded GTFS version {version} in {time.monotonic() - started:.1f}s")
+
+    def _run(self):
+        next_download = time.monotonic() + self.interval
+        while not self._stop_event.wait(min(self.reload_interval, self.interval)):
+            try:
+                if time.monotonic() >= next_download and self.should_download():
+                    next_download = time.monotonic() + self.interval
+                    self.download()
+                self.reload()
+            except Exception as e:
+                print(f"Error reloading GTFS data: {e}")
+
+
+gtfs_feed_updater = GTFSFeedUpdater()
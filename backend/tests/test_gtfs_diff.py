@@ -0,0 +1,172 @@
+import os
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'gtfs_tests.db')}")
+
+import services.static.gtfs_data_loader as gtfs_data_loader
+from services.static.gtfs_diff import GTFSChangeSet
+from services.static.gtfs_snapshot import FEED_VERSION_FILE, SNAPSHOT_DIR
+
+ROUTES = {
+    'bus': {'route_1': '101', 'route_2': '102', 'route_3': '103', 'route_4': '104'},
+    'tram': {'route_5': '1', 'route_6': '2', 'route_7': '3'},
+}
+SERVICES = ['service_1', 'service_2', 'service_3']
+
+
+def write_feed(folder_path, routes, seed):
+    # Blocks of every service running trips of one or two routes, over
+    # stops shared by all routes.
+    rng = np.random.default_rng(seed)
+    stop_ids = [f'stop_{i}_{300000 + i * 37}' for i in range(20)]
+    route_stops = {route_id: list(rng.choice(stop_ids, 6, replace=False)) for route_id in routes}
+
+    trips, stop_times = [], []
+    block = 0
+    for service_id in SERVICES:
+        for _ in range(12):
+            block += 1
+            block_routes = list(rng.choice(list(routes), int(rng.integers(1, 3)), replace=False))
+            for trip_number in range(1, int(rng.integers(3, 6))):
+                route_id = block_routes[trip_number % len(block_routes)]
+                direction_id = trip_number % 2
+                trip_id = f'block_{block}_trip_{trip_number}_{service_id}'
+                trips.append((trip_id, route_id, service_id, f'Headsign {route_id} {direction_id}', direction_id, f'shape_{route_id}', f'block_{block}'))
+                sequence = route_stops[route_id][::-1] if direction_id else route_stops[route_id]
+                for stop_sequence, stop_id in enumerate(sequence, start=1):
+                    time = f'{5 + trip_number:02}:{stop_sequence * 3:02}:00'
+                    stop_times.append((trip_id, time, time, stop_id, stop_sequence))
+
+    os.makedirs(folder_path, exist_ok=True)
+    pd.DataFrame({
+        'stop_id': stop_ids,
+        'stop_name': [f'Stop {i}' for i in range(len(stop_ids))],
+        'stop_lat': rng.uniform(50.0, 50.1, len(stop_ids)).round(5),
+        'stop_lon': rng.uniform(19.8, 20.0, len(stop_ids)).round(5),
+    }).to_csv(os.path.join(folder_path, 'stops.txt'), index=False)
+    pd.DataFrame({'route_id': list(routes), 'route_short_name': list(routes.values())}).to_csv(
+        os.path.join(folder_path, 'routes.txt'), index=False)
+    pd.DataFrame(trips, columns=['trip_id', 'route_id', 'service_id', 'trip_headsign', 'direction_id', 'shape_id', 'block_id']).to_csv(
+        os.path.join(folder_path, 'trips.txt'), index=False)
+    pd.DataFrame(stop_times, columns=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']).to_csv(
+        os.path.join(folder_path, 'stop_times.txt'), index=False)
+    pd.DataFrame([(f'shape_{route_id}', 50.0 + i, 19.9, i) for route_id in routes for i in (1, 2)],
+                 columns=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']).to_csv(
+        os.path.join(folder_path, 'shapes.txt'), index=False)
+    pd.DataFrame([{'service_id': service_id, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1, 'friday': 1,
+                   'saturday': int(service_id != 'service_1'), 'sunday': 0, 'start_date': 20260101, 'end_date': 20261231}
+                  for service_id in SERVICES]).to_csv(os.path.join(folder_path, 'calendar.txt'), index=False)
+    write_version(folder_path, f'v1-{seed}')
+
+
+def write_version(folder_path, version):
+    with open(os.path.join(folder_path, FEED_VERSION_FILE), 'w') as f:
+        f.write(version)
+
+
+def update_feed(folder_path, seed):
+    # A small update: one trip retimed, one moved to another route, one
+    # removed and one stop renamed.
+    rng = np.random.default_rng(seed + 100)
+    read = lambda name: pd.read_csv(os.path.join(folder_path, f'{name}.txt'))
+    trips, stop_times, stops = read('trips'), read('stop_times'), read('stops')
+    retimed, moved, removed = rng.choice(trips['trip_id'].values, 3, replace=False)
+
+    rows = stop_times['trip_id'] == retimed
+    stop_times.loc[rows, 'departure_time'] = stop_times.loc[rows, 'departure_time'].str.replace(':00$', ':30', regex=True)
+    route_ids = trips['route_id'].unique()
+    moved_route = trips.loc[trips['trip_id'] == moved, 'route_id'].iloc[0]
+    trips.loc[trips['trip_id'] == moved, 'route_id'] = route_ids[(list(route_ids).index(moved_route) + 1) % len(route_ids)]
+    trips = trips[trips['trip_id'] != removed]
+    stop_times = stop_times[stop_times['trip_id'] != removed]
+    renamed = rng.choice(stop_times['stop_id'].unique())
+    stops.loc[stops['stop_id'] == renamed, 'stop_name'] += ' Renamed'
+
+    for name, df in (('trips', trips), ('stop_times', stop_times), ('stops', stops)):
+        df.to_csv(os.path.join(folder_path, f'{name}.txt'), index=False)
+    write_version(folder_path, f'v2-{seed}')
+    return {'retimed': retimed, 'moved': moved, 'removed': removed, 'renamed': renamed}
+
+
+@pytest.fixture(params=range(4))
+def feeds(request, tmp_path, monkeypatch):
+    # The model of the first version, the feed updated on disk and what was
+    # changed.
+    for vehicle_type, routes in ROUTES.items():
+        write_feed(str(tmp_path / vehicle_type), routes, request.param)
+    monkeypatch.setattr(gtfs_data_loader, 'GTFS_DATA_PATH', str(tmp_path))
+    previous = gtfs_data_loader.build_gtfs_data()
+    updates = {vehicle_type: update_feed(str(tmp_path / vehicle_type), request.param) for vehicle_type in ROUTES}
+    return tmp_path, previous, updates
+
+
+def test_change_set_lists_changed_keys_and_what_they_affect(feeds):
+    _, previous, updates = feeds
+    for suffix, vehicle_type in (('a', 'bus'), ('t', 'tram')):
+        update = updates[vehicle_type]
+        previous_tables = gtfs_data_loader.previous_feed_tables(previous, suffix)
+        changes = GTFSChangeSet(previous_tables, gtfs_data_loader.read_feed_tables(vehicle_type, previous_tables))
+
+        assert changes.changed['trips'] == {update['moved'], update['removed']}
+        assert changes.changed['stop_times'] == {update['retimed'], update['removed']}
+        assert changes.changed['stops'] == {update['renamed']}
+        assert not changes.changed['routes'] and not changes.changed['calendar'] and not changes.changed['shapes']
+        trips = previous[f'trips_{suffix}']
+        for trip_id in (update['retimed'], update['moved'], update['removed']):
+            assert trips.loc[trip_id, 'route_id'] in changes.routes
+            assert trips.loc[trip_id, 'service_id'] in changes.services
+            assert trips.loc[trip_id, 'block_id'] in changes.blocks
+
+
+def test_unchanged_feed_has_an_empty_change_set(tmp_path, monkeypatch):
+    write_feed(str(tmp_path / 'bus'), ROUTES['bus'], 0)
+    monkeypatch.setattr(gtfs_data_loader, 'GTFS_DATA_PATH', str(tmp_path))
+    previous = gtfs_data_loader.build_feed_data('bus', 'a')
+    write_version(str(tmp_path / 'bus'), 'v1-republished')
+
+    previous_tables = gtfs_data_loader.previous_feed_tables(previous, 'a')
+    changes = GTFSChangeSet(previous_tables, gtfs_data_loader.read_feed_tables('bus', previous_tables))
+    assert changes.is_empty()
+    assert not changes.routes and not changes.services and not changes.stops
+
+
+def board_rows(gtfs_index):
+    return {key: gtfs_index.stop_departures.departures(*key) for key in gtfs_index.stop_departures.groups}
+
+
+def object_rows(df):
+    df = df.astype(object)
+    return df.where(df.notna(), None).values.tolist()
+
+
+def test_incremental_build_matches_a_full_build(feeds):
+    tmp_path, previous, _ = feeds
+    incremental = gtfs_data_loader.build_gtfs_data(previous)
+    for vehicle_type in ROUTES:
+        shutil.rmtree(tmp_path / vehicle_type / SNAPSHOT_DIR, ignore_errors=True)
+    full = gtfs_data_loader.build_gtfs_data()
+
+    for suffix in ('a', 't'):
+        assert object_rows(incremental[f'schedule_num_{suffix}']) == object_rows(full[f'schedule_num_{suffix}'])
+        incremental_index, full_index = incremental[f'index_{suffix}'], full[f'index_{suffix}']
+        assert object_rows(incremental_index.departure_trips) == object_rows(full_index.departure_trips)
+        assert board_rows(incremental_index) == board_rows(full_index)
+        assert dict(incremental_index.route_stops) == dict(full_index.route_stops)
+        assert incremental_index.stop_patterns.by_route == full_index.stop_patterns.by_route
+
+
+def test_routes_the_change_set_does_not_reach_are_taken_over(feeds):
+    _, previous, _ = feeds
+    gtfs_data = gtfs_data_loader.build_gtfs_data(previous)
+    for suffix, vehicle_type in (('a', 'bus'), ('t', 'tram')):
+        previous_index, gtfs_index = previous[f'index_{suffix}'], gtfs_data[f'index_{suffix}']
+        previous_tables = gtfs_data_loader.previous_feed_tables(previous, suffix)
+        changes = GTFSChangeSet(previous_tables, gtfs_data_loader.read_feed_tables(vehicle_type, previous_tables))
+        for route_id, route_stops in gtfs_index.route_stops.items():
+            assert (route_stops is previous_index.route_stops[route_id]) == (route_id not in changes.routes)
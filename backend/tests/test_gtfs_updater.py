@@ -0,0 +1,45 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.static.gtfs_snapshot import FEED_VERSION_FILE, read_feed_files, write_feed_files
+from services.static.gtfs_updater import install_feed
+
+
+def write_files(folder_path, file_names, content):
+    os.makedirs(folder_path, exist_ok=True)
+    for file_name in file_names:
+        with open(os.path.join(folder_path, file_name), 'w') as f:
+            f.write(content)
+
+
+def read_file(folder_path, file_name):
+    with open(os.path.join(folder_path, file_name)) as f:
+        return f.read()
+
+
+def test_install_removes_only_files_of_the_previous_feed(tmp_path):
+    folder_path, staging_path = str(tmp_path / 'bus'), str(tmp_path / 'staging')
+    write_files(folder_path, ['stops.txt', 'fare_rules.txt', 'notes.txt'], 'old')
+    write_feed_files(folder_path, ['stops.txt', 'fare_rules.txt'])
+    write_files(staging_path, ['stops.txt', 'transfers.txt', FEED_VERSION_FILE], 'new')
+
+    install_feed(staging_path, folder_path)
+
+    assert sorted(name for name in os.listdir(folder_path) if not name.startswith('.')) == ['notes.txt', 'stops.txt', 'transfers.txt']
+    assert read_file(folder_path, 'stops.txt') == 'new'
+    assert read_file(folder_path, 'notes.txt') == 'old'
+    assert read_file(folder_path, FEED_VERSION_FILE) == 'new'
+    assert read_feed_files(folder_path) == ['stops.txt', 'transfers.txt']
+
+
+def test_install_over_a_feed_without_a_file_list_removes_nothing(tmp_path):
+    folder_path, staging_path = str(tmp_path / 'bus'), str(tmp_path / 'staging')
+    write_files(folder_path, ['stops.txt', 'notes.txt'], 'old')
+    write_files(staging_path, ['stops.txt', FEED_VERSION_FILE], 'new')
+
+    install_feed(staging_path, folder_path)
+
+    assert read_file(folder_path, 'notes.txt') == 'old'
+    assert read_file(folder_path, 'stops.txt') == 'new'
@@ -0,0 +1,40 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.realtime.realtime_spatial import VehicleGridIndex
+
+# Three vehicles in Krakow, one without a GPS fix reported at 0, 0 and one
+# without a position at all.
+VEHICLES = pd.DataFrame({
+    'latitude': [50.061, 50.065, 0.0, 50.012, np.nan],
+    'longitude': [19.937, 19.945, 0.0, 20.011, np.nan],
+})
+
+
+def test_vehicle_at_zero_zero_does_not_stretch_the_grid():
+    index = VehicleGridIndex(VEHICLES)
+
+    assert index.width * index.height <= 100
+    assert len(index.cell_start) == index.width * index.height + 1
+    assert sorted(index.rows.tolist()) == [0, 1, 3]
+
+
+def test_queries_skip_vehicles_outside_the_service_area():
+    index = VehicleGridIndex(VEHICLES)
+
+    assert index.query((19.93, 50.06, 19.95, 50.07)).tolist() == [0, 1]
+    assert index.query((19.0, 49.5, 21.0, 50.7)).tolist() == [0, 1, 3]
+    assert index.query((-1.0, -1.0, 1.0, 1.0)).tolist() == []
+    # Without a bounding box every vehicle with a position is listed.
+    assert index.query().tolist() == [0, 1, 2, 3]
+
+
+def test_grid_of_vehicles_all_outside_the_service_area_is_empty():
+    index = VehicleGridIndex(VEHICLES.iloc[[2]])
+
+    assert index.width == 0
+    assert index.query((19.93, 50.06, 19.95, 50.07)).tolist() == []
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.realtime.realtime_snapshot import RealtimeSnapshot
+from services.realtime.realtime_stream import VEHICLE_KEY_COLUMNS, RealtimeUpdate, VehicleFilter, encode_vehicle_delta, unique_vehicles
+
+COLUMNS = ['vehicle_id', 'trip_id', 'type', 'latitude', 'longitude', 'bearing', 'stop_id', 'schedule_number', 'route_short_name']
+
+
+def make_snapshot(version, rows):
+    vehicles = pd.DataFrame(rows, columns=COLUMNS)
+    return RealtimeSnapshot(version, None, None, unique_vehicles(vehicles))
+
+
+def key(record):
+    return tuple('' if record[column] is None else str(record[column]) for column in VEHICLE_KEY_COLUMNS)
+
+
+def apply_changes(records, changed, removed):
+    vehicles = {key(record): record for record in records}
+    for record in removed:
+        del vehicles[key(record)]
+    for record in changed:
+        vehicles[key(record)] = record
+    return vehicles
+
+
+# Two buses without a license plate, one bus reported twice and a plate
+# used by a bus and a tram.
+PREVIOUS = [
+    ('', 'trip_1', 'bus', 50.01, 19.91, 0.0, 'stop_1', '101/01', '101'),
+    (None, 'trip_2', 'bus', 50.02, 19.92, 0.0, 'stop_2', '102/01', '102'),
+    ('KR 100', 'trip_3', 'bus', 50.03, 19.93, 0.0, 'stop_3', '103/01', '103'),
+    ('KR 100', 'trip_3', 'bus', 50.04, 19.94, 0.0, 'stop_3', '103/01', '103'),
+    ('HY 200', 'trip_4', 'bus', 50.05, 19.95, 0.0, 'stop_4', '104/01', '104'),
+    ('HY 200', 'trip_5', 'tram', 50.06, 19.96, 0.0, 'stop_5', '1/01', '1'),
+    ('KR 300', 'trip_6', 'bus', 50.07, 19.97, 0.0, 'stop_6', '106/01', '106'),
+]
+CURRENT = [
+    ('', 'trip_1', 'bus', 50.11, 19.91, 0.0, 'stop_1', '101/01', '101'),
+    (None, 'trip_2', 'bus', 50.02, 19.92, 0.0, 'stop_2', '102/01', '102'),
+    ('', 'trip_7', 'bus', 50.12, 19.92, 0.0, 'stop_7', '107/01', '107'),
+    ('KR 100', 'trip_3', 'bus', 50.04, 19.94, 0.0, 'stop_3', '103/01', '103'),
+    ('KR 100', 'trip_3', 'bus', 50.14, 19.94, 0.0, 'stop_3', '103/01', '103'),
+    ('HY 200', 'trip_5', 'tram', 50.06, 19.96, 0.0, 'stop_5', '1/01', '1'),
+    ('KR 300', 'trip_8', 'bus', 50.07, 19.97, 0.0, 'stop_8', '108/01', '108'),
+]
+
+
+def test_unique_vehicles_keeps_vehicles_without_a_license_plate():
+    vehicles = make_snapshot(1, PREVIOUS).vehicles
+    assert [tuple(row) for row in vehicles[VEHICLE_KEY_COLUMNS].fillna('').values] == [
+        ('bus', '', 'trip_1'),
+        ('bus', '', 'trip_2'),
+        ('bus', 'KR 100', 'trip_3'),
+        ('bus', 'HY 200', 'trip_4'),
+        ('tram', 'HY 200', 'trip_5'),
+        ('bus', 'KR 300', 'trip_6'),
+    ]
+    # The last report of a vehicle sent twice wins.
+    assert vehicles['latitude'].values[2] == 50.04
+
+
+def test_delta_applied_to_the_full_list_gives_the_next_full_list():
+    previous, current = make_snapshot(1, PREVIOUS), make_snapshot(2, CURRENT)
+    delta = json.loads(encode_vehicle_delta(previous, current))
+
+    assert not delta['full']
+    assert [key(record) for record in delta['vehicles']] == [
+        ('bus', '', 'trip_1'), ('bus', '', 'trip_7'), ('bus', 'KR 100', 'trip_3'), ('bus', 'KR 300', 'trip_8'),
+    ]
+    assert [key(record) for record in delta['removed']] == [('bus', 'HY 200', 'trip_4'), ('bus', 'KR 300', 'trip_6')]
+    assert apply_changes(previous.vehicle_records(), delta['vehicles'], delta['removed']) == \
+        {key(record): record for record in current.vehicle_records()}
+
+
+def test_stream_diff_applied_to_the_snapshot_gives_the_next_snapshot():
+    previous, current = make_snapshot(1, PREVIOUS), make_snapshot(2, CURRENT)
+    vehicle_filter = VehicleFilter(vehicle_types=['bus'])
+    first = RealtimeUpdate(previous)
+    update = RealtimeUpdate(current, first)
+
+    def payload(event):
+        return json.loads(event.split(b'data: ', 1)[1])
+
+    snapshot = payload(first.snapshot_event(vehicle_filter))['vehicles']
+    diff = payload(update.event_for(vehicle_filter, previous.version))
+    assert apply_changes(snapshot, diff['added'] + diff['moved'], diff['removed']) == \
+        {key(record): record for record in payload(update.snapshot_event(vehicle_filter))['vehicles']}
@@ -0,0 +1,184 @@
+import os
+import sys
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.static.gtfs_schedule_numbers import create_schedule_numbers_bus, create_schedule_numbers_tram
+
+# Small bus and tram feeds (routes, trips, calendar) and the schedule numbers
+# the original nested-loop implementation produced for them.
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'schedule_numbers')
+BUILDERS = {
+    'bus': create_schedule_numbers_bus,
+    'tram': create_schedule_numbers_tram,
+}
+
+
+def read_feed(vehicle_type):
+    folder_path = os.path.join(DATA_PATH, vehicle_type)
+    return tuple(pd.read_csv(os.path.join(folder_path, f'{table_name}.txt')) for table_name in ('routes', 'trips', 'calendar'))
+
+
+def read_expected(vehicle_type):
+    return pd.read_csv(os.path.join(DATA_PATH, f'expected_{vehicle_type}.csv'), dtype=str)
+
+
+def schedule_numbers_by_block(schedule_numbers, service_id):
+    rows = schedule_numbers[schedule_numbers['service_id'] == service_id]
+    return dict(zip(rows['block_id'], rows['schedule_number']))
+
+
+# The numbering as it was before it was vectorised, kept as the reference.
+def legacy_schedule_numbers_bus(routes_data, trips_data, calendar_df):
+    route_short_names = routes_data['route_short_name'].drop_duplicates().values.tolist()
+    service_ids = calendar_df['service_id'].tolist()
+    shedule_list = []
+
+    for service_id in service_ids:
+        filtered_trips_data = trips_data[trips_data['service_id'] == service_id]
+        sorted_route_short_names = sorted(route_short_names, key=int)
+        routes_list = []
+        for route_short_name in sorted_route_short_names:
+            route_id = routes_data[routes_data["route_short_name"] == route_short_name]["route_id"].values[0]
+            block_ids = filtered_trips_data[filtered_trips_data['route_id'] == route_id]['block_id'].drop_duplicates().values.tolist()
+            block_numbers = [block.split('_')[1] for block in block_ids]
+            block_numbers.sort(key=int)
+            if len(block_numbers) > 0:
+                routes_list.append({route_short_name: block_numbers})
+        first_key = next(iter(routes_list[0]))
+        first_block_id = int(routes_list[0][first_key][0])
+        last_bloc = first_block_id - 1
+        for route_block in routes_list:
+            for route, blocks in route_block.items():
+                if blocks:
+                    schedule_num = 1
+                    for block in blocks:
+                        if int(block) == last_bloc + 1:
+                            last_bloc = int(block)
+                            shedule_list.append({"block_id": f"block_{block}", "schedule_number": f"{route}/{str(schedule_num).zfill(2)}", "service_id": service_id})
+                            schedule_num += 1
+
+    return pd.DataFrame(shedule_list)
+
+
+def legacy_schedule_numbers_tram(routes_data, trips_data, calendar_df):
+    service_ids = calendar_df['service_id'].tolist()
+    final_schedule_list = []
+    for service_id in service_ids:
+        shedule_list = []
+        block_ids = trips_data[trips_data['service_id'] == service_id]['block_id'].drop_duplicates().values
+        for block_id in block_ids:
+            route_ids = trips_data[trips_data['block_id'] == block_id]['route_id'].drop_duplicates().values
+            if len(route_ids) > 1:
+                route_id = route_ids[-1]
+            else:
+                route_id = route_ids[0]
+            shedule_list.append({"block_id": block_id, "route_id": route_id, "service_id": service_id})
+
+        sorted_objects = sorted(shedule_list, key=itemgetter('route_id', 'block_id'))
+        route_counters = {}
+        for obj in sorted_objects:
+            route_id = obj['route_id']
+            if route_id not in route_counters:
+                route_counters[route_id] = 1
+            route_short_name = routes_data[routes_data["route_id"] == route_id]["route_short_name"].values[0]
+
+            obj['schedule_number'] = f"{route_short_name}/{route_counters[route_id]:02}"
+            route_counters[route_id] += 1
+            del obj['route_id']
+            final_schedule_list.append(obj)
+    return pd.DataFrame(final_schedule_list)
+
+
+LEGACY_BUILDERS = {
+    'bus': legacy_schedule_numbers_bus,
+    'tram': legacy_schedule_numbers_tram,
+}
+
+
+def random_feed(seed):
+    # Routes with one short name used twice, services in shuffled calendar
+    # order, and blocks with gaps in their numbers that run several routes.
+    rng = np.random.default_rng(seed)
+    route_count = int(rng.integers(3, 12))
+    short_names = rng.choice(np.arange(1, 900), route_count, replace=False)
+    route_ids = [f'route_{i}' for i in rng.permutation(route_count * 3)[:route_count]]
+    routes = pd.DataFrame({
+        'route_id': route_ids + ['route_duplicate'],
+        'route_short_name': list(short_names) + [short_names[0]],
+    })
+    service_ids = [f'service_{i}' for i in rng.permutation(6)[:int(rng.integers(1, 4))]]
+    calendar = pd.DataFrame({'service_id': service_ids, 'monday': 1})
+
+    trips = []
+    for service_id in service_ids:
+        # Every service has a block on the first route, as the original
+        # bus numbering fails on services without one.
+        trips.append((f'block_1_trip_0_{service_id}', route_ids[0], service_id, 'block_1'))
+        for block in rng.choice(np.arange(2, 60), int(rng.integers(5, 40)), replace=False):
+            for trip in range(int(rng.integers(1, 4))):
+                route_id = routes['route_id'].values[rng.integers(len(routes))]
+                trips.append((f'block_{block}_trip_{trip}_{service_id}', route_id, service_id, f'block_{block}'))
+    trips = pd.DataFrame(trips, columns=['trip_id', 'route_id', 'service_id', 'block_id'])
+    return routes, trips.sample(frac=1, random_state=seed).reset_index(drop=True), calendar
+
+
+@pytest.mark.parametrize('vehicle_type', ['bus', 'tram'])
+def test_matches_frozen_legacy_output(vehicle_type):
+    schedule_numbers = BUILDERS[vehicle_type](*read_feed(vehicle_type))
+    pd.testing.assert_frame_equal(schedule_numbers.astype(str).reset_index(drop=True), read_expected(vehicle_type))
+
+
+def test_bus_numbers_only_blocks_continuing_the_sequence():
+    schedule_numbers = create_schedule_numbers_bus(*read_feed('bus'))
+
+    # Routes in numeric order of their short name, "2" taking the first of
+    # its two route_ids. block_6 and block_7 break the sequence started by
+    # block_1, and block_3 was already numbered on route 2.
+    assert schedule_numbers_by_block(schedule_numbers, 'service_2') == {
+        'block_1': '2/01',
+        'block_2': '2/02',
+        'block_3': '2/03',
+        'block_4': '10/01',
+        'block_5': '102/01',
+    }
+    # A service starts its own sequence at its lowest block of the first
+    # route it runs, and blocks are compared as numbers.
+    assert schedule_numbers_by_block(schedule_numbers, 'service_1') == {
+        'block_8': '10/01',
+        'block_9': '10/02',
+        'block_10': '10/03',
+        'block_11': '102/01',
+    }
+
+
+def test_tram_blocks_take_their_last_distinct_route():
+    schedule_numbers = create_schedule_numbers_tram(*read_feed('tram'))
+
+    # block_1 runs 1, 3, 1: the last route it switches to is 3. Blocks are
+    # numbered per route in order of block_id as text.
+    assert schedule_numbers_by_block(schedule_numbers, 'service_1') == {
+        'block_10': '1/01',
+        'block_2': '1/02',
+        'block_1': '3/01',
+        'block_3': '52/01',
+    }
+    # Routes of a block are taken from its trips of every service.
+    assert schedule_numbers_by_block(schedule_numbers, 'service_2') == {
+        'block_5': '1/01',
+        'block_1': '3/01',
+        'block_4': '3/02',
+    }
+
+
+@pytest.mark.parametrize('seed', range(25))
+@pytest.mark.parametrize('vehicle_type', ['bus', 'tram'])
+def test_matches_legacy_numbering_on_random_feeds(vehicle_type, seed):
+    routes, trips, calendar = random_feed(seed)
+    expected = LEGACY_BUILDERS[vehicle_type](routes, trips, calendar)
+    schedule_numbers = BUILDERS[vehicle_type](routes, trips, calendar)
+    pd.testing.assert_frame_equal(schedule_numbers.reset_index(drop=True), expected, check_dtype=False)
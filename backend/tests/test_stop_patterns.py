@@ -0,0 +1,177 @@
+import os
+import sys
+import tempfile
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'gtfs_tests.db')}")
+
+import services.static.gtfs_data_loader as gtfs_data_loader
+from services.static.gtfs_processing import get_gtfs_index, get_stop_patterns_for_route, get_stops_list_for_route
+
+ROUTES = {
+    'bus': {'route_1': '101', 'route_2': '102', 'route_3': '103'},
+    'tram': {'route_4': '1', 'route_5': '2'},
+}
+# A stop of the stop times that stops.txt does not list.
+MISSING_STOP_ID = 'stop_99_399999'
+
+
+def write_feed(folder_path, routes, seed):
+    # Routes with a few stop patterns per direction. Patterns visit some
+    # stops twice, loop back to where they started and pass stops missing
+    # from stops.txt; stops come in pairs sharing a name.
+    rng = np.random.default_rng(seed)
+    stop_ids = [f'stop_{i}_{300000 + i * 37}' for i in range(30)]
+    stops = pd.DataFrame({
+        'stop_id': stop_ids,
+        'stop_name': [f'Stop {i // 2}' for i in range(len(stop_ids))],
+        'stop_lat': rng.uniform(50.0, 50.1, len(stop_ids)),
+        'stop_lon': rng.uniform(19.8, 20.0, len(stop_ids)),
+    })
+
+    trips, stop_times, shapes = [], [], []
+    block = 0
+    for route_id in routes:
+        for direction_id in (0, 1):
+            for pattern in range(int(rng.integers(1, 4))):
+                sequence = list(rng.choice(stop_ids, int(rng.integers(3, 9))))
+                if rng.random() < 0.5:
+                    sequence.insert(int(rng.integers(len(sequence))), MISSING_STOP_ID)
+                if rng.random() < 0.5:
+                    sequence.append(sequence[0])
+                shape_id = f'shape_{route_id}_{direction_id}_{pattern}'
+                shapes += [(shape_id, 50.0, 19.9, 1), (shape_id, 50.1, 20.0, 2)]
+                headsign = f'Headsign {route_id} {direction_id} {int(rng.integers(2))}'
+                for _ in range(int(rng.integers(2, 7))):
+                    block += 1
+                    for trip_number in range(1, int(rng.integers(2, 5))):
+                        trip_id = f'block_{block}_trip_{trip_number}_service_1'
+                        trips.append((trip_id, route_id, 'service_1', headsign, direction_id, shape_id, f'block_{block}'))
+                        for stop_sequence, stop_id in enumerate(sequence, start=1):
+                            time = f'{5 + trip_number:02}:{stop_sequence:02}:00'
+                            stop_times.append((trip_id, time, time, stop_id, stop_sequence))
+
+    os.makedirs(folder_path)
+    stops.to_csv(os.path.join(folder_path, 'stops.txt'), index=False)
+    pd.DataFrame({'route_id': list(routes), 'route_short_name': list(routes.values())}).to_csv(
+        os.path.join(folder_path, 'routes.txt'), index=False)
+    pd.DataFrame(trips, columns=['trip_id', 'route_id', 'service_id', 'trip_headsign', 'direction_id', 'shape_id', 'block_id']).to_csv(
+        os.path.join(folder_path, 'trips.txt'), index=False)
+    pd.DataFrame(stop_times, columns=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence']).to_csv(
+        os.path.join(folder_path, 'stop_times.txt'), index=False)
+    pd.DataFrame(shapes, columns=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']).to_csv(
+        os.path.join(folder_path, 'shapes.txt'), index=False)
+    pd.DataFrame([{'service_id': 'service_1', 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1, 'friday': 1,
+                   'saturday': 0, 'sunday': 0, 'start_date': 20260101, 'end_date': 20261231}]).to_csv(
+        os.path.join(folder_path, 'calendar.txt'), index=False)
+
+
+# The stop list of a route as it was built before stop patterns, from the
+# raw tables: the longest stop list among the first trip of every shape.
+def legacy_stops_list_for_route(folder_path, route_id, vehicle_type, route_number):
+    trips = pd.read_csv(os.path.join(folder_path, 'trips.txt')).set_index('trip_id')
+    stop_times = pd.read_csv(os.path.join(folder_path, 'stop_times.txt'))
+    stops = pd.read_csv(os.path.join(folder_path, 'stops.txt'))
+    stops['stop_name'] = gtfs_data_loader.stop_display_names(stops['stop_id'], stops['stop_name'], vehicle_type)
+    trips_for_route = trips[trips['route_id'] == route_id]
+
+    direction_ids = [0, 1]
+    for direction_id in direction_ids:
+        filtered_trips = trips_for_route[trips_for_route['direction_id'] == direction_id]
+
+    if len(route_number) <= 2:
+        test_number = len(filtered_trips['block_id'].drop_duplicates()) + 1
+    else:
+        test_number = 1
+
+    grouped_directions_dict = {}
+    for direction_id in direction_ids:
+        filtered_trips = trips_for_route[trips_for_route['direction_id'] == direction_id]['trip_headsign'].values
+        trip_headsign_counts = Counter(filtered_trips)
+        grouped_directions_dict[direction_id] = [trip_headsign for trip_headsign, count in trip_headsign_counts.items() if count > test_number]
+
+    for direction_id, trip_headsigns in grouped_directions_dict.items():
+        longest_stops_dict_length = 0
+        longest_stops_dict = None
+        for trip_headsign in trip_headsigns:
+            filtered_trips = trips_for_route[trips_for_route['trip_headsign'] == trip_headsign]
+            if filtered_trips.empty:
+                continue
+            trip_ids = filtered_trips['shape_id'].drop_duplicates().index
+            for trip_id in trip_ids:
+                trip_number = trip_id.split("_")[3]
+                if trip_number == '1':
+                    continue
+                stop_times_with_correct_trip_id = stop_times[stop_times['trip_id'] == trip_id]
+                stops_for_all_trips = stop_times_with_correct_trip_id.merge(stops, on='stop_id', how='inner')
+                stops_dict = stops_for_all_trips[['stop_id', 'stop_name']].drop_duplicates().to_dict(orient='records')
+                if len(stops_dict) > longest_stops_dict_length:
+                    longest_stops_dict_length = len(stops_dict)
+                    longest_stops_dict = stops_dict
+
+        grouped_directions_dict[direction_id] = [trip_headsigns, longest_stops_dict]
+    return grouped_directions_dict
+
+
+@pytest.fixture(params=range(5))
+def feed(request, tmp_path, monkeypatch):
+    for vehicle_type, routes in ROUTES.items():
+        write_feed(str(tmp_path / vehicle_type), routes, request.param)
+    monkeypatch.setattr(gtfs_data_loader, 'GTFS_DATA_PATH', str(tmp_path))
+    gtfs_data = gtfs_data_loader.build_feed_data('bus', 'a')
+    gtfs_data.update(gtfs_data_loader.build_feed_data('tram', 't'))
+    return str(tmp_path), gtfs_data
+
+
+def test_patterns_keep_the_full_stop_sequence(feed):
+    folder_path, gtfs_data = feed
+    for vehicle_type in ROUTES:
+        stop_times = pd.read_csv(os.path.join(folder_path, vehicle_type, 'stop_times.txt'))
+        stop_names = gtfs_data_loader.read_feed_tables(vehicle_type)['stops'].set_index('stop_id')['stop_display_name']
+        gtfs_index = get_gtfs_index(gtfs_data, vehicle_type)
+        for trip_id, trip_stop_times in stop_times.groupby('trip_id', sort=False):
+            expected = [
+                {'stop_id': stop_id, 'stop_name': stop_names.get(stop_id)}
+                for stop_id in trip_stop_times['stop_id']
+            ]
+            assert gtfs_index.stop_patterns.trip_stops(gtfs_index.trip_position(trip_id)) == expected
+
+
+def test_patterns_of_a_route_list_repeated_and_unknown_stops(feed):
+    folder_path, gtfs_data = feed
+    repeated = unknown = 0
+    for vehicle_type, routes in ROUTES.items():
+        trips = pd.read_csv(os.path.join(folder_path, vehicle_type, 'trips.txt'))
+        stop_times = pd.read_csv(os.path.join(folder_path, vehicle_type, 'stop_times.txt'))
+        for route_id, route_number in routes.items():
+            route_trip_ids = trips.loc[trips['route_id'] == route_id, 'trip_id']
+            route_stop_times = stop_times[stop_times['trip_id'].isin(route_trip_ids)]
+            sequences = {tuple(group['stop_id']) for _, group in route_stop_times.groupby('trip_id')}
+            patterns = [pattern for directions in get_stop_patterns_for_route(gtfs_data, route_number).values() for pattern in directions]
+            assert {tuple(stop['stop_id'] for stop in pattern['stops']) for pattern in patterns} == sequences
+            for pattern in patterns:
+                stop_ids = [stop['stop_id'] for stop in pattern['stops']]
+                repeated += len(stop_ids) > len(set(stop_ids))
+                unknown += MISSING_STOP_ID in stop_ids
+    assert repeated and unknown
+
+
+def test_stops_list_for_route_matches_legacy_output(feed):
+    folder_path, gtfs_data = feed
+    for vehicle_type, routes in ROUTES.items():
+        for route_id, route_number in routes.items():
+            expected = legacy_stops_list_for_route(os.path.join(folder_path, vehicle_type), route_id, vehicle_type, route_number)
+            assert get_stops_list_for_route(gtfs_data, route_number) == expected
+
+
+def test_stops_lists_are_built_at_load_and_read_only(feed):
+    _, gtfs_data = feed
+    for vehicle_type, routes in ROUTES.items():
+        route_stops = get_gtfs_index(gtfs_data, vehicle_type).route_stops
+        assert set(route_stops) == set(routes)
+        with pytest.raises(TypeError):
+            route_stops['route_1'] = {}
@@ -2,41 +2,46 @@ import { useEffect, useState } from 'react';
 
 const API_URL = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
 
+interface Vehicle {
+  vehicle_id: string;
+}
+
 const useRealtimeData = () => {
-  const [realtimeData, setRealtimeData] = useState([]);
+  const [realtimeData, setRealtimeData] = useState<Vehicle[]>([]);
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
 
   useEffect(() => {
-    const fetchRealtimeData = async () => {
-      try {
-        setLoading(true); 
-        const response = await fetch(`${API_URL}/api/realtime/vehicles`);
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch data');
-        }
-        const data = await response.json();
-        setRealtimeData(data);
-      } catch (error) {
-        if (error instanceof Error) {
-          setError(error.message);
-        } else {
-          setError('An unknown error occurred');
-        }
-      } finally {
-        setLoading(false); 
-      }
+    // The server sends the whole fleet once, then only added, moved and
+    // removed vehicles for every ingestion cycle.
+    const vehicles = new Map<string, Vehicle>();
+    const eventSource = new EventSource(`${API_URL}/api/realtime/stream`);
+
+    eventSource.addEventListener('snapshot', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      vehicles.clear();
+      data.vehicles.forEach((vehicle: Vehicle) => vehicles.set(vehicle.vehicle_id, vehicle));
+      setRealtimeData(Array.from(vehicles.values()));
+      setError(null);
+      setLoading(false);
+    });
+
+    eventSource.addEventListener('diff', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      data.added.forEach((vehicle: Vehicle) => vehicles.set(vehicle.vehicle_id, vehicle));
+      data.moved.forEach((vehicle: Vehicle) => vehicles.set(vehicle.vehicle_id, vehicle));
+      data.removed.forEach((vehicleId: string) => vehicles.delete(vehicleId));
+      setRealtimeData(Array.from(vehicles.values()));
+    });
+
+    eventSource.onerror = () => {
+      // EventSource reconnects on its own and the server starts the new
+      // connection with a full snapshot.
+      setError('Lost connection to real-time data');
     };
 
-    fetchRealtimeData();
-
-    const intervalId = setInterval(() => {
-      fetchRealtimeData();
-    }, 20000);
-
-    return () => clearInterval(intervalId);
-  }, []); 
+    return () => eventSource.close();
+  }, []);
 
   return { realtimeData, loading, error };
 };